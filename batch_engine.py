@@ -0,0 +1,507 @@
+# batch_engine.py
+
+import copy
+
+import numpy as np
+
+from game_environment import PrisonersDilemma, MatchHistory
+from rl_agents import QLearningAgent, LinearQAgent, LinearFeatures
+from classic_strategies import (
+    AlwaysCooperate, AlwaysCheat, TitForTat, Grudger, Pavlov, RandomStrategy,
+    TitForTwoTats, TwoTitsForTat, GenerousTitForTat, AdaptiveTitForTat
+)
+from strategy_fsm import is_deterministic, fast_forward_match
+from rng import RandomStream, MATCH_STREAMS, derive_seed, seed_agent
+
+COOPERATE = PrisonersDilemma.COOPERATE
+CHEAT = PrisonersDilemma.CHEAT
+EMPTY = -1 # Padding value for history windows, same as PrisonersDilemma.get_state
+
+
+class SeededDraws:
+    """
+    One RandomStream per match, for one of the match's streams (rng.MATCH_STREAMS: a player's or the
+    noise's). Each match consumes it in exactly the order the agent (or the environment) consumes
+    its own stream in `run_match`, so a batch seeded with [s_0, ..., s_n] reproduces
+    `run_match(..., seed=s_k)` for every k.
+    """
+    exact = True
+
+    def __init__(self, seeds, stream: str):
+        self.seeds = [derive_seed(seed, stream) for seed in seeds]
+        self.streams = [RandomStream(seed) for seed in self.seeds]
+
+    def uniform(self, matches: np.ndarray) -> np.ndarray:
+        streams = self.streams
+        return np.fromiter((streams[k].uniform() for k in matches), dtype=np.float64, count=len(matches))
+
+    def choice(self, matches: np.ndarray) -> np.ndarray:
+        # The agents' random choice: CHEAT if a uniform draw is below 0.5
+        return (self.uniform(matches) < 0.5).astype(np.int8)
+
+    def agent_seed(self, match: int):
+        """The seed run_match gives the agent in this match (see rng.seed_match)."""
+        return self.seeds[match]
+
+
+class GeneratorDraws:
+    """Vectorized draws from a single numpy Generator shared by the whole batch."""
+    exact = False
+
+    def __init__(self, rng: np.random.Generator):
+        self.rng = rng
+
+    def uniform(self, matches: np.ndarray) -> np.ndarray:
+        return self.rng.random(len(matches))
+
+    def choice(self, matches: np.ndarray) -> np.ndarray:
+        return self.rng.integers(0, 2, size=len(matches), dtype=np.int8)
+
+    def agent_seed(self, match: int):
+        """A fresh seed for an agent copy playing in this match."""
+        return int(self.rng.integers(2 ** 63))
+
+
+class BatchPolicy:
+    """
+    Vectorized counterpart of an agent, playing one side of a subset of the batch's matches.
+    Per-match state lives in arrays aligned with `matches`.
+    """
+    def __init__(self, agent, matches: np.ndarray, memory_length: int):
+        self.agent = agent
+        self.matches = matches          # Match indices this policy plays in
+        self.size = len(matches)
+        self.memory_length = memory_length
+
+    def act(self, own_window: np.ndarray, opp_window: np.ndarray, draws) -> np.ndarray:
+        """
+        Chooses actions for all of this policy's matches.
+        :param own_window: (size, memory_length) array of own last moves, padded with EMPTY.
+        :param opp_window: (size, memory_length) array of opponent's last moves, padded with EMPTY.
+        :param draws: Source of random numbers for stochastic policies.
+        :return: int8 array of actions.
+        """
+        raise NotImplementedError
+
+    def observe(self, own_actions: np.ndarray, opp_actions: np.ndarray):
+        """Called after every round with the actions just played."""
+        pass
+
+    def bind(self, draws):
+        """Called once before the first round with the draws this policy will be given."""
+        pass
+
+
+class _ConstantPolicy(BatchPolicy):
+    def __init__(self, agent, matches, memory_length, action):
+        super().__init__(agent, matches, memory_length)
+        self.actions = np.full(self.size, action, dtype=np.int8)
+
+    def act(self, own_window, opp_window, draws):
+        return self.actions
+
+
+class _TitForTatPolicy(BatchPolicy):
+    def act(self, own_window, opp_window, draws):
+        if self.memory_length == 0:
+            return np.zeros(self.size, dtype=np.int8)
+        return (opp_window[:, -1] == CHEAT).astype(np.int8)
+
+
+class _GrudgerPolicy(BatchPolicy):
+    def __init__(self, agent, matches, memory_length):
+        super().__init__(agent, matches, memory_length)
+        self.grudge = np.zeros(self.size, dtype=bool)
+
+    def act(self, own_window, opp_window, draws):
+        # Every move is the newest entry of the window for one round, so checking the last
+        # move each round is equivalent to Grudger's `CHEAT in opponent_history` scan.
+        if self.memory_length > 0:
+            self.grudge |= opp_window[:, -1] == CHEAT
+        return self.grudge.astype(np.int8)
+
+
+class _PavlovPolicy(BatchPolicy):
+    def __init__(self, agent, matches, memory_length):
+        super().__init__(agent, matches, memory_length)
+        self.last_own = np.full(self.size, EMPTY, dtype=np.int8)
+        self.last_opponent = np.full(self.size, EMPTY, dtype=np.int8)
+
+    def act(self, own_window, opp_window, draws):
+        stay = self.last_own == self.last_opponent
+        actions = np.where(stay, self.last_own, 1 - self.last_own).astype(np.int8)
+        actions[self.last_own == EMPTY] = COOPERATE
+        return actions
+
+    def observe(self, own_actions, opp_actions):
+        self.last_own[:] = own_actions
+        self.last_opponent[:] = opp_actions
+
+
+class _RandomPolicy(BatchPolicy):
+    def act(self, own_window, opp_window, draws):
+        return draws.choice(self.matches)
+
+
+class _TitForTwoTatsPolicy(BatchPolicy):
+    def act(self, own_window, opp_window, draws):
+        if self.memory_length < 2:
+            return np.zeros(self.size, dtype=np.int8)
+        return ((opp_window[:, -1] == CHEAT) & (opp_window[:, -2] == CHEAT)).astype(np.int8)
+
+
+class _TwoTitsForTatPolicy(BatchPolicy):
+    def __init__(self, agent, matches, memory_length):
+        super().__init__(agent, matches, memory_length)
+        self.punish_count = np.zeros(self.size, dtype=np.int64)
+
+    def act(self, own_window, opp_window, draws):
+        punishing = self.punish_count > 0
+        self.punish_count[punishing] -= 1
+        if self.memory_length == 0:
+            return punishing.astype(np.int8)
+        provoked = ~punishing & (opp_window[:, -1] == CHEAT)
+        self.punish_count[provoked] = 1
+        return (punishing | provoked).astype(np.int8)
+
+
+class _ForgivingPolicy(BatchPolicy):
+    """TitForTat that forgives a defection with a per-match probability (GenerousTitForTat)."""
+    def __init__(self, agent, matches, memory_length):
+        super().__init__(agent, matches, memory_length)
+        self.forgiveness = np.full(self.size, agent.forgiveness_prob, dtype=np.float64)
+
+    def act(self, own_window, opp_window, draws):
+        actions = np.zeros(self.size, dtype=np.int8)
+        if self.memory_length == 0:
+            return actions
+        provoked = np.flatnonzero(opp_window[:, -1] == CHEAT)
+        if len(provoked):
+            forgive = draws.uniform(self.matches[provoked]) < self.forgiveness[provoked]
+            actions[provoked[~forgive]] = CHEAT
+        return actions
+
+
+class _AdaptiveTitForTatPolicy(_ForgivingPolicy):
+    def __init__(self, agent, matches, memory_length):
+        BatchPolicy.__init__(self, agent, matches, memory_length)
+        self.forgiveness = np.zeros(self.size, dtype=np.float64) # AdaptiveTitForTat.reset()
+        self.learning_rate = agent.learning_rate
+
+    def observe(self, own_actions, opp_actions):
+        cooperated = opp_actions == COOPERATE
+        self.forgiveness = np.where(cooperated,
+                                    np.minimum(1.0, self.forgiveness + self.learning_rate),
+                                    np.maximum(0.0, self.forgiveness - self.learning_rate))
+
+
+class _QLearningPolicy(BatchPolicy):
+    """Fixed (non-learning) epsilon-greedy policy read from a QLearningAgent's Q-table."""
+    def __init__(self, agent, matches, memory_length):
+        super().__init__(agent, matches, memory_length)
+        self.epsilon = agent.epsilon
+        self.greedy_actions = greedy_action_table(agent, memory_length)
+        self.digit_weights = 3 ** np.arange(2 * memory_length - 1, -1, -1, dtype=np.int64)
+
+    def act(self, own_window, opp_window, draws):
+        if self.memory_length:
+            digits = np.concatenate((own_window, opp_window), axis=1).astype(np.int64) + 1
+            actions = self.greedy_actions[digits @ self.digit_weights]
+        else:
+            actions = np.repeat(self.greedy_actions, self.size)
+        # choose_action always draws once, even with epsilon 0; mirror that in exact mode
+        if self.epsilon > 0 or draws.exact:
+            explore = np.flatnonzero(draws.uniform(self.matches) < self.epsilon)
+            if len(explore):
+                actions[explore] = draws.choice(self.matches[explore])
+        return actions
+
+
+class _LinearQPolicy(BatchPolicy):
+    """Fixed (non-learning) epsilon-greedy policy of a LinearQAgent, with the features of all its matches in one array."""
+    def __init__(self, agent, matches, memory_length):
+        super().__init__(agent, matches, memory_length)
+        self.epsilon = agent.epsilon
+        self.weights = agent.weights.copy()
+        self.features = LinearFeatures(agent.memory_length, self.size, agent.streak_cap)
+
+    def act(self, own_window, opp_window, draws):
+        q_values = self.features.X @ self.weights.T
+        actions = (q_values[:, COOPERATE] < q_values[:, CHEAT]).astype(np.int8)
+        # choose_action always draws once, even with epsilon 0; mirror that in exact mode
+        if self.epsilon > 0 or draws.exact:
+            explore = np.flatnonzero(draws.uniform(self.matches) < self.epsilon)
+            if len(explore):
+                actions[explore] = draws.choice(self.matches[explore])
+        return actions
+
+    def observe(self, own_actions, opp_actions):
+        self.features.push(own_actions, opp_actions)
+
+
+class _ObjectPolicy(BatchPolicy):
+    """
+    Fallback for strategies without a vectorized policy: one copy of the agent per match,
+    driven round by round through `choose_action` and `observe` like `run_match` does, each
+    with its own MatchHistory of the opponent's moves.
+    Each copy draws from its own stream, seeded from the batch's draws (in an exact batch, the
+    stream run_match would give the agent).
+    """
+    def __init__(self, agent, matches, memory_length):
+        super().__init__(agent, matches, memory_length)
+        self.copies = [copy.deepcopy(agent) for _ in range(self.size)]
+        for a in self.copies:
+            a.reset()
+        self.histories = [MatchHistory(window=memory_length, log=False) for _ in range(self.size)]
+        self.observers = [getattr(a, "observe", None) for a in self.copies]
+
+    def bind(self, draws):
+        # Copies of one agent would otherwise all replay its stream
+        for a, match in zip(self.copies, self.matches.tolist()):
+            seed_agent(a, draws.agent_seed(match))
+
+    def act(self, own_window, opp_window, draws):
+        actions = np.empty(self.size, dtype=np.int8)
+        for k, a in enumerate(self.copies):
+            actions[k] = a.choose_action(self.histories[k])
+        return actions
+
+    def observe(self, own_actions, opp_actions):
+        for history, observe, own, opp in zip(self.histories, self.observers, own_actions.tolist(), opp_actions.tolist()):
+            history.append(opp)
+            if observe is not None:
+                observe(own, opp)
+
+
+BATCH_POLICIES = {
+    AlwaysCooperate: lambda agent, matches, m: _ConstantPolicy(agent, matches, m, COOPERATE),
+    AlwaysCheat: lambda agent, matches, m: _ConstantPolicy(agent, matches, m, CHEAT),
+    TitForTat: _TitForTatPolicy,
+    Grudger: _GrudgerPolicy,
+    Pavlov: _PavlovPolicy,
+    RandomStrategy: _RandomPolicy,
+    TitForTwoTats: _TitForTwoTatsPolicy,
+    TwoTitsForTat: _TwoTitsForTatPolicy,
+    GenerousTitForTat: _ForgivingPolicy,
+    AdaptiveTitForTat: _AdaptiveTitForTatPolicy,
+    QLearningAgent: _QLearningPolicy,
+    LinearQAgent: _LinearQPolicy,
+}
+
+
+def make_policy(agent, matches: np.ndarray, memory_length: int) -> BatchPolicy:
+    """
+    Builds the vectorized policy for `agent` over the given match indices.
+    Strategies registered in BATCH_POLICIES get an array implementation; any other agent that
+    chooses from the opponent's history (see match_kernels.py) falls back to driving per-match
+    copies of the agent.
+    """
+    factory = BATCH_POLICIES.get(type(agent))
+    if factory is not None:
+        return factory(agent, matches, memory_length)
+    if callable(getattr(agent, "choose_action", None)) and getattr(agent, "observes", "history") == "history":
+        return _ObjectPolicy(agent, matches, memory_length)
+    raise TypeError(f"Unknown agent type: {type(agent)}")
+
+
+def greedy_action_table(agent: QLearningAgent, memory_length: int) -> np.ndarray:
+    """
+    Greedy action for every possible state of a Q-table, indexed by the integer state code
+    (PrisonersDilemma.encode_state). Unvisited states default to COOPERATE, like a fresh
+    [0.0, 0.0] entry does.
+    """
+    if agent.dense:
+        if agent.memory_length != memory_length:
+            raise ValueError(f"{agent.name} has a dense Q-table for memory_length={agent.memory_length}, "
+                             f"not {memory_length}.")
+        return (agent.q_table[:, COOPERATE] < agent.q_table[:, CHEAT]).astype(np.int8)
+    table = np.zeros(3 ** (2 * memory_length), dtype=np.int8)
+    for state, q_values in agent.q_table.items():
+        if q_values[COOPERATE] < q_values[CHEAT]:
+            table[PrisonersDilemma.encode_state(state)] = CHEAT
+    return table
+
+
+def _group_policies(agents, memory_length: int) -> list:
+    groups = {}
+    for k, agent in enumerate(agents):
+        groups.setdefault(id(agent), (agent, []))[1].append(k)
+    return [make_policy(agent, np.array(matches, dtype=np.int64), memory_length)
+            for agent, matches in groups.values()]
+
+
+def run_batch(agents1, agents2, num_rounds: int, env: PrisonersDilemma,
+              seeds=None, rng: np.random.Generator = None, record_rounds: bool = False):
+    """
+    Plays len(agents1) independent matches in lockstep, match k being agents1[k] vs agents2[k].
+    Agents are only read, never mutated: the same object may appear in many matches.
+    Pairings of two deterministic agents are played once, by cycle detection on their
+    compiled finite-state machines, and the result is shared by all their matches (unless the
+    environment has execution noise).
+    :param agents1: Sequence of player-1 agents, one per match.
+    :param agents2: Sequence of player-2 agents, one per match.
+    :param num_rounds: Number of rounds in each match.
+    :param env: The game environment (its memory_length sets the history window).
+    :param seeds: Optional per-match seeds. Match k then reproduces
+                  `run_match(agents1[k], agents2[k], ..., seed=seeds[k])` exactly.
+    :param rng: numpy Generator for unseeded (vectorized) draws. Ignored if seeds is given.
+    :param record_rounds: If True, also return the (matches, rounds) per-round rewards.
+    :return: (agent1_scores, agent2_scores, agent1_round_scores, agent2_round_scores);
+             the round score arrays are None unless record_rounds is set.
+    """
+    num_matches = len(agents1)
+    if len(agents2) != num_matches:
+        raise ValueError("agents1 and agents2 must have the same length.")
+    if seeds is not None and len(seeds) != num_matches:
+        raise ValueError("Need exactly one seed per match.")
+
+    deterministic_pairings = {}
+    stochastic_matches = []
+    for k, (agent1, agent2) in enumerate(zip(agents1, agents2)):
+        pairing = (id(agent1), id(agent2))
+        if pairing in deterministic_pairings:
+            deterministic_pairings[pairing][2].append(k)
+        elif not env.noise and is_deterministic(agent1) and is_deterministic(agent2):
+            deterministic_pairings[pairing] = (agent1, agent2, [k])
+        else:
+            stochastic_matches.append(k)
+
+    if not deterministic_pairings:
+        return _run_lockstep(agents1, agents2, num_rounds, env, seeds, rng, record_rounds)
+
+    scores1 = np.zeros(num_matches, dtype=np.int64)
+    scores2 = np.zeros(num_matches, dtype=np.int64)
+    round_scores1 = np.empty((num_matches, num_rounds), dtype=np.int8) if record_rounds else None
+    round_scores2 = np.empty((num_matches, num_rounds), dtype=np.int8) if record_rounds else None
+
+    for agent1, agent2, matches in deterministic_pairings.values():
+        s1, s2, rs1, rs2 = fast_forward_match(agent1, agent2, num_rounds, env, record_rounds=record_rounds)
+        scores1[matches] = s1
+        scores2[matches] = s2
+        if record_rounds:
+            round_scores1[matches] = rs1
+            round_scores2[matches] = rs2
+
+    if stochastic_matches:
+        rest = np.array(stochastic_matches, dtype=np.int64)
+        s1, s2, rs1, rs2 = _run_lockstep([agents1[k] for k in stochastic_matches],
+                                         [agents2[k] for k in stochastic_matches], num_rounds, env,
+                                         None if seeds is None else [seeds[k] for k in stochastic_matches],
+                                         rng, record_rounds)
+        scores1[rest] = s1
+        scores2[rest] = s2
+        if record_rounds:
+            round_scores1[rest] = rs1
+            round_scores2[rest] = rs2
+
+    return scores1, scores2, round_scores1, round_scores2
+
+
+def _run_lockstep(agents1, agents2, num_rounds, env, seeds, rng, record_rounds):
+    """Round-by-round vectorized play of all matches; see run_batch."""
+    num_matches = len(agents1)
+    if seeds is not None:
+        draws1, draws2, noise_draws = (SeededDraws(seeds, stream) for stream in MATCH_STREAMS)
+    else:
+        draws1 = draws2 = noise_draws = GeneratorDraws(rng if rng is not None else np.random.default_rng())
+    noise = env.noise
+    all_matches = np.arange(num_matches)
+
+    memory_length = env.memory_length
+    payoffs = env.PAYOFF_MATRIX
+    policies1 = _group_policies(agents1, memory_length)
+    policies2 = _group_policies(agents2, memory_length)
+    single1 = len(policies1) == 1
+    single2 = len(policies2) == 1
+    for policy in policies1:
+        policy.bind(draws1)
+    for policy in policies2:
+        policy.bind(draws2)
+
+    window1 = np.full((num_matches, memory_length), EMPTY, dtype=np.int8)
+    window2 = np.full((num_matches, memory_length), EMPTY, dtype=np.int8)
+    actions1 = np.empty(num_matches, dtype=np.int8)
+    actions2 = np.empty(num_matches, dtype=np.int8)
+    scores1 = np.zeros(num_matches, dtype=np.int64)
+    scores2 = np.zeros(num_matches, dtype=np.int64)
+    round_scores1 = np.empty((num_matches, num_rounds), dtype=np.int8) if record_rounds else None
+    round_scores2 = np.empty((num_matches, num_rounds), dtype=np.int8) if record_rounds else None
+
+    for round_num in range(num_rounds):
+        # A single policy covering every match needs no gather/scatter
+        if single1:
+            actions1[:] = policies1[0].act(window1, window2, draws1)
+        else:
+            for policy in policies1:
+                m = policy.matches
+                actions1[m] = policy.act(window1[m], window2[m], draws1)
+        if single2:
+            actions2[:] = policies2[0].act(window2, window1, draws2)
+        else:
+            for policy in policies2:
+                m = policy.matches
+                actions2[m] = policy.act(window2[m], window1[m], draws2)
+        if noise: # Trembling hand, in PrisonersDilemma.trembling's order: player 1's flip, then player 2's
+            actions1 ^= (noise_draws.uniform(all_matches) < noise).astype(np.int8)
+            actions2 ^= (noise_draws.uniform(all_matches) < noise).astype(np.int8)
+
+        rewards = payoffs[actions1, actions2]
+        scores1 += rewards[:, 0]
+        scores2 += rewards[:, 1]
+        if record_rounds:
+            round_scores1[:, round_num] = rewards[:, 0]
+            round_scores2[:, round_num] = rewards[:, 1]
+
+        for policy in policies1:
+            m = policy.matches
+            policy.observe(actions1 if single1 else actions1[m], actions2 if single1 else actions2[m])
+        for policy in policies2:
+            m = policy.matches
+            policy.observe(actions2 if single2 else actions2[m], actions1 if single2 else actions1[m])
+
+        if memory_length:
+            window1[:, :-1] = window1[:, 1:]
+            window1[:, -1] = actions1
+            window2[:, :-1] = window2[:, 1:]
+            window2[:, -1] = actions2
+
+    return scores1, scores2, round_scores1, round_scores2
+
+
+def run_match_batch(agent1, agent2, num_matches: int, num_rounds: int, env: PrisonersDilemma,
+                    seeds=None, rng: np.random.Generator = None, record_rounds: bool = False):
+    """
+    Plays `num_matches` independent matches of the same pairing in lockstep.
+    See run_batch for the parameters and return value.
+    """
+    return run_batch([agent1] * num_matches, [agent2] * num_matches, num_rounds, env,
+                     seeds=seeds, rng=rng, record_rounds=record_rounds)
+
+
+# Example Usage (checks the batch engine against run_match)
+if __name__ == "__main__":
+    from main import run_match
+
+    env = PrisonersDilemma(memory_length=1)
+    agents = [AlwaysCooperate(), AlwaysCheat(), TitForTat(), Grudger(), Pavlov(), RandomStrategy(),
+              TitForTwoTats(), TwoTitsForTat(), GenerousTitForTat(), AdaptiveTitForTat()]
+    seeds = list(range(20))
+
+    for a1 in agents:
+        for a2 in agents:
+            batch_scores, _, _, _ = run_match_batch(a1, a2, len(seeds), 50, env, seeds=seeds)
+            opponent = copy.deepcopy(a2) # run_match needs two objects to give the players two streams
+            serial_scores = [run_match(a1, opponent, 50, env, seed=seed)[0] for seed in seeds]
+            status = "OK" if batch_scores.tolist() == serial_scores else "MISMATCH"
+            print(f"{a1.name} vs {a2.name}: {status} (mean {batch_scores.mean():.2f})")
+
+    # With memory_length 0 nothing is visible, so Grudger must never grudge in any engine
+    from markov_eval import expected_scores
+    blind_env = PrisonersDilemma(memory_length=0)
+    for opponent in (AlwaysCheat(), TitForTat(), Pavlov()):
+        serial = run_match(Grudger(), opponent, 50, blind_env, seed=0)[:2]
+        batch = tuple(int(scores[0]) for scores in run_match_batch(Grudger(), opponent, 1, 50, blind_env, seeds=[0])[:2])
+        fsm = fast_forward_match(Grudger(), opponent, 50, blind_env)[:2]
+        markov = expected_scores(Grudger(), opponent, 50, blind_env)
+        status = "OK" if serial == batch == tuple(fsm) == markov else "MISMATCH"
+        print(f"Grudger vs {opponent.name} (memory 0, serial/batch/FSM/Markov): {status} {serial}")
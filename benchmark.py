@@ -0,0 +1,259 @@
+# benchmark.py
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from game_environment import PrisonersDilemma, MatchHistory
+from rl_agents import QLearningAgent, LinearQAgent
+from classic_strategies import (
+    AlwaysCooperate, AlwaysCheat, TitForTat, Grudger, Pavlov, RandomStrategy,
+    TitForTwoTats, TwoTitsForTat, GenerousTitForTat, AdaptiveTitForTat
+)
+
+DEFAULT_THRESHOLD = 0.10 # Flag a benchmark when its rate drops by more than 10% against the baseline
+
+
+def _history(memory_length: int, moves: int = 16) -> MatchHistory:
+    rng = random.Random(0)
+    history = MatchHistory(window=memory_length)
+    for _ in range(moves):
+        history.append(rng.choice(PrisonersDilemma.ACTIONS))
+    return history
+
+
+def _get_state(memory_length):
+    env = PrisonersDilemma(memory_length=memory_length)
+    h1, h2 = _history(memory_length), _history(memory_length)
+    def run(n):
+        for _ in range(n):
+            env.get_state(h1, h2)
+    return run
+
+def _play_round():
+    env = PrisonersDilemma()
+    def run(n):
+        for _ in range(n):
+            env.play_round(0, 1)
+    return run
+
+def _choose_action(strategy_class):
+    strategy = strategy_class()
+    history = _history(memory_length=2)
+    def run(n):
+        strategy.reset()
+        for _ in range(n):
+            strategy.choose_action(history)
+    return run
+
+def _q_learning(memory_length, dense, planning_steps=0):
+    env = PrisonersDilemma(memory_length=memory_length)
+    agent = QLearningAgent(memory_length=memory_length if dense else None, planning_steps=planning_steps)
+    rng = random.Random(0)
+    states = [env.get_state(_history(memory_length, moves=k), _history(memory_length, moves=k + 1))
+              for k in range(8)]
+    if dense:
+        states = [env.encode_state(state) for state in states]
+    def run(n):
+        for i in range(n):
+            state = states[i & 7]
+            action = agent.choose_action(state)
+            agent.learn(state, action, rng.choice((0, 1, 3, 5)), states[(i + 1) & 7])
+    return run
+
+def _run_match(num_rounds, memory_length, training, record="compact"):
+    from main import run_match
+    from traces import TraceWriter
+    env = PrisonersDilemma(memory_length=memory_length)
+    agent = QLearningAgent(memory_length=memory_length)
+    opponent = TitForTat()
+    writer = TraceWriter(os.path.join(tempfile.mkdtemp(), "trace.bin")) if record == "streaming" else None
+    def run(n):
+        for _ in range(max(1, n // num_rounds)):
+            run_match(agent, opponent, num_rounds, env, is_training=training, record=record, trace_writer=writer)
+    return run
+
+def _batched_training(learner, memory_length):
+    from training import train_q_agent_batched, train_linear_agent_batched
+    opponents = [TitForTat(), AlwaysCheat(), Pavlov(), RandomStrategy(), GenerousTitForTat()]
+    def run(n):
+        rng = np.random.default_rng(0)
+        env = PrisonersDilemma(memory_length=memory_length) # Opponents see as far back as the learner
+        if learner == "linear":
+            train_linear_agent_batched(LinearQAgent(memory_length=memory_length), opponents, max(1, n // 50), 50,
+                                       env, rng=rng, verbose=False)
+        else: # The Q-table (3^(2m) rows) is allocated inside the timed run, as training would
+            train_q_agent_batched(QLearningAgent(memory_length=memory_length), opponents, max(1, n // 50), 50,
+                                  env, rng=rng, verbose=False)
+    return run
+
+def _match_server(clients, players):
+    import asyncio
+    from match_server import load_test
+    matches = clients // players * (players * (players - 1) // 2) # Per load test
+    def run(n):
+        for _ in range(max(1, -(-n // matches))):
+            asyncio.run(load_test(clients, players))
+    return run
+
+def _evolution(dynamics):
+    from evolution import evolve
+    payoffs = np.random.default_rng(0).uniform(0, 250, (11, 11))
+    def run(n):
+        evolve(payoffs, n, dynamics=dynamics, population_size=1_000_000, mutation=0.001, seed=0)
+    return run
+
+def _pipeline(config):
+    import main
+    def run(n):
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.main(config)
+    return run
+
+
+def _cli_startup():
+    # A bare `train` in a fresh interpreter: what each short job-array invocation pays before any work
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py"), "train",
+               "--num-training-episodes", "0", "--show-plots", "false"]
+    def run(n):
+        for _ in range(n):
+            subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+    return run
+
+
+def benchmark_suite(quick: bool = False) -> dict:
+    """
+    The hot paths to time, as name -> (setup, operations per timed run, unit).
+    setup() returns run(n), which performs n operations.
+    """
+    scale = 0.1 if quick else 1.0
+    ops = lambda n: max(1, int(n * scale))
+    pipeline_config = {"num_training_episodes": ops(500), "rounds_per_match": 50, "num_eval_matches_per_pair": 20,
+                       "num_eval_workers": 1, "payoff_cache_path": None, "show_plots": False,
+                       "convergence": None} # Always train the full budget, so every run does the same work
+    suite = {
+        "env.play_round": (_play_round, ops(200_000), "rounds"),
+    }
+    for m in (1, 4):
+        suite[f"env.get_state[m={m}]"] = (lambda m=m: _get_state(m), ops(100_000), "states")
+    for cls in (AlwaysCooperate, AlwaysCheat, TitForTat, Grudger, Pavlov, RandomStrategy,
+                TitForTwoTats, TwoTitsForTat, GenerousTitForTat, AdaptiveTitForTat):
+        suite[f"strategy.{cls.__name__}.choose_action"] = (lambda cls=cls: _choose_action(cls), ops(200_000), "actions")
+    for m in (1, 3):
+        for dense in (False, True):
+            backend = "dense" if dense else "dict"
+            suite[f"qlearning.choose_learn[{backend},m={m}]"] = (lambda m=m, d=dense: _q_learning(m, d), ops(100_000), "steps")
+    suite["qlearning.choose_learn[dense,m=3,planning=10]"] = (lambda: _q_learning(3, True, 10), ops(10_000), "steps")
+    for num_rounds in (50, 1000):
+        for m in (1, 3):
+            for training in (False, True):
+                mode = "train" if training else "eval"
+                suite[f"run_match[{mode},rounds={num_rounds},m={m}]"] = (
+                    lambda r=num_rounds, m=m, t=training: _run_match(r, m, t), ops(100_000), "rounds")
+    for record in ("off", "compact", "streaming"):
+        suite[f"run_match[eval,rounds=100000,m=1,record={record}]"] = (
+            lambda record=record: _run_match(100_000, 1, False, record), ops(1_000_000), "rounds")
+    for learner, m in (("tabular", 3), ("linear", 3), ("tabular", 6), ("linear", 6), ("linear", 32)):
+        suite[f"training.batched[{learner},m={m}]"] = (
+            lambda l=learner, m=m: _batched_training(l, m), ops(500_000), "rounds")
+    # Server and clients in one event loop, over local TCP: 100 tournaments of 4 clients, 600 matches of 50 rounds
+    suite["match_server.loadtest[clients=400]"] = (lambda: _match_server(400, 4), 600, "matches")
+    for dynamics in ("replicator", "moran", "tournament"):
+        suite[f"evolution.{dynamics}[N=10^6]"] = (lambda d=dynamics: _evolution(d), ops(1000), "generations")
+    pipeline_rounds = pipeline_config["num_training_episodes"] * pipeline_config["rounds_per_match"]
+    suite["cli.startup[train]"] = (_cli_startup, 10 if quick else 20, "launches")
+    suite["pipeline.main[reduced]"] = (lambda: _pipeline(pipeline_config), pipeline_rounds, "training rounds")
+    return suite
+
+
+def run_benchmark(setup, operations: int, repeats: int = 3) -> dict:
+    """Best-of-`repeats` wall time, plus peak traced memory of one extra (traced) run."""
+    run = setup()
+    run(max(1, operations // 100)) # Warm-up: imports, caches, first allocations
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run(operations)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    run(operations)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": best, "operations": operations, "rate": operations / best, "peak_memory_kb": peak / 1024}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    :return: (name, baseline_rate, current_rate, change) for every benchmark whose rate fell by more
+             than `threshold` (a fraction) compared to the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        change = result["rate"] / reference["rate"] - 1.0
+        if change < -threshold:
+            regressions.append((name, reference["rate"], result["rate"], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation hot paths.")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the results (JSON).")
+    parser.add_argument("--baseline", help="Results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown that counts as a regression (default: %(default)s).")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this text.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per benchmark (best is kept).")
+    parser.add_argument("--quick", action="store_true", help="Run 10x fewer operations.")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, (setup, operations, unit) in benchmark_suite(args.quick).items():
+        if args.filter not in name:
+            continue
+        result = run_benchmark(setup, operations, args.repeats)
+        result["unit"] = unit
+        results[name] = result
+        print(f"{name:<48} {result['rate']:>14,.0f} {unit}/s   peak {result['peak_memory_kb']:>10,.1f} KiB")
+        sys.stdout.flush()
+
+    report = {
+        "meta": {"timestamp": time.time(), "python": platform.python_version(), "numpy": np.__version__,
+                 "platform": platform.platform(), "quick": args.quick},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n--- Regressions (more than {args.threshold:.0%} slower than {args.baseline}) ---")
+            for name, before, after, change in regressions:
+                print(f"  {name}: {before:,.0f} -> {after:,.0f} ({change:+.1%})")
+            return 1
+        print(f"\nNo regressions against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    import matplotlib
+    matplotlib.use("Agg") # Headless: never open plot windows
+    sys.exit(main())
@@ -1,11 +1,26 @@
 # classic_strategies.py
 
-import random
 from collections import deque
 from game_environment import PrisonersDilemma
+from rng import RandomStream
 
 class ClassicStrategy:
-    """Base class for all classic strategies."""
+    """
+    Base class for all classic strategies.
+
+    Any object with the same interface can take part in a match (see match_kernels.py), so custom
+    strategies do not need to touch main.py: `name`, `reset()`, `choose_action(observation)`, and
+    optionally `observe(own_action, opponent_action)`, which is called after every round.
+    `observes` says what choose_action is given: "history" (the opponent's MatchHistory) or
+    "state" (the environment state, like a QLearningAgent).
+    Stochastic strategies draw from their own random stream, `self.rng` (see rng.py), which
+    `seed(seed)` restarts.
+    """
+    observes = "history"
+    # True if the strategy's moves are fully determined by the match so far (no randomness).
+    # Deterministic strategies can be compiled to finite-state machines (see strategy_fsm.py).
+    deterministic = False
+
     def __init__(self, name: str):
         self.name = name
 
@@ -16,12 +31,26 @@ class ClassicStrategy:
         """
         raise NotImplementedError
 
+    def observe(self, own_action: int, opponent_action: int):
+        """
+        Called after every round with the actions both players just made.
+        Strategies with internal state that depends on the round's outcome override this.
+        """
+        pass # Most classic strategies are stateless or read everything from the history
+
     def reset(self):
         """Resets any internal state of the strategy (if any)."""
         pass # Most classic strategies are stateless or only need simple history
 
+    def seed(self, seed):
+        """Restarts the strategy's random stream from `seed` (nothing to do for deterministic strategies)."""
+        if not self.deterministic:
+            self.rng.seed(seed)
+
 class AlwaysCooperate(ClassicStrategy):
     """Always cooperates, regardless of opponent's moves."""
+    deterministic = True
+
     def __init__(self):
         super().__init__("AlwaysCooperate")
 
@@ -30,6 +59,8 @@ class AlwaysCooperate(ClassicStrategy):
 
 class AlwaysCheat(ClassicStrategy):
     """Always cheats, regardless of opponent's moves."""
+    deterministic = True
+
     def __init__(self):
         super().__init__("AlwaysCheat")
 
@@ -40,6 +71,8 @@ class TitForTat(ClassicStrategy):
     """
     Starts with cooperation, then mimics the opponent's last move.
     """
+    deterministic = True
+
     def __init__(self):
         super().__init__("TitForTat")
 
@@ -52,6 +85,8 @@ class Grudger(ClassicStrategy):
     """
     Starts with cooperation, but defects forever if the opponent ever defects.
     """
+    deterministic = True
+
     def __init__(self):
         super().__init__("Grudger")
         self.grudge = False
@@ -60,7 +95,16 @@ class Grudger(ClassicStrategy):
         if self.grudge:
             return PrisonersDilemma.CHEAT
 
-        if PrisonersDilemma.CHEAT in opponent_history:
+        # A MatchHistory knows in O(1) whether the opponent ever defected. A plain deque (as
+        # strategy_fsm gives) has its newest move checked every round instead, which catches every
+        # defection as it happens without rescanning the whole history. With memory_length 0
+        # nothing is visible, so neither way may see the defection (as in every other engine)
+        window = getattr(opponent_history, "window", 0)
+        if window is None or window > 0:
+            ever_defected = opponent_history.ever_defected
+        else:
+            ever_defected = bool(opponent_history) and opponent_history[-1] == PrisonersDilemma.CHEAT
+        if ever_defected:
             self.grudge = True
             return PrisonersDilemma.CHEAT
         return PrisonersDilemma.COOPERATE
@@ -75,6 +119,8 @@ class Pavlov(ClassicStrategy):
     Cheat if one cooperated and the other cheated (lose).
     This agent needs its own last action as well as opponent's.
     """
+    deterministic = True
+
     def __init__(self):
         super().__init__("Pavlov")
         self.last_own_action = None
@@ -92,21 +138,26 @@ class Pavlov(ClassicStrategy):
             # Last round was a "loss" (one cooperated, one cheated) -> Shift action
             return PrisonersDilemma.COOPERATE if self.last_own_action == PrisonersDilemma.CHEAT else PrisonersDilemma.CHEAT
 
-    def update_last_actions(self, own_action: int, opponent_action: int):
+    def observe(self, own_action: int, opponent_action: int):
         self.last_own_action = own_action
         self.last_opponent_action = opponent_action
 
+    def update_last_actions(self, own_action: int, opponent_action: int):
+        """Deprecated name of observe, kept for callers written against the old API."""
+        self.observe(own_action, opponent_action)
+
     def reset(self):
         self.last_own_action = None
         self.last_opponent_action = None
 
 class RandomStrategy(ClassicStrategy):
     """Chooses actions randomly."""
-    def __init__(self):
+    def __init__(self, seed=None):
         super().__init__("Random")
+        self.rng = RandomStream(seed)
 
     def choose_action(self, opponent_history: deque) -> int:
-        return random.choice(PrisonersDilemma.ACTIONS)
+        return PrisonersDilemma.CHEAT if self.rng.uniform() < 0.5 else PrisonersDilemma.COOPERATE
 
 # --- NEW STRATEGIES ADDED BELOW ---
 
@@ -115,6 +166,8 @@ class TitForTwoTats(ClassicStrategy):
     Starts with cooperation, defects only if the opponent defects two times in a row.
     More forgiving than TitForTat.
     """
+    deterministic = True
+
     def __init__(self):
         super().__init__("TitForTwoTats")
 
@@ -131,6 +184,8 @@ class TwoTitsForTat(ClassicStrategy):
     Starts with cooperation. If the opponent defects, it defects twice in a row.
     More punitive than TitForTat.
     """
+    deterministic = True
+
     def __init__(self):
         super().__init__("TwoTitsForTat")
         self.punish_count = 0 # How many more defects to dole out
@@ -157,9 +212,10 @@ class GenerousTitForTat(ClassicStrategy):
     Similar to TitForTat, but with a small probability of cooperating
     even if the opponent defected in the previous round.
     """
-    def __init__(self, forgiveness_prob: float = 0.1):
+    def __init__(self, forgiveness_prob: float = 0.1, seed=None):
         super().__init__("GenerousTitForTat")
         self.forgiveness_prob = forgiveness_prob # Probability of cooperating after opponent defects
+        self.rng = RandomStream(seed)
 
     def choose_action(self, opponent_history: deque) -> int:
         if not opponent_history:
@@ -167,7 +223,7 @@ class GenerousTitForTat(ClassicStrategy):
         
         if opponent_history[-1] == PrisonersDilemma.CHEAT:
             # Opponent defected, but we might forgive
-            if random.random() < self.forgiveness_prob:
+            if self.rng.uniform() < self.forgiveness_prob:
                 return PrisonersDilemma.COOPERATE
             else:
                 return PrisonersDilemma.CHEAT # Standard TFT response
@@ -181,11 +237,12 @@ class AdaptiveTitForTat(ClassicStrategy):
     Starts as TFT, but might become more forgiving or more punishing.
     This one is illustrative and a simple adaptation.
     """
-    def __init__(self, initial_forgiveness=0.0, learning_rate=0.05):
+    def __init__(self, initial_forgiveness=0.0, learning_rate=0.05, seed=None):
         super().__init__("AdaptiveTitForTat")
         self.forgiveness = initial_forgiveness # Probability of cooperating when opponent defects
         self.learning_rate = learning_rate
         self.last_opponent_action = None # To track opponent's last move
+        self.rng = RandomStream(seed)
 
     def choose_action(self, opponent_history: deque) -> int:
         if not opponent_history:
@@ -196,16 +253,16 @@ class AdaptiveTitForTat(ClassicStrategy):
 
         if self.last_opponent_action == PrisonersDilemma.CHEAT:
             # Opponent defected, decide based on current forgiveness
-            if random.random() < self.forgiveness:
+            if self.rng.uniform() < self.forgiveness:
                 return PrisonersDilemma.COOPERATE # Forgive
             else:
                 return PrisonersDilemma.CHEAT # Punish
         else: # Opponent cooperated
             return PrisonersDilemma.COOPERATE
 
-    # This agent needs its own way to "learn" from results, so it's a bit hybrid.
-    # We'll need to call update_strategy from main.py after each round.
-    def update_strategy(self, own_action: int, opponent_action: int):
+    # This agent needs its own way to "learn" from results, so it's a bit hybrid:
+    # it adapts its forgiveness after every round through the observe callback.
+    def observe(self, own_action: int, opponent_action: int):
         # If opponent cooperated, become slightly more forgiving (or maintain if already forgiving)
         if opponent_action == PrisonersDilemma.COOPERATE:
             self.forgiveness = min(1.0, self.forgiveness + self.learning_rate)
@@ -213,9 +270,10 @@ class AdaptiveTitForTat(ClassicStrategy):
         elif opponent_action == PrisonersDilemma.CHEAT:
             self.forgiveness = max(0.0, self.forgiveness - self.learning_rate)
 
+    def update_strategy(self, own_action: int, opponent_action: int):
+        """Deprecated name of observe, kept for callers written against the old API."""
+        self.observe(own_action, opponent_action)
+
     def reset(self):
         self.forgiveness = 0.0 # Reset to initial state
         self.last_opponent_action = None
-
-# For AdaptiveTitForTat, we need to adapt the run_match function in main.py
-# similarly to how Pavlov is handled, to call `update_strategy` after each round.
\ No newline at end of file
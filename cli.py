@@ -0,0 +1,106 @@
+# cli.py
+
+import argparse
+import json
+import os
+import sys
+
+# Only the light modules are imported here: pandas (evaluation tables) and matplotlib (plots) are
+# imported by the phases that use them, so a bare `train` pays for neither
+import main as pipeline
+
+COMMANDS = {
+    "run": "Train, evaluate against the classic strategies and play the example match (the default).",
+    "train": "Train the QLearner (saved to --checkpoint-path).",
+    "evaluate": "Tournament of the trained QLearner (from --checkpoint-path) and the classic strategies.",
+    "tournament": "Tournament of the classic strategies only.",
+    "demo": "Verbose example match of the trained QLearner (from --checkpoint-path) against TitForTat.",
+}
+
+
+def parse_value(text: str):
+    """A setting given on the command line: JSON (numbers, true/false, null, lists, objects) or a plain string."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def load_config(path: str) -> dict:
+    """Settings from a JSON file, or a TOML file if its name ends in .toml."""
+    if path.endswith(".toml"):
+        import tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    settings = argparse.ArgumentParser(add_help=False)
+    settings.add_argument("--config", action="append", default=argparse.SUPPRESS, metavar="PATH",
+                          help="JSON or TOML file of settings (several are applied in order).")
+    settings.add_argument("--set", action="append", default=argparse.SUPPRESS, metavar="KEY=VALUE",
+                          help="Override one setting, VALUE being JSON or a plain string.")
+    # One flag per setting of main.DEFAULT_CONFIG; flags win over --set, which wins over --config files
+    for key, default in pipeline.DEFAULT_CONFIG.items():
+        settings.add_argument(f"--{key.replace('_', '-')}", dest=key, type=parse_value, default=argparse.SUPPRESS,
+                              metavar="VALUE", help=f"(default: {json.dumps(default)})")
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]) or "cli.py", parents=[settings],
+                                     description="Iterated Prisoner's Dilemma: train, evaluate and compare strategies.")
+    commands = parser.add_subparsers(dest="command", metavar="{" + ",".join(COMMANDS) + "}")
+    for name, description in COMMANDS.items():
+        commands.add_parser(name, parents=[settings], help=description, description=description)
+    return parser
+
+
+def resolve_config(parser: argparse.ArgumentParser, args: argparse.Namespace) -> dict:
+    """The settings of this invocation that differ from main.DEFAULT_CONFIG."""
+    config = {}
+    for path in getattr(args, "config", []):
+        config.update(load_config(path))
+    for assignment in getattr(args, "set", []):
+        key, separator, value = assignment.partition("=")
+        if not separator:
+            parser.error(f"--set expects KEY=VALUE, not {assignment!r}.")
+        config[key.replace("-", "_")] = parse_value(value)
+    config.update({key: getattr(args, key) for key in pipeline.DEFAULT_CONFIG if hasattr(args, key)})
+    unknown = sorted(set(config) - set(pipeline.DEFAULT_CONFIG))
+    if unknown:
+        parser.error(f"Unknown settings: {', '.join(unknown)}.")
+    return config
+
+
+def run_cli(argv: list = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    config = resolve_config(parser, args)
+    command = args.command or "run"
+    if command == "run":
+        pipeline.main(config)
+        return 0
+
+    run = pipeline.setup(config)
+    try:
+        if command == "train":
+            if not run["config"]["checkpoint_path"]:
+                print("Note: no --checkpoint-path, the trained QLearner will not be saved.")
+            _, training_curve = pipeline.train(run)
+            if run["plotting"]:
+                pipeline.plot_training(run, training_curve)
+        elif command == "evaluate":
+            pipeline.evaluate(run, [pipeline.load_q_agent(run, mmap_mode="r")] + pipeline.classic_agents())
+        elif command == "tournament":
+            pipeline.evaluate(run, pipeline.classic_agents())
+        elif command == "demo":
+            pipeline.demo(run, pipeline.load_q_agent(run))
+    except FileNotFoundError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 1
+    pipeline.report_profile(run)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_cli())
@@ -0,0 +1,247 @@
+# evolution.py
+
+import copy
+import json
+
+import numpy as np
+
+from game_environment import PrisonersDilemma
+from tournament import run_tournament, evaluate_pairing, pairing_rng
+from payoff_cache import PayoffCache
+
+DYNAMICS = ("replicator", "moran", "tournament")
+
+
+def payoff_matrix(agents: list, num_rounds: int, env: PrisonersDilemma, num_matches: int = 50,
+                  master_seed: int = 0, workers: int = None, verbose: bool = False, cache: PayoffCache = None,
+                  target_ci: float = None, confidence: float = 0.95) -> np.ndarray:
+    """
+    Average match score of every strategy against every strategy, including against itself.
+    Off-diagonal entries come from run_tournament (so they are parallel and cached like any
+    evaluation); each diagonal entry is a match between the agent and a copy of it.
+    :return: payoffs[i, j] = average score of agents[i] against agents[j].
+    """
+    pairwise_scores, _ = run_tournament(agents, num_rounds, num_matches, env, master_seed=master_seed,
+                                        workers=workers, verbose=verbose, cache=cache, target_ci=target_ci,
+                                        confidence=confidence)
+    payoffs = np.array([[pairwise_scores[row.name][column.name] for column in agents] for row in agents])
+    sampling = {"target_ci": target_ci, "confidence": confidence}
+    for i, agent in enumerate(agents):
+        twin = copy.deepcopy(agent)
+        key = cache.key(agent, twin, num_rounds, env.memory_length, num_matches, master_seed,
+                        sampling={**sampling, "noise": env.noise}) if cache is not None else None
+        result = cache.get(key) if cache is not None else None
+        if result is None:
+            result = evaluate_pairing(agent, twin, num_matches, num_rounds, env,
+                                      rng=pairing_rng(master_seed, agent.name, agent.name), **sampling)
+            if cache is not None:
+                cache.put(key, agent, twin, *result)
+        payoffs[i, i] = (result[0] + result[1]) / 2 # Both sides play the same strategy
+    return payoffs
+
+
+def _fitness(payoffs: np.ndarray, freqs: np.ndarray, counts: np.ndarray, selection_strength: float,
+             noise: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Fitness of each strategy: 1 - w + w * (average payoff) / (largest payoff).
+    In a finite population (counts given) individuals do not play themselves.
+    """
+    scale = payoffs.max() or 1.0
+    if counts is None:
+        average_payoff = payoffs @ freqs
+    else:
+        population = counts.sum()
+        average_payoff = (payoffs @ counts - np.diag(payoffs)) / max(1, population - 1)
+    if noise:
+        average_payoff = np.maximum(0.0, average_payoff + rng.normal(0.0, noise * scale, len(average_payoff)))
+    return 1.0 - selection_strength + selection_strength * average_payoff / scale
+
+
+def _mutate(probs: np.ndarray, mutation: float) -> np.ndarray:
+    """Each offspring switches to a strategy drawn uniformly at random with probability `mutation`."""
+    return probs if not mutation else (1.0 - mutation) * probs + mutation / len(probs)
+
+
+def _proportional(weights: np.ndarray, fallback: np.ndarray) -> np.ndarray:
+    total = weights.sum()
+    return weights / total if total > 0 else fallback
+
+
+def _tournament_winners(freqs: np.ndarray, fitness: np.ndarray, tournament_size: int) -> np.ndarray:
+    """
+    Probability that the fittest of tournament_size individuals, drawn with replacement, plays
+    each strategy (ties shared in proportion to frequency). The winner is no fitter than strategy i
+    with probability (total frequency of strategies no fitter than i)^k.
+    """
+    order = np.argsort(-fitness, kind="stable")
+    sorted_fitness = fitness[order]
+    sorted_freqs = freqs[order]
+    starts = np.flatnonzero(np.r_[True, sorted_fitness[1:] != sorted_fitness[:-1]]) # Groups of tied strategies
+    group_mass = np.add.reduceat(sorted_freqs, starts)
+    weaker = np.clip(1.0 - np.cumsum(group_mass), 0.0, None) # Frequency of strategies less fit than each group
+    group_wins = (weaker + group_mass) ** tournament_size - weaker ** tournament_size
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(freqs)]))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sorted_wins = np.where(group_mass[group] > 0, group_wins[group] * sorted_freqs / group_mass[group], 0.0)
+    wins = np.empty_like(sorted_wins)
+    wins[order] = sorted_wins
+    return wins
+
+
+def _initial_counts(freqs: np.ndarray, population_size: int) -> np.ndarray:
+    """Integer counts closest to freqs * population_size that add up to population_size."""
+    exact = freqs * population_size
+    counts = np.floor(exact).astype(np.int64)
+    shortfall = population_size - counts.sum()
+    counts[np.argsort(counts - exact, kind="stable")[:shortfall]] += 1
+    return counts
+
+
+class HistoryWriter:
+    """
+    Streams one row of strategy frequencies per generation to a .npy file (readable with
+    np.load(path, mmap_mode="r")), through a memory map flushed every flush_every generations.
+    The strategy names and run settings go to <path>.json.
+    """
+    def __init__(self, path: str, num_generations: int, names: list, settings: dict, flush_every: int = 100):
+        self.rows = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64,
+                                              shape=(num_generations + 1, len(names)))
+        self.flush_every = max(1, flush_every)
+        with open(f"{path}.json", "w") as f:
+            json.dump({"names": list(names), **settings}, f, indent=2)
+
+    def write(self, generation: int, freqs: np.ndarray):
+        self.rows[generation] = freqs
+        if generation % self.flush_every == 0:
+            self.rows.flush()
+
+    def close(self) -> np.memmap:
+        self.rows.flush()
+        return self.rows
+
+
+def evolve(payoffs: np.ndarray, num_generations: int, dynamics: str = "replicator", population_size: int = None,
+           initial: np.ndarray = None, mutation: float = 0.0, noise: float = 0.0, selection_strength: float = 1.0,
+           tournament_size: int = 2, moran_substeps: int = 50, seed=None, history_path: str = None,
+           names: list = None, flush_every: int = 100) -> np.ndarray:
+    """
+    Evolves the frequencies of strategies whose pairwise payoffs are known (see payoff_matrix).
+    No matches are played: each generation is a few vectorized operations on the k strategy
+    frequencies or counts, so its cost does not depend on the population size.
+    :param payoffs: (k, k) matrix, payoffs[i, j] = score of strategy i against strategy j.
+    :param num_generations: Generations to run.
+    :param dynamics: "replicator": discrete replicator dynamics, each strategy's share grows in
+                     proportion to its fitness (a Wright-Fisher resampling when population_size is set).
+                     "moran": a Moran process, one fitness-proportional birth and one uniformly drawn
+                     death per step, population_size steps per generation (needs population_size).
+                     "tournament": every offspring copies the fittest of tournament_size individuals
+                     drawn at random.
+    :param population_size: Number of individuals, or None for an infinite population (frequencies
+                            evolve deterministically unless noise is set).
+    :param initial: Initial frequencies (default: uniform).
+    :param mutation: Probability that an offspring adopts a uniformly drawn strategy instead.
+    :param noise: Standard deviation of Gaussian noise added to each strategy's average payoff every
+                  generation, as a fraction of the largest payoff.
+    :param selection_strength: w in fitness = 1 - w + w * payoff / max payoff (0: neutral drift).
+    :param tournament_size: Individuals per tournament ("tournament" dynamics).
+    :param moran_substeps: The Moran steps of a generation are drawn in this many batches, with
+                           births and deaths in a batch sampled together (population_size substeps is the
+                           exact step-by-step process).
+    :param seed: Seed of the numpy Generator used for sampling.
+    :param history_path: Stream the history to this .npy file (see HistoryWriter) instead of memory.
+    :param names: Strategy names, recorded with the history file.
+    :param flush_every: Generations between flushes of the history file.
+    :return: (num_generations + 1, k) array of frequencies, row 0 being the initial population
+             (a read-only view of the file when history_path is set).
+    """
+    if dynamics not in DYNAMICS:
+        raise ValueError(f"Unknown dynamics {dynamics!r}; expected one of {DYNAMICS}.")
+    if dynamics == "moran" and population_size is None:
+        raise ValueError("The Moran process needs a finite population_size.")
+    if not 0.0 <= mutation <= 1.0:
+        raise ValueError("mutation must be a probability.")
+    payoffs = np.asarray(payoffs, dtype=np.float64)
+    num_strategies = len(payoffs)
+    if payoffs.shape != (num_strategies, num_strategies):
+        raise ValueError(f"payoffs must be a square matrix, not of shape {payoffs.shape}.")
+    if payoffs.min() < 0:
+        raise ValueError("Payoffs must be non-negative (fitness is proportional to payoff).")
+    rng = np.random.default_rng(seed)
+    uniform = np.full(num_strategies, 1.0 / num_strategies)
+    freqs = uniform if initial is None else np.asarray(initial, dtype=np.float64) / np.sum(initial)
+    counts = None if population_size is None else _initial_counts(freqs, population_size)
+    if counts is not None:
+        freqs = counts / population_size
+
+    if history_path is not None:
+        settings = {"dynamics": dynamics, "population_size": population_size, "mutation": mutation, "noise": noise,
+                    "selection_strength": selection_strength, "tournament_size": tournament_size, "seed": seed}
+        history = HistoryWriter(history_path, num_generations, names or [str(i) for i in range(num_strategies)],
+                                settings, flush_every)
+    else:
+        history = None
+        rows = np.empty((num_generations + 1, num_strategies))
+    record = history.write if history is not None else rows.__setitem__
+    record(0, freqs)
+
+    if dynamics == "moran":
+        substeps = max(1, min(moran_substeps, population_size))
+        batch_sizes = np.full(substeps, population_size // substeps)
+        batch_sizes[:population_size % substeps] += 1
+
+    for generation in range(1, num_generations + 1):
+        if dynamics == "moran":
+            for batch in batch_sizes:
+                fitness = _fitness(payoffs, freqs, counts, selection_strength, noise, rng)
+                births = rng.multinomial(batch, _mutate(_proportional(counts * fitness, freqs), mutation))
+                deaths = rng.multivariate_hypergeometric(counts, batch)
+                counts += births - deaths
+                freqs = counts / population_size
+        else:
+            fitness = _fitness(payoffs, freqs, counts, selection_strength, noise, rng)
+            if dynamics == "replicator":
+                offspring = _proportional(freqs * fitness, freqs)
+            else:
+                offspring = _tournament_winners(freqs, fitness, tournament_size)
+            offspring = _mutate(offspring, mutation)
+            if counts is None:
+                freqs = offspring
+            else:
+                counts = rng.multinomial(population_size, offspring)
+                freqs = counts / population_size
+        record(generation, freqs)
+
+    if history is not None:
+        history.close()
+        return np.load(history_path, mmap_mode="r")
+    return rows
+
+
+# Example Usage
+if __name__ == "__main__":
+    import time
+
+    from rl_agents import QLearningAgent
+    from training import train_q_agent_batched
+    from classic_strategies import (
+        AlwaysCooperate, AlwaysCheat, TitForTat, Grudger, Pavlov, RandomStrategy,
+        TitForTwoTats, TwoTitsForTat, GenerousTitForTat, AdaptiveTitForTat
+    )
+
+    env = PrisonersDilemma(memory_length=1)
+    classic_agents = [AlwaysCooperate(), AlwaysCheat(), TitForTat(), Grudger(), Pavlov(), RandomStrategy(),
+                      TitForTwoTats(), TwoTitsForTat(), GenerousTitForTat(), AdaptiveTitForTat()]
+    q_agent = QLearningAgent(memory_length=env.memory_length)
+    train_q_agent_batched(q_agent, classic_agents, 2000, 50, env, rng=np.random.default_rng(0), verbose=False)
+    q_agent.epsilon = 0.0
+    agents = classic_agents + [q_agent]
+    names = [agent.name for agent in agents]
+
+    payoffs = payoff_matrix(agents, 50, env, workers=1)
+    for dynamics in DYNAMICS:
+        start = time.perf_counter()
+        history = evolve(payoffs, 1000, dynamics=dynamics, population_size=1_000_000, mutation=0.001, seed=0)
+        seconds = time.perf_counter() - start
+        print(f"\n{dynamics} (10^6 individuals, 1000 generations, {seconds:.2f}s):")
+        for name, share in sorted(zip(names, history[-1]), key=lambda item: item[1], reverse=True):
+            print(f"  {name:<20} {share:.3f}")
@@ -3,6 +3,10 @@
 from collections import deque
 from typing import Tuple 
 
+import numpy as np
+
+from rng import RandomStream
+
 class PrisonersDilemma:
     """
     Represents the Iterated Prisoner's Dilemma game environment.
@@ -22,14 +26,46 @@ class PrisonersDilemma:
         (CHEAT, CHEAT): (1, 1)           # P: Punishment for mutual defection
     }
 
-    def __init__(self, memory_length=1):
+    # The same payoffs as an array for vectorized lookups:
+    # PAYOFF_MATRIX[player_1_action, player_2_action] -> [p1_reward, p2_reward]
+    PAYOFF_MATRIX = np.zeros((2, 2, 2), dtype=np.int64)
+    for (_a1, _a2), _rewards in PAYOFFS.items():
+        PAYOFF_MATRIX[_a1, _a2] = _rewards
+    del _a1, _a2, _rewards
+
+    def __init__(self, memory_length=1, noise: float = 0.0, seed=None):
         """
         Initializes the game environment.
         :param memory_length: How many previous moves to consider for the state.
+        :param noise: Execution noise ("trembling hand"): probability that a player's chosen action
+                      is flipped before it is played. Both players see the actions actually played.
+        :param seed: Seed of the noise stream (see rng.py).
         """
         if memory_length < 0:
             raise ValueError("Memory length cannot be negative.")
+        if not 0.0 <= noise <= 1.0:
+            raise ValueError("Noise must be a probability.")
         self.memory_length = memory_length
+        self.noise = noise
+        self.rng = RandomStream(seed) if noise else None
+
+    def seed(self, seed):
+        """Restarts the noise stream from `seed` (nothing to do without noise)."""
+        if self.rng is not None:
+            self.rng.seed(seed)
+
+    def trembling(self, act):
+        """
+        Wraps an agent's action method so that its action is flipped with probability `noise`.
+        Without noise the method is returned as is, so noise-free matches pay nothing per round.
+        """
+        if not self.noise:
+            return act
+        noise, rng = self.noise, self.rng
+        def trembling_act(observation):
+            action = act(observation)
+            return 1 - action if rng.uniform() < noise else action
+        return trembling_act
 
     def play_round(self, action_p1: int, action_p2: int) -> tuple[int, int]:
         """
@@ -42,6 +78,13 @@ class PrisonersDilemma:
             raise ValueError("Invalid action. Use COOPERATE or CHEAT.")
         return self.PAYOFFS[(action_p1, action_p2)]
 
+    def start_match(self) -> "MatchState":
+        """
+        Starts tracking a new match and returns its rolling state (also kept as self.match_state).
+        """
+        self.match_state = MatchState(self.memory_length)
+        return self.match_state
+
     def get_state(self, p1_history: deque, p2_history: deque) -> tuple:
         """
         Generates a state representation based on the last 'memory_length' moves.
@@ -61,6 +104,177 @@ class PrisonersDilemma:
 
         return (p1_state_part, p2_state_part)
 
+    @property
+    def num_states(self) -> int:
+        """
+        Number of distinct states: each of the 2 * memory_length moves is COOPERATE, CHEAT or padding.
+        """
+        return 3 ** (2 * self.memory_length)
+
+    @staticmethod
+    def encode_state(state: tuple) -> int:
+        """
+        Encodes a get_state tuple as an integer in [0, num_states), in base 3 with one digit
+        per move (padding -1 -> 0, COOPERATE -> 1, CHEAT -> 2), own moves first, oldest first.
+        """
+        code = 0
+        for move in state[0]:
+            code = code * 3 + move + 1
+        for move in state[1]:
+            code = code * 3 + move + 1
+        return code
+
+    def decode_state(self, code: int) -> tuple:
+        """Inverse of encode_state."""
+        moves = []
+        for _ in range(2 * self.memory_length):
+            code, digit = divmod(code, 3)
+            moves.append(digit - 1)
+        moves.reverse()
+        return (tuple(moves[:self.memory_length]), tuple(moves[self.memory_length:]))
+
+class MatchState:
+    """
+    Rolling integer state of a match, for both players' perspectives.
+    Each player's window of the last memory_length moves is kept as a base-3 code; appending a
+    move shifts it one digit left and masks off the oldest digit (multiply by 3, modulo 3^memory_length).
+    p1_state and p2_state always equal PrisonersDilemma.encode_state of the matching get_state tuple.
+    """
+    def __init__(self, memory_length: int):
+        self.memory_length = memory_length
+        self.window_states = 3 ** memory_length # Number of distinct windows of one player
+        self.reset()
+
+    def reset(self):
+        # Digit 0 is the padding value, so an empty history is code 0
+        self.p1_window = 0
+        self.p2_window = 0
+        self.p1_state = 0 # State as seen by player 1: (p1 window, p2 window)
+        self.p2_state = 0 # State as seen by player 2: (p2 window, p1 window)
+
+    def push(self, action_p1: int, action_p2: int):
+        """Appends one round's actions to both windows."""
+        window_states = self.window_states
+        self.p1_window = p1_window = (self.p1_window * 3 + action_p1 + 1) % window_states
+        self.p2_window = p2_window = (self.p2_window * 3 + action_p2 + 1) % window_states
+        self.p1_state = p1_window * window_states + p2_window
+        self.p2_state = p2_window * window_states + p1_window
+
+    def state_tuples(self) -> tuple:
+        """The current states of (player 1, player 2) in get_state tuple form, for debugging."""
+        decoder = PrisonersDilemma(self.memory_length)
+        return decoder.decode_state(self.p1_state), decoder.decode_state(self.p2_state)
+
+class MatchHistory(deque):
+    """
+    One player's moves in a match.
+    As a deque it holds the last `window` moves (all of them if window is None), exactly what
+    strategies have always been given. Alongside, every move of the match is logged in a
+    bytearray (one byte per move) and running summaries are kept up to date on each append,
+    so strategies can read them in O(1) instead of rescanning: cooperations, defections,
+    ever_defected and streak (length of the current run of identical moves).
+    Moves can only be added (append, extend, +=) or all dropped (clear); the other deque
+    mutators raise TypeError, since they would leave the log and summaries out of step.
+    With log=False nothing is logged (when no trace is recorded, the log would only grow a byte
+    per round): the summaries still hold, but last(k) only reaches back `window` moves.
+    """
+    def __init__(self, window: int = None, log: bool = True):
+        super().__init__(maxlen=window)
+        self.window = window
+        self.log = log
+        self.moves = bytearray()
+        self.spilled = 0 # Moves played but not in the log: dropped from its front by spill(), or never logged
+        self._unspilled = 0 # Position in the log of the first move spill() has not returned yet
+        self.defections = 0
+        self.streak = 0
+        self._last_move = None
+
+    def append(self, action: int):
+        if action == self._last_move:
+            self.streak += 1
+        else:
+            self.streak = 1
+            self._last_move = action
+        if self.log:
+            self.moves.append(action)
+        else:
+            self.spilled += 1
+        deque.append(self, action)
+        self.defections += action # CHEAT is 1, COOPERATE is 0
+
+    def extend(self, actions):
+        for action in actions:
+            self.append(action)
+
+    def __iadd__(self, actions):
+        self.extend(actions)
+        return self
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("MatchHistory only grows by append/extend (or is emptied by clear), "
+                        "so the move log and summaries always match the deque.")
+
+    appendleft = extendleft = insert = remove = pop = popleft = _read_only
+    rotate = reverse = __setitem__ = __delitem__ = _read_only
+
+    def clear(self):
+        deque.clear(self)
+        self.moves = bytearray()
+        self.spilled = 0
+        self._unspilled = 0
+        self.defections = 0
+        self.streak = 0
+        self._last_move = None
+
+    def spill(self, keep: int = 0) -> bytes:
+        """
+        Returns the moves logged since the previous spill and drops them from the log, except
+        the last `keep` (last(k) only reaches back that far). The summaries, rounds included,
+        are unaffected. Lets a very long match stream its moves out in constant memory.
+        """
+        moves = bytes(self.moves[self._unspilled:])
+        dropped = max(0, len(self.moves) - keep)
+        del self.moves[:dropped]
+        self.spilled += dropped
+        self._unspilled = len(self.moves)
+        return moves
+
+    @property
+    def cooperations(self) -> int:
+        return self.rounds - self.defections
+
+    @property
+    def ever_defected(self) -> bool:
+        return self.defections > 0
+
+    @property
+    def rounds(self) -> int:
+        """Number of moves played so far (not limited by the window)."""
+        return self.spilled + len(self.moves)
+
+    def last(self, k: int) -> tuple:
+        """The last k moves (fewer at the start of a match), oldest first, regardless of the window (unless not logging)."""
+        if k <= 0:
+            return ()
+        return tuple(self.moves[-k:]) if self.log else tuple(self)[-k:]
+
+    def to_array(self) -> np.ndarray:
+        """The moves still in the log (all of them unless spilled) as a uint8 array (a view, no copy)."""
+        return np.frombuffer(self.moves, dtype=np.uint8)
+
+    def __reduce__(self):
+        # deque pickles/copies as (iterable, maxlen); rebuild through __init__ and __setstate__ instead
+        return (type(self), (self.window, self.log), {**self.__dict__, "_visible": list(self)})
+
+    def __setstate__(self, state: dict):
+        state = dict(state)
+        visible = state.pop("_visible", None) # The window: without a log, the only copy of its moves
+        self.__dict__.update(state)
+        deque.extend(self, self.moves if visible is None else visible) # maxlen keeps just the visible window
+
+    def __repr__(self):
+        return f"MatchHistory({list(self)}, window={self.window}, rounds={self.rounds})"
+
 # Example Usage (for testing the environment)
 if __name__ == "__main__":
     env = PrisonersDilemma(memory_length=2)
@@ -92,4 +306,10 @@ if __name__ == "__main__":
 
     p1_hist_s.append(env.COOPERATE) # Now 2 moves, but memory_length is 1
     p1_hist_s.popleft() # keep deque limited if needed
-    print(f"State (memory=1, after popleft): {env_short_memory.get_state(p1_hist_s, p2_hist_s)}")
\ No newline at end of file
+    print(f"State (memory=1, after popleft): {env_short_memory.get_state(p1_hist_s, p2_hist_s)}")
+
+    # The same states as rolling integer codes
+    match_state = env.start_match()
+    for a1, a2 in [(env.COOPERATE, env.COOPERATE), (env.CHEAT, env.COOPERATE), (env.COOPERATE, env.CHEAT)]:
+        match_state.push(a1, a2)
+        print(f"Rolling state: codes=({match_state.p1_state}, {match_state.p2_state}), tuples={match_state.state_tuples()}")
\ No newline at end of file
@@ -1,116 +1,105 @@
 # main.py
 
-import random
-from collections import deque
+import os
 import sys
-import pandas as pd
+from collections import deque
 
 from game_environment import PrisonersDilemma
-from rl_agents import QLearningAgent
+from rl_agents import QLearningAgent, PrioritizedSweeping
 from classic_strategies import (
-    AlwaysCooperate, AlwaysCheat, TitForTat, Grudger, Pavlov, RandomStrategy, ClassicStrategy,
+    AlwaysCooperate, AlwaysCheat, TitForTat, Grudger, Pavlov, RandomStrategy,
     TitForTwoTats, TwoTitsForTat, GenerousTitForTat, AdaptiveTitForTat # NEW IMPORTS
 )
-from visualization import plot_scores, plot_single_match_scores
-
-
-def run_match(agent1, agent2, num_rounds: int, env: PrisonersDilemma, is_training: bool = False, verbose: bool = False):
+from visualization import SeriesDecimator
+from tournament import run_tournament
+from payoff_cache import PayoffCache
+from training import train_q_agent_batched, train_q_agent_parallel, ConvergenceMonitor
+from profiling import Profiler, phase
+from match_kernels import make_kernel
+from rng import derive_seed, make_generator, seed_agent
+from traces import TraceWriter
+
+
+def run_match(agent1, agent2, num_rounds: int, env: PrisonersDilemma, is_training: bool = False, verbose: bool = False,
+              profiler: Profiler = None, seed=None, record: str = "compact", trace_writer: TraceWriter = None):
     """
     Runs a single match between two agents.
-    ... (This function remains largely the same, but with the added AdaptiveTitForTat update) ...
+    The pairing's code path (what each agent observes, observe callbacks, learning, printing) is
+    resolved once by match_kernels.make_kernel; any agent following its protocol can play.
+    :param profiler: Optional Profiler; times every phase of the round loop (state, each agent's
+                     choose_action, play_round, history updates, learning, printing) and the whole match.
+    :param seed: Restart both agents' and the noise's random streams from this seed first (rng.seed_match).
+    :param record: What to keep of each round (traces.RECORD_LEVELS): "off" (totals only),
+                   "compact" (int8 arrays, see MatchTrace) or "streaming" (appended to trace_writer's file).
+    :return: (agent1_total_score, agent2_total_score, agent1_round_scores, agent2_round_scores);
+             the round scores are int64 arrays when recording "compact", None otherwise.
     """
-    agent1_history = deque(maxlen=env.memory_length)
-    agent2_history = deque(maxlen=env.memory_length)
-    agent1_total_score = 0
-    agent2_total_score = 0
-    agent1_round_scores = []
-    agent2_round_scores = []
-
-    # Reset agents for a new match
-    agent1.reset()
-    agent2.reset()
-
-    if verbose:
-        print(f"\n--- Match: {agent1.name} vs {agent2.name} (Rounds: {num_rounds}) ---")
-
-    for round_num in range(num_rounds):
-        state_for_agent1 = env.get_state(agent1_history, agent2_history)
-        state_for_agent2 = env.get_state(agent2_history, agent1_history)
-
-        if isinstance(agent1, QLearningAgent):
-            action_a1 = agent1.choose_action(state_for_agent1)
-        elif isinstance(agent1, ClassicStrategy):
-            action_a1 = agent1.choose_action(agent2_history)
-        else:
-            raise TypeError(f"Unknown agent type for agent1: {type(agent1)}")
-
-        if isinstance(agent2, QLearningAgent):
-            action_a2 = agent2.choose_action(state_for_agent2)
-        elif isinstance(agent2, ClassicStrategy):
-            action_a2 = agent2.choose_action(agent1_history)
-        else:
-            raise TypeError(f"Unknown agent type for agent2: {type(agent2)}")
-
-        # Special handling for Pavlov and AdaptiveTitForTat
-        if isinstance(agent1, Pavlov):
-            agent1.update_last_actions(action_a1, action_a2)
-        if isinstance(agent2, Pavlov):
-            agent2.update_last_actions(action_a2, action_a1)
-
-        reward_a1, reward_a2 = env.play_round(action_a1, action_a2)
-
-        agent1_total_score += reward_a1
-        agent2_total_score += reward_a2
-        agent1_round_scores.append(reward_a1)
-        agent2_round_scores.append(reward_a2)
-
-        agent1_history.append(action_a1)
-        agent2_history.append(action_a2)
-
-        # NEW: Update strategy for AdaptiveTitForTat if it's one of the agents
-        if isinstance(agent1, AdaptiveTitForTat):
-            agent1.update_strategy(action_a1, action_a2)
-        if isinstance(agent2, AdaptiveTitForTat):
-            agent2.update_strategy(action_a2, action_a1)
-
-        if is_training:
-            next_state_for_agent1 = env.get_state(agent1_history, agent2_history)
-            next_state_for_agent2 = env.get_state(agent2_history, agent1_history)
-
-            if isinstance(agent1, QLearningAgent):
-                agent1.learn(state_for_agent1, action_a1, reward_a1, next_state_for_agent1)
-            if isinstance(agent2, QLearningAgent):
-                agent2.learn(state_for_agent2, action_a2, reward_a2, next_state_for_agent2)
-
-        if verbose:
-            print(f"  Rnd {round_num + 1}: {agent1.name} {env.ACTION_NAMES[action_a1]} ({reward_a1}) "
-                  f"| {agent2.name} {env.ACTION_NAMES[action_a2]} ({reward_a2}) "
-                  f"| Scores: {agent1.name}={agent1_total_score}, {agent2.name}={agent2_total_score}")
-
-    if verbose:
-        print(f"--- Match End --- Final Scores: {agent1.name}={agent1_total_score}, {agent2.name}={agent2_total_score}")
-
-    return agent1_total_score, agent2_total_score, agent1_round_scores, agent2_round_scores
-
-
-def main():
-    # --- Configuration ---
-    NUM_TRAINING_EPISODES = 2000 # How many matches the Q-Learner trains
-    ROUNDS_PER_MATCH = 50       # Number of rounds in each match
-    MEMORY_LENGTH = 1           # How many past moves the state considers (0 for no memory, 1 for last move)
-    NUM_EVAL_MATCHES_PER_PAIR = 50 # How many times each pair plays in evaluation phase
+    return make_kernel(agent1, agent2, env, is_training=is_training, verbose=verbose, profiler=profiler,
+                       record=record, trace_writer=trace_writer).play(num_rounds, seed=seed)
+
+
+# --- Configuration ---
+# Defaults for main() and the command line (cli.py); pass a dict with any of these keys to override them
+DEFAULT_CONFIG = {
+    "num_training_episodes": 2000, # How many matches the Q-Learner trains
+    "num_training_envs": 1,        # Matches trained in lockstep (1 = classic one-episode-at-a-time loop)
+    "num_training_workers": 1,     # Processes training into one shared Q-table (None = all CPUs, 1 = this process only)
+    "training_mode": "hogwild",    # With several workers: "hogwild" (lock-free shared updates) or "average"
+    "self_play": 0.0,              # With several workers: fraction of episodes the QLearner plays against itself
+    "rounds_per_match": 50,        # Number of rounds in each match
+    "memory_length": 1,            # How many past moves the state considers (0 for no memory, 1 for last move)
+    "noise": 0.0,                  # Probability that a played action is flipped ("trembling hand")
+    "seed": None,                  # Master seed of training, noise and the example match (None: not reproducible)
+    "num_eval_matches_per_pair": 50, # Most matches a stochastic pair plays in evaluation phase
+    "eval_ci_half_width": 5.0,     # Stop sampling a pair once its confidence intervals are this narrow (None: always play them all)
+    "eval_confidence": 0.95,       # Confidence level of those intervals
+    "num_eval_workers": None,      # Processes for the evaluation tournament (None = all CPUs)
+    "eval_seed": 0,                # Master seed of the evaluation tournament
+    "payoff_cache_path": "payoff_cache.sqlite", # On-disk cache of pairwise results (None to disable)
+    "show_plots": True,            # Display the training, pairwise-score and example-match plots
+    "plot_dir": None,              # Write the plots as files here instead of displaying them (headless, Agg)
+    "plot_format": "png",          # File format of those plots: "png" or "svg"
+    "plot_max_points": 2000,       # Most points per training curve (longer runs are shown as min/max/mean buckets)
+    "profile": False,              # Time the phases of matches, training and evaluation (see profiling.py)
+    "profile_output": None,        # With profile: write <path>.json and a cProfile-format <path>.prof
+    "checkpoint_path": None,       # Save the trained Q-table here (QLearningAgent.save; None to disable)
+    "checkpoint_every": 0,         # Also save a checkpoint every this many training episodes (0: only at the end)
+    "resume": False,               # Continue training from checkpoint_path if it exists
+    "convergence": None,           # ConvergenceMonitor settings for stopping training early, e.g. {} for its defaults (None: always train the full budget)
+    "planning_steps": 0,           # Prioritized-sweeping backups per real training round (0: plain Q-learning; serial/parallel training)
+}
+
+
+def setup(config: dict = None) -> dict:
+    """
+    Fills in DEFAULT_CONFIG for the keys `config` leaves out and builds what every phase of a run
+    shares: the environment, the seed derivation, the profiler and the plot destinations.
+    :return: The run: a dict with "config", "env", "seed_for", "profiler", "plotting" and "plot_path".
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    SEED = config["seed"]
+    PLOT_DIR = config["plot_dir"]
+    if PLOT_DIR is not None:
+        os.makedirs(PLOT_DIR, exist_ok=True)
 
     # --- Setup Environment ---
-    env = PrisonersDilemma(memory_length=MEMORY_LENGTH)
-
-    # --- Define Agents ---
-    q_agent_train = QLearningAgent(alpha=0.1, gamma=0.9, epsilon=0.2, name="QLearner (Training)")
-    q_agent_eval = q_agent_train
-    q_agent_eval.name = "QLearner (Eval)"
-    q_agent_eval.epsilon = 0.05
-
+    # Every random stream of the run (each match's agents and noise) is derived from SEED
+    seed_for = (lambda *keys: None) if SEED is None else (lambda *keys: derive_seed(SEED, *keys))
+    env = PrisonersDilemma(memory_length=config["memory_length"], noise=config["noise"], seed=seed_for("noise"))
+    return {
+        "config": config,
+        "env": env,
+        "seed_for": seed_for,
+        "profiler": Profiler() if config["profile"] else None,
+        "plotting": config["show_plots"] or PLOT_DIR is not None,
+        # Plots are written to PLOT_DIR when it is set, shown otherwise
+        "plot_path": lambda name: os.path.join(PLOT_DIR, f"{name}.{config['plot_format']}") if PLOT_DIR is not None else None,
+    }
+
+
+def classic_agents() -> list:
     # UPDATED: Add new strategies here
-    classic_agents = [
+    return [
         AlwaysCooperate(),
         AlwaysCheat(),
         TitForTat(),
@@ -123,6 +112,50 @@ def main():
         AdaptiveTitForTat()      # NEW
     ]
 
+
+def load_q_agent(run: dict, mmap_mode: str = None) -> QLearningAgent:
+    """The trained QLearner saved at checkpoint_path, set up for evaluation."""
+    CHECKPOINT_PATH = run["config"]["checkpoint_path"]
+    if not CHECKPOINT_PATH or not os.path.exists(CHECKPOINT_PATH):
+        raise FileNotFoundError(f"No trained QLearner at checkpoint_path={CHECKPOINT_PATH!r}; run training first.")
+    q_agent_eval = QLearningAgent.load(CHECKPOINT_PATH, name="QLearner (Eval)", mmap_mode=mmap_mode)
+    q_agent_eval.epsilon = 0.05
+    return q_agent_eval
+
+
+def train(run: dict) -> tuple:
+    """
+    Training phase: trains the QLearner (resuming from checkpoint_path if asked) and saves it
+    there, if set.
+    :return: (QLearner, the SeriesDecimator summary of its training scores)
+    """
+    config, env, seed_for, profiler = run["config"], run["env"], run["seed_for"], run["profiler"]
+    NUM_TRAINING_EPISODES = config["num_training_episodes"]
+    NUM_TRAINING_ENVS = config["num_training_envs"]
+    NUM_TRAINING_WORKERS = config["num_training_workers"]
+    ROUNDS_PER_MATCH = config["rounds_per_match"]
+    MEMORY_LENGTH = config["memory_length"]
+    CHECKPOINT_PATH = config["checkpoint_path"]
+    CHECKPOINT_EVERY = config["checkpoint_every"]
+    SEED = config["seed"]
+
+    # --- Define Agents ---
+    if CHECKPOINT_PATH and config["resume"] and os.path.exists(CHECKPOINT_PATH):
+        # num_training_episodes is the total: only the episodes the checkpoint is missing are played
+        q_agent_train = QLearningAgent.load(CHECKPOINT_PATH, name="QLearner (Training)")
+        if q_agent_train.memory_length != MEMORY_LENGTH:
+            raise ValueError(f"Checkpoint {CHECKPOINT_PATH} has memory_length={q_agent_train.memory_length}, "
+                             f"but the environment uses {MEMORY_LENGTH}.")
+        print(f"Resuming from checkpoint {CHECKPOINT_PATH} ({q_agent_train.episodes_trained} episodes trained)")
+        if config["planning_steps"]: # Checkpoints hold the Q-table only: the model is learnt again
+            q_agent_train.planner = PrioritizedSweeping(config["planning_steps"])
+    else:
+        q_agent_train = QLearningAgent(alpha=0.1, gamma=0.9, epsilon=0.2, name="QLearner (Training)", memory_length=MEMORY_LENGTH,
+                                       planning_steps=config["planning_steps"])
+    q_agent_eval = q_agent_train
+    q_agent_eval.name = "QLearner (Eval)"
+    q_agent_eval.epsilon = 0.05
+
     print(f"--- Starting RL Training ({NUM_TRAINING_EPISODES} episodes, {ROUNDS_PER_MATCH} rounds/episode) ---")
     print(f"RL Agent: {q_agent_train.name} (alpha={q_agent_train.alpha}, gamma={q_agent_train.gamma}, epsilon={q_agent_train.epsilon})")
     print(f"Environment Memory Length: {MEMORY_LENGTH}\n")
@@ -133,59 +166,140 @@ def main():
         TitForTwoTats(), TwoTitsForTat(), GenerousTitForTat(), AdaptiveTitForTat()
     ]
 
-    q_learner_training_scores = []
-
-    for episode in range(NUM_TRAINING_EPISODES):
-        opponent_class = random.choice([type(a) for a in training_opponents])
-        current_opponent = opponent_class()
-
-        q_score, opponent_score, _, _ = run_match(q_agent_train, current_opponent, ROUNDS_PER_MATCH, env, is_training=True)
-        q_learner_training_scores.append(q_score)
-
-        if (episode + 1) % (NUM_TRAINING_EPISODES // 10) == 0 or episode == 0:
-            print(f"Training Episode {episode + 1}/{NUM_TRAINING_EPISODES}. "
-                  f"{q_agent_train.name} Score: {q_score} (vs {current_opponent.name}). "
-                  f"Avg Q-Score so far: {sum(q_learner_training_scores)/(episode+1):.2f}")
-            sys.stdout.flush()
-
+    # Summarized as training runs, so the training plot costs the same whatever the number of episodes
+    training_curve = SeriesDecimator(config["plot_max_points"])
+    first_episode = q_agent_train.episodes_trained
+    # Stops training once the greedy policy and the rolling score have settled (see training.ConvergenceMonitor)
+    monitor = ConvergenceMonitor(**config["convergence"]) if config["convergence"] is not None else None
+    with phase(profiler, "main.training"):
+        if NUM_TRAINING_WORKERS != 1:
+            training_scores, _ = train_q_agent_parallel(q_agent_train, training_opponents,
+                                                        max(0, NUM_TRAINING_EPISODES - first_episode),
+                                                        ROUNDS_PER_MATCH, env, workers=NUM_TRAINING_WORKERS,
+                                                        self_play=config["self_play"],
+                                                        mode=config["training_mode"],
+                                                        checkpoint_path=CHECKPOINT_PATH,
+                                                        checkpoint_every=CHECKPOINT_EVERY,
+                                                        monitor=monitor, seed=seed_for("training"))
+        elif NUM_TRAINING_ENVS > 1:
+            training_scores = train_q_agent_batched(q_agent_train, training_opponents,
+                                                    max(0, NUM_TRAINING_EPISODES - first_episode),
+                                                    ROUNDS_PER_MATCH, env, num_envs=NUM_TRAINING_ENVS,
+                                                    rng=make_generator(SEED, "training"),
+                                                    checkpoint_path=CHECKPOINT_PATH,
+                                                    checkpoint_every=CHECKPOINT_EVERY,
+                                                    monitor=monitor)
+            if profiler is not None:
+                profiler.count("training.batched_rounds", len(training_scores) * ROUNDS_PER_MATCH)
+        else:
+            opponent_chooser = make_generator(SEED, "training")
+            # Only a running total and the monitor's window of recent scores are kept, not one score per episode
+            episodes_played = score_sum = 0
+            recent_scores = deque(maxlen=monitor.window if monitor is not None else 1)
+            if SEED is not None:
+                q_agent_train.seed(seed_for("training", "learner"))
+            for episode in range(first_episode, NUM_TRAINING_EPISODES):
+                opponent_class = type(training_opponents[opponent_chooser.integers(len(training_opponents))])
+                current_opponent = opponent_class()
+                if SEED is not None:
+                    seed_agent(current_opponent, seed_for("training", episode))
+
+                q_score, opponent_score, _, _ = run_match(q_agent_train, current_opponent, ROUNDS_PER_MATCH, env, is_training=True,
+                                                          profiler=profiler, record="off")
+                episodes_played += 1
+                score_sum += q_score
+                recent_scores.append(q_score)
+                training_curve.add(q_score)
+                q_agent_train.episodes_trained += 1
+                if CHECKPOINT_PATH and CHECKPOINT_EVERY and (episode + 1) % CHECKPOINT_EVERY == 0:
+                    q_agent_train.save(CHECKPOINT_PATH)
+                if profiler is not None and episode % max(1, NUM_TRAINING_EPISODES // 100) == 0:
+                    profiler.sample_q_table(q_agent_train, episode)
+
+                if (episode + 1) % max(1, NUM_TRAINING_EPISODES // 10) == 0 or episode == first_episode:
+                    print(f"Training Episode {episode + 1}/{NUM_TRAINING_EPISODES}. "
+                          f"{q_agent_train.name} Score: {q_score} (vs {current_opponent.name}). "
+                          f"Avg Q-Score so far: {score_sum / episodes_played:.2f}"
+                          + (f". {monitor.describe_last()}" if monitor is not None and monitor.history else ""))
+                    sys.stdout.flush()
+
+                if monitor is not None and monitor.due(episodes_played) and \
+                        monitor.check(q_agent_train, list(recent_scores), MEMORY_LENGTH, episodes_done=episodes_played):
+                    break
+            if monitor is not None:
+                monitor.finish(episodes_played, NUM_TRAINING_EPISODES - first_episode)
+            if CHECKPOINT_PATH:
+                q_agent_train.save(CHECKPOINT_PATH)
+
+        if training_curve.count == 0: # The batched and parallel trainers return all their scores at the end
+            training_curve.extend(training_scores)
+            del training_scores
+
+    if profiler is not None:
+        profiler.sample_q_table(q_agent_train, q_agent_train.episodes_trained) # Fewer than the budget after an early stop
     print("\n--- Training Complete ---")
+    if monitor is not None:
+        print(f"Training stopped: {monitor.stop_reason}")
 
-    # --- Evaluation Phase ---
-    print(f"\n--- Starting Evaluation ({NUM_EVAL_MATCHES_PER_PAIR} matches per pair) ---")
-    print(f"QLearner Eval Epsilon: {q_agent_eval.epsilon}")
-
-    all_agents_for_eval = [q_agent_eval] + classic_agents
-
-    pairwise_scores = {agent.name: {opponent.name: 0.0 for opponent in all_agents_for_eval} for agent in all_agents_for_eval}
-
-    for i, agent1_template in enumerate(all_agents_for_eval):
-        for j, agent2_template in enumerate(all_agents_for_eval):
-            if i == j:
-                continue
-
-            print(f"  Evaluating: {agent1_template.name} vs {agent2_template.name}...", end='')
-            sys.stdout.flush()
+    return q_agent_train, training_curve
 
-            agent1 = agent1_template if isinstance(agent1_template, QLearningAgent) else type(agent1_template)()
-            agent2 = agent2_template if isinstance(agent2_template, QLearningAgent) else type(agent2_template)()
 
-            total_score_agent1_this_pairing = 0
+def plot_training(run: dict, training_curve):
+    from visualization import plot_scores
+    plot_scores({"QLearner (Training)": training_curve},
+                training_curve.count, run["config"]["rounds_per_match"],
+                "QLearner Cumulative Score During Training (vs. Random Opponents)", path=run["plot_path"]("training_scores"))
 
-            for _ in range(NUM_EVAL_MATCHES_PER_PAIR):
-                s1, s2, _, _ = run_match(agent1, agent2, ROUNDS_PER_MATCH, env, is_training=False, verbose=False)
-                total_score_agent1_this_pairing += s1
 
-            avg_score_agent1_vs_agent2 = total_score_agent1_this_pairing / NUM_EVAL_MATCHES_PER_PAIR
+def evaluate(run: dict, agents: list) -> tuple:
+    """
+    Evaluation phase: a round-robin tournament between `agents`, printed as a pairwise table with
+    confidence intervals and as average scores per strategy (and plotted as a heatmap).
+    :return: (pairwise_scores, pairwise_ci) as returned by run_tournament.
+    """
+    import pandas as pd
 
-            pairwise_scores[agent1_template.name][agent2_template.name] = avg_score_agent1_vs_agent2
-            print(" Done.")
-            sys.stdout.flush()
+    config, env, profiler = run["config"], run["env"], run["profiler"]
+    NUM_EVAL_MATCHES_PER_PAIR = config["num_eval_matches_per_pair"]
+    EVAL_CI_HALF_WIDTH = config["eval_ci_half_width"]
+    EVAL_CONFIDENCE = config["eval_confidence"]
+    PAYOFF_CACHE_PATH = config["payoff_cache_path"]
 
-    print("\n--- Pairwise Average Scores (rows play against columns) ---")
+    # --- Evaluation Phase ---
+    if EVAL_CI_HALF_WIDTH is None:
+        print(f"\n--- Starting Evaluation ({NUM_EVAL_MATCHES_PER_PAIR} matches per pair) ---")
+    else:
+        print(f"\n--- Starting Evaluation (up to {NUM_EVAL_MATCHES_PER_PAIR} matches per pair, "
+              f"until ±{EVAL_CI_HALF_WIDTH} at {EVAL_CONFIDENCE:.0%} confidence) ---")
+    for agent in agents:
+        if isinstance(agent, QLearningAgent):
+            print(f"{agent.name} Epsilon: {agent.epsilon}")
+
+    # Each unordered pairing is played once, in parallel, with its own RNG stream derived from eval_seed
+    # Deterministic pairings are played once, stochastic ones sampled until their confidence intervals are narrow enough
+    # Pairings whose agents and settings are unchanged since an earlier run are read from the cache
+    with phase(profiler, "main.evaluation"):
+        payoff_cache = PayoffCache(PAYOFF_CACHE_PATH) if PAYOFF_CACHE_PATH else None
+        if payoff_cache is not None:
+            payoff_cache.invalidate_stale()
+        pairwise_scores, pairwise_ci = run_tournament(agents, config["rounds_per_match"], NUM_EVAL_MATCHES_PER_PAIR,
+                                                      env, master_seed=config["eval_seed"],
+                                                      workers=config["num_eval_workers"],
+                                                      cache=payoff_cache, profiler=profiler,
+                                                      target_ci=EVAL_CI_HALF_WIDTH, confidence=EVAL_CONFIDENCE)
+        if payoff_cache is not None:
+            payoff_cache.close()
+
+    print(f"\n--- Pairwise Average Scores ± {EVAL_CONFIDENCE:.0%} CI (rows play against columns) ---")
     df_pairwise_scores = pd.DataFrame(pairwise_scores).transpose()
+    df_pairwise_ci = pd.DataFrame(pairwise_ci).transpose()
     for agent_name in df_pairwise_scores.index:
         df_pairwise_scores.loc[agent_name, agent_name] = float('nan')
-    print(df_pairwise_scores.round(2))
+        df_pairwise_ci.loc[agent_name, agent_name] = float('nan')
+    df_pairwise_display = df_pairwise_scores.round(2).astype(str) + " ± " + df_pairwise_ci.round(2).astype(str)
+    for agent_name in df_pairwise_display.index:
+        df_pairwise_display.loc[agent_name, agent_name] = "-"
+    print(df_pairwise_display)
 
     final_avg_scores = {}
     for agent_name, scores_dict in pairwise_scores.items():
@@ -200,19 +314,57 @@ def main():
     for name, score in sorted_scores:
         print(f"  {name}: {score:.2f}")
 
-    # --- Visualization ---
+    if run["plotting"]:
+        from visualization import plot_pairwise_heatmap
+        plot_pairwise_heatmap(df_pairwise_scores, ci=df_pairwise_ci, path=run["plot_path"]("pairwise_scores"))
+    return pairwise_scores, pairwise_ci
 
-    plot_scores({"QLearner (Training)": q_learner_training_scores},
-                NUM_TRAINING_EPISODES, ROUNDS_PER_MATCH,
-                "QLearner Cumulative Score During Training (vs. Random Opponents)")
 
-    print("\n--- Showing an example match: QLearner (Eval) vs TitForTat (verbose) ---")
+def demo(run: dict, q_agent_eval: QLearningAgent) -> tuple:
+    """Plays and prints (verbose) one example match of the greedy QLearner against TitForTat."""
+    ROUNDS_PER_MATCH = run["config"]["rounds_per_match"]
+    print(f"\n--- Showing an example match: {q_agent_eval.name} vs TitForTat (verbose) ---")
     q_agent_eval.epsilon = 0.0
     tft_agent_demo = TitForTat()
 
-    q_scores, tft_scores, q_round_scores, tft_round_scores = run_match(q_agent_eval, tft_agent_demo, ROUNDS_PER_MATCH, env, is_training=False, verbose=True)
-    plot_single_match_scores(q_agent_eval.name, tft_agent_demo.name, q_round_scores, tft_round_scores, ROUNDS_PER_MATCH)
+    result = run_match(q_agent_eval, tft_agent_demo, ROUNDS_PER_MATCH, run["env"], is_training=False, verbose=True,
+                       profiler=run["profiler"], seed=run["seed_for"]("demo"))
+    if run["plotting"]:
+        from visualization import plot_single_match_scores
+        q_scores, tft_scores, q_round_scores, tft_round_scores = result
+        plot_single_match_scores(q_agent_eval.name, tft_agent_demo.name, q_round_scores, tft_round_scores, ROUNDS_PER_MATCH,
+                                 path=run["plot_path"]("example_match"))
+    return result
+
+
+def report_profile(run: dict):
+    profiler, config = run["profiler"], run["config"]
+    if profiler is not None:
+        print("\n--- Profile ---")
+        print(profiler.report())
+        if config["profile_output"]:
+            profiler.to_json(config["profile_output"] + ".json")
+            profiler.dump_stats(config["profile_output"] + ".prof")
+            print(f"Profile written to {config['profile_output']}.json and {config['profile_output']}.prof")
+
+
+def main(config: dict = None):
+    """The whole pipeline: training, evaluation of the QLearner against the classic strategies, example match."""
+    run = setup(config)
+    q_agent_eval, training_curve = train(run)
+    if run["config"]["checkpoint_path"]:
+        # Evaluation workers then map the saved Q-table read-only instead of each unpickling a copy
+        q_agent_eval = load_q_agent(run, mmap_mode="r")
+    evaluate(run, [q_agent_eval] + classic_agents())
+
+    # --- Visualization ---
+    if run["plotting"]:
+        plot_training(run, training_curve)
+    demo(run, q_agent_eval)
+    report_profile(run)
+    return run["profiler"]
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    from cli import run_cli
+    sys.exit(run_cli())
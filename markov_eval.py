@@ -0,0 +1,105 @@
+# markov_eval.py
+
+import numpy as np
+
+from game_environment import PrisonersDilemma
+from rl_agents import QLearningAgent
+from classic_strategies import (
+    AlwaysCooperate, AlwaysCheat, TitForTat, Grudger, Pavlov, RandomStrategy,
+    TitForTwoTats, GenerousTitForTat
+)
+
+COOPERATE = PrisonersDilemma.COOPERATE
+CHEAT = PrisonersDilemma.CHEAT
+
+# Outcomes of a round, seen from one player: index = own_action * 2 + opponent_action
+OUTCOMES = [(COOPERATE, COOPERATE), (COOPERATE, CHEAT), (CHEAT, COOPERATE), (CHEAT, CHEAT)]
+SWAPPED = [own * 2 + opponent for opponent, own in OUTCOMES] # The same outcome seen by the other player
+
+
+def memory_one_vector(agent, memory_length: int, noise: float = 0.0):
+    """
+    Expresses an agent as a memory-one strategy: its probability of cooperating in the first
+    round, and after each outcome of the previous round (ordered as OUTCOMES).
+    :param agent: A classic strategy or a (non-learning) QLearningAgent.
+    :param memory_length: The environment's memory length (the agent's visible history window).
+    :param noise: The environment's execution noise; the vector is still the intended play, but some
+                  agents only act on the previous round alone when no move is ever flipped.
+    :return: (p_first, p_after) with p_after an array of 4 probabilities, or None if the agent's
+             play depends on more than the previous round.
+    """
+    kind = type(agent)
+    if kind is AlwaysCooperate:
+        return 1.0, np.ones(4)
+    if kind is AlwaysCheat:
+        return 0.0, np.zeros(4)
+    if kind is RandomStrategy:
+        return 0.5, np.full(4, 0.5)
+    if kind is Pavlov: # Stays after equal moves, shifts otherwise: always ends up on the opponent's move
+        return 1.0, np.array([1.0, 0.0, 1.0, 0.0])
+    if kind in (TitForTat, Grudger, TitForTwoTats, GenerousTitForTat) and memory_length == 0:
+        return 1.0, np.ones(4) # They never see any history, so they always cooperate
+    if kind is TitForTat:
+        return 1.0, np.array([1.0, 0.0, 1.0, 0.0])
+    if kind is Grudger and not noise: # Only mutual cooperation so far keeps it cooperating
+        return 1.0, np.array([1.0, 0.0, 0.0, 0.0])
+    if kind is TitForTwoTats and memory_length == 1: # Never sees two moves, so never retaliates
+        return 1.0, np.ones(4)
+    if kind is GenerousTitForTat:
+        forgive = agent.forgiveness_prob
+        return 1.0, np.array([1.0, forgive, 1.0, forgive])
+    if kind is QLearningAgent and memory_length <= 1:
+        def p_cooperate(state):
+            q_values = agent.q_values(state)
+            greedy = 1.0 if q_values[COOPERATE] >= q_values[CHEAT] else 0.0
+            return (1 - agent.epsilon) * greedy + agent.epsilon * 0.5
+        if memory_length == 0:
+            p = p_cooperate(((), ()))
+            return p, np.full(4, p)
+        return p_cooperate(((-1,), (-1,))), np.array([p_cooperate(((own,), (opponent,))) for own, opponent in OUTCOMES])
+    return None
+
+
+def _joint_distribution(p1: float, p2: float) -> np.ndarray:
+    """Distribution over OUTCOMES (player 1's view) when the players cooperate with p1 and p2."""
+    return np.array([p1 * p2, p1 * (1 - p2), (1 - p1) * p2, (1 - p1) * (1 - p2)])
+
+
+def expected_scores(agent1, agent2, num_rounds: int, env: PrisonersDilemma):
+    """
+    Exact expected total scores of a match between two memory-one agents.
+    The previous round's outcome is a 4-state Markov chain with transition matrix M and first-round
+    distribution v0, so the expected total is v0 (I + M + ... + M^(R-1)) r. The geometric sum is
+    the top-right block of [[M, I], [0, I]]^R, computed with O(log R) matrix products.
+    With execution noise e, an agent that means to cooperate with probability p plays C with
+    probability p (1 - e) + (1 - p) e, and the chain runs on the actions actually played.
+    :return: (expected_score_agent1, expected_score_agent2), or None if either agent is not memory-one.
+    """
+    vector1 = memory_one_vector(agent1, env.memory_length, env.noise)
+    vector2 = memory_one_vector(agent2, env.memory_length, env.noise)
+    if vector1 is None or vector2 is None:
+        return None
+    (first1, after1), (first2, after2) = vector1, vector2
+    if env.noise:
+        first1, after1, first2, after2 = (p * (1 - env.noise) + (1 - p) * env.noise
+                                          for p in (first1, after1, first2, after2))
+
+    start = _joint_distribution(first1, first2)
+    transitions = np.array([_joint_distribution(after1[o], after2[SWAPPED[o]]) for o in range(4)])
+    block = np.zeros((8, 8))
+    block[:4, :4] = transitions
+    block[:4, 4:] = np.eye(4)
+    block[4:, 4:] = np.eye(4)
+    visits = start @ np.linalg.matrix_power(block, num_rounds)[:4, 4:] # Expected visits per outcome
+
+    rewards = np.array([env.PAYOFF_MATRIX[own, opponent] for own, opponent in OUTCOMES], dtype=np.float64)
+    score1, score2 = visits @ rewards
+    return float(score1), float(score2)
+
+
+# Example Usage
+if __name__ == "__main__":
+    env = PrisonersDilemma(memory_length=1)
+    print(f"GenerousTitForTat vs Random: {expected_scores(GenerousTitForTat(), RandomStrategy(), 50, env)}")
+    print(f"Pavlov vs Random: {expected_scores(Pavlov(), RandomStrategy(), 50, env)}")
+    print(f"TitForTat vs AlwaysCheat: {expected_scores(TitForTat(), AlwaysCheat(), 50, env)}")
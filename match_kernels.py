@@ -0,0 +1,315 @@
+# match_kernels.py
+
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from game_environment import PrisonersDilemma, MatchHistory
+from classic_strategies import ClassicStrategy
+from rng import seed_match
+from traces import RECORD_LEVELS, MatchTrace, TraceWriter
+
+
+def observer(agent):
+    """
+    The agent's per-round observe callback, or None if it has none (or only the no-op default).
+    Anything driving agents round by round (kernels, match_server's local seats) calls it after each round.
+    """
+    observe = getattr(agent, "observe", None)
+    if observe is None or getattr(type(agent), "observe", None) is ClassicStrategy.observe:
+        return None
+    return observe
+
+
+class MatchKernel:
+    """
+    The round loop of one pairing, with its code path resolved once instead of every round.
+
+    Agents follow a small protocol (see ClassicStrategy): `name`, `reset()`, `choose_action(observation)`,
+    an `observes` attribute ("history", the default, or "state"), an optional per-round
+    `observe(own_action, opponent_action)` callback and, for learners, `learn(state, action, reward, next_state)`.
+    "state" agents are given integer state codes if they have a dense Q-table (`dense`) and every
+    state-reading agent in the match accepts them, get_state tuples otherwise. Learners that build
+    their own inputs through observe (`learns_from_observations`, e.g. LinearQAgent) need neither.
+    Training, evaluation and verbose/profiled play each have their own loop. With execution noise
+    (PrisonersDilemma(noise=...)) the action methods are wrapped once by env.trembling.
+    The loops only keep totals; rounds are recorded (`record`, see traces.RECORD_LEVELS) from the
+    players' move logs, after the match or, when streaming, after every trace_writer.chunk_rounds rounds.
+    """
+    def __init__(self, agent1, agent2, env: PrisonersDilemma, is_training: bool = False, verbose: bool = False,
+                 profiler=None, record: str = "compact", trace_writer: TraceWriter = None):
+        if record not in RECORD_LEVELS:
+            raise ValueError(f"Unknown record level {record!r}; expected one of {RECORD_LEVELS}.")
+        if (record == "streaming") != (trace_writer is not None):
+            raise ValueError("record='streaming' needs a trace_writer, and only it uses one.")
+        for agent in (agent1, agent2):
+            if not callable(getattr(agent, "choose_action", None)):
+                raise TypeError(f"Unknown agent type: {type(agent)}")
+            if getattr(agent, "observes", "history") not in ("history", "state"):
+                raise ValueError(f"{agent.name}: observes must be 'history' or 'state', not {agent.observes!r}.")
+        self.agent1 = agent1
+        self.agent2 = agent2
+        self.env = env
+        self.is_training = is_training
+        self.verbose = verbose
+        self.profiler = profiler
+        self.record = record
+        self.trace_writer = trace_writer
+        self.trace = None # MatchTrace of the last match, when recording "compact"
+
+        self.learn1 = getattr(agent1, "learn", None) if is_training else None
+        self.learn2 = getattr(agent2, "learn", None) if is_training else None
+        self.reads_state1 = getattr(agent1, "observes", "history") == "state"
+        self.reads_state2 = getattr(agent2, "observes", "history") == "state"
+        state_users = [agent for agent, learn, reads_state in ((agent1, self.learn1, self.reads_state1),
+                                                               (agent2, self.learn2, self.reads_state2))
+                       if reads_state or (learn is not None and not getattr(agent, "learns_from_observations", False))]
+        for agent in state_users:
+            # State codes (and tuples) only index a dense Q-table built for the environment's memory length
+            if getattr(agent, "dense", False) and agent.memory_length != env.memory_length:
+                raise ValueError(f"{agent.name}: its dense Q-table has memory_length={agent.memory_length}, "
+                                 f"but the environment uses {env.memory_length}.")
+        # Dense Q-tables read the environment's rolling integer state; anything else needs get_state tuples
+        self.tuple_states = any(not getattr(agent, "dense", False) for agent in state_users)
+
+        self.act1 = env.trembling(self._action_method(agent1))
+        self.act2 = env.trembling(self._action_method(agent2))
+        if self.learn1 is not None and not self.tuple_states:
+            self.learn1 = getattr(agent1, "learn_index", self.learn1)
+        if self.learn2 is not None and not self.tuple_states:
+            self.learn2 = getattr(agent2, "learn_index", self.learn2)
+        self.observe1 = observer(agent1)
+        self.observe2 = observer(agent2)
+
+        if verbose or profiler is not None:
+            self.loop = self._instrumented_loop
+        elif is_training:
+            self.loop = self._train_loop
+        else:
+            self.loop = self._eval_loop
+
+    def _action_method(self, agent):
+        # Dense agents take integer state codes directly when the whole match uses them
+        if getattr(agent, "observes", "history") == "state" and not self.tuple_states:
+            return getattr(agent, "choose_action_index", agent.choose_action)
+        return agent.choose_action
+
+    def play(self, num_rounds: int, seed=None):
+        """
+        Plays one match from the start (agents are reset first).
+        :param seed: If given, the agents' and the noise's random streams are first restarted from
+                     streams derived from it (rng.seed_match), which makes the match reproducible.
+        :return: (agent1_total_score, agent2_total_score, agent1_round_scores, agent2_round_scores);
+                 the round scores are int64 arrays when recording "compact" (the whole trace, actions
+                 included, is then `self.trace`, stored as int8), None otherwise.
+        """
+        if seed is not None:
+            seed_match(self.agent1, self.agent2, self.env, seed)
+        self.agent1.reset()
+        self.agent2.reset()
+        memory_length = self.env.memory_length
+        match_state = self.env.start_match()
+        # Strategies see the last memory_length moves, plus O(1) summaries of the whole match; the move
+        # logs are only kept when a trace is built from them
+        logged = self.record != "off"
+        history1 = MatchHistory(window=memory_length, log=logged)
+        history2 = MatchHistory(window=memory_length, log=logged)
+
+        if self.record == "streaming":
+            return self._stream(num_rounds, match_state, history1, history2)
+        total1, total2 = self.loop(num_rounds, match_state, history1, history2)
+        if self.record == "off":
+            return total1, total2, None, None
+        self.trace = MatchTrace.from_histories(history1, history2)
+        # Widened so that summing them (even with the builtin sum) cannot overflow int8
+        return total1, total2, self.trace.rewards1.astype(np.int64), self.trace.rewards2.astype(np.int64)
+
+    __call__ = play
+
+    def _stream(self, num_rounds, match_state, history1, history2):
+        """Plays the match chunk by chunk, appending each chunk's rounds to the trace writer."""
+        writer = self.trace_writer
+        # The instrumented loop prints and times whole matches, so it is not split
+        chunk = max(1, num_rounds) if self.loop == self._instrumented_loop else writer.chunk_rounds
+        total1 = total2 = 0
+        writer.begin_match(self.agent1.name, self.agent2.name)
+        for start in range(0, num_rounds, chunk):
+            score1, score2 = self.loop(min(chunk, num_rounds - start), match_state, history1, history2)
+            total1 += score1
+            total2 += score2
+            writer.write(history1.spill(), history2.spill())
+        writer.end_match()
+        return total1, total2, None, None
+
+    def _states(self, match_state, history1, history2):
+        if self.tuple_states:
+            return self.env.get_state(history1, history2), self.env.get_state(history2, history1)
+        return match_state.p1_state, match_state.p2_state
+
+    def _eval_loop(self, num_rounds, match_state, history1, history2):
+        act1, act2 = self.act1, self.act2
+        reads_state1, reads_state2 = self.reads_state1, self.reads_state2
+        observe1, observe2 = self.observe1, self.observe2
+        tuple_states = self.tuple_states
+        get_state = self.env.get_state
+        play_round = self.env.play_round
+        append1, append2, push = history1.append, history2.append, match_state.push
+        total1 = total2 = 0
+        state1 = state2 = None
+
+        for _ in range(num_rounds):
+            if tuple_states:
+                state1 = get_state(history1, history2)
+                state2 = get_state(history2, history1)
+            else:
+                state1 = match_state.p1_state
+                state2 = match_state.p2_state
+            action1 = act1(state1 if reads_state1 else history2)
+            action2 = act2(state2 if reads_state2 else history1)
+            reward1, reward2 = play_round(action1, action2)
+            total1 += reward1
+            total2 += reward2
+            append1(action1)
+            append2(action2)
+            push(action1, action2)
+            if observe1 is not None:
+                observe1(action1, action2)
+            if observe2 is not None:
+                observe2(action2, action1)
+
+        return total1, total2
+
+    def _train_loop(self, num_rounds, match_state, history1, history2):
+        act1, act2 = self.act1, self.act2
+        reads_state1, reads_state2 = self.reads_state1, self.reads_state2
+        observe1, observe2 = self.observe1, self.observe2
+        learn1, learn2 = self.learn1, self.learn2
+        tuple_states = self.tuple_states
+        get_state = self.env.get_state
+        play_round = self.env.play_round
+        append1, append2, push = history1.append, history2.append, match_state.push
+        total1 = total2 = 0
+        state1, state2 = self._states(match_state, history1, history2)
+
+        for _ in range(num_rounds):
+            action1 = act1(state1 if reads_state1 else history2)
+            action2 = act2(state2 if reads_state2 else history1)
+            reward1, reward2 = play_round(action1, action2)
+            total1 += reward1
+            total2 += reward2
+            append1(action1)
+            append2(action2)
+            push(action1, action2)
+            if observe1 is not None:
+                observe1(action1, action2)
+            if observe2 is not None:
+                observe2(action2, action1)
+
+            # The next states are also the states the next round is played from
+            if tuple_states:
+                next_state1 = get_state(history1, history2)
+                next_state2 = get_state(history2, history1)
+            else:
+                next_state1 = match_state.p1_state
+                next_state2 = match_state.p2_state
+            if learn1 is not None:
+                learn1(state1, action1, reward1, next_state1)
+            if learn2 is not None:
+                learn2(state2, action2, reward2, next_state2)
+            state1 = next_state1
+            state2 = next_state2
+
+        return total1, total2
+
+    def _instrumented_loop(self, num_rounds, match_state, history1, history2):
+        """The general loop: optional learning, per-round printing and per-phase timing (see profiling.py)."""
+        agent1, agent2, env = self.agent1, self.agent2, self.env
+        verbose, profiler = self.verbose, self.profiler
+        timed = profiler is not None
+        clock = time.perf_counter
+        match_start = clock()
+        phase_times = defaultdict(float)
+        choose1 = f"run_match.choose_action:{type(agent1).__name__}"
+        choose2 = f"run_match.choose_action:{type(agent2).__name__}"
+        total1 = total2 = 0
+
+        if verbose:
+            print(f"\n--- Match: {agent1.name} vs {agent2.name} (Rounds: {num_rounds}) ---")
+
+        for round_num in range(num_rounds):
+            t0 = clock() if timed else 0.0
+            state1, state2 = self._states(match_state, history1, history2)
+            if timed:
+                t1 = clock()
+                phase_times["run_match.state"] += t1 - t0
+
+            action1 = self.act1(state1 if self.reads_state1 else history2)
+            if timed:
+                t2 = clock()
+                phase_times[choose1] += t2 - t1
+            action2 = self.act2(state2 if self.reads_state2 else history1)
+            if timed:
+                t3 = clock()
+                phase_times[choose2] += t3 - t2
+
+            reward1, reward2 = env.play_round(action1, action2)
+            if timed:
+                t4 = clock()
+                phase_times["run_match.play_round"] += t4 - t3
+
+            total1 += reward1
+            total2 += reward2
+            history1.append(action1)
+            history2.append(action2)
+            match_state.push(action1, action2)
+            if self.observe1 is not None:
+                self.observe1(action1, action2)
+            if self.observe2 is not None:
+                self.observe2(action2, action1)
+            if timed:
+                t5 = clock()
+                phase_times["run_match.update"] += t5 - t4
+
+            if self.is_training:
+                next_state1, next_state2 = self._states(match_state, history1, history2)
+                if self.learn1 is not None:
+                    self.learn1(state1, action1, reward1, next_state1)
+                if self.learn2 is not None:
+                    self.learn2(state2, action2, reward2, next_state2)
+                if timed:
+                    t6 = clock()
+                    phase_times["run_match.learn"] += t6 - t5
+                    t5 = t6
+
+            if verbose:
+                print(f"  Rnd {round_num + 1}: {agent1.name} {env.ACTION_NAMES[action1]} ({reward1}) "
+                      f"| {agent2.name} {env.ACTION_NAMES[action2]} ({reward2}) "
+                      f"| Scores: {agent1.name}={total1}, {agent2.name}={total2}")
+                if timed:
+                    phase_times["run_match.verbose"] += clock() - t5
+
+        if verbose:
+            print(f"--- Match End --- Final Scores: {agent1.name}={total1}, {agent2.name}={total2}")
+
+        if timed:
+            for phase_name, seconds in phase_times.items():
+                profiler.add(phase_name, seconds, num_rounds)
+            profiler.record_match(agent1, agent2, clock() - match_start, num_rounds)
+            profiler.count("run_match.matches")
+            profiler.count("run_match.rounds", num_rounds)
+            if self.is_training:
+                profiler.count("run_match.learn_updates",
+                               num_rounds * ((self.learn1 is not None) + (self.learn2 is not None)))
+
+        return total1, total2
+
+
+def make_kernel(agent1, agent2, env: PrisonersDilemma, is_training: bool = False, verbose: bool = False,
+                profiler=None, record: str = "compact", trace_writer: TraceWriter = None) -> MatchKernel:
+    """
+    Resolves the pairing's code path once; the returned kernel can play any number of matches
+    between these two agent objects (`kernel.play(num_rounds)`).
+    """
+    return MatchKernel(agent1, agent2, env, is_training=is_training, verbose=verbose, profiler=profiler,
+                       record=record, trace_writer=trace_writer)
@@ -0,0 +1,565 @@
+# match_server.py
+
+# Asyncio match server: agents running in other processes (any language) connect over local TCP or a
+# Unix socket, are paired by a round-robin tournament scheduler and play their matches through a
+# line protocol. One connection can play many matches at once, so thousands of matches run
+# concurrently in one event loop.
+#
+# Protocol: one ASCII line per message, fields separated by spaces; match ids are integers, actions
+# are C (Cooperate) or D (Cheat; 0 and 1 are accepted too).
+#
+#   client -> server
+#     HELLO <name> [<tournament> [<max matches>]]   join a tournament (default "default"), playing at
+#                                                   most <max matches> matches at once
+#     ACT <match> <round> <C|D>                     answer to a MOVE (an answer to any other round
+#                                                   than the awaited one, e.g. a late one, is an ERROR)
+#     BYE                                           leave (unplayed moves are forfeited)
+#   server -> client
+#     WELCOME <name> <tournament>                   joined, under this (possibly deduplicated) name
+#     START <match> <opponent> <rounds>             a match begins
+#     MOVE <match> <round>                          your action for this round (rounds count from 1)
+#     RESULT <match> <own action> <opponent action> <own reward>
+#     END <match> <own total> <opponent total>
+#     DONE <tournament>                             all the tournament's matches are over
+#     ERROR <message>
+#
+# A tournament starts once `players` clients have joined it. Every pair of its entrants (the clients
+# plus the server's in-process local agents) plays `matches_per_pair` matches; moves not answered
+# within `move_timeout` seconds, or owed by a client that left, are played as `timeout_action`.
+# Backpressure: a client never has more than its <max matches> matches running, the server never
+# more than max_active_matches, and a match waits for a client's socket to drain whenever more than
+# write_buffer_limit bytes are queued for it.
+#
+#     python match_server.py serve --port 8765 --players 4 --local TitForTat,AlwaysCheat
+#     python match_server.py loadtest --clients 400 --players 4
+
+import argparse
+import asyncio
+import collections
+import copy
+import itertools
+import json
+import time
+
+import numpy as np
+
+from game_environment import PrisonersDilemma, MatchHistory
+from match_kernels import observer
+from rng import derive_seed, seed_agent
+import classic_strategies
+
+ACTION_LETTERS = "CD" # Indexed by action
+_ACTIONS = {b"C": PrisonersDilemma.COOPERATE, b"D": PrisonersDilemma.CHEAT,
+            b"0": PrisonersDilemma.COOPERATE, b"1": PrisonersDilemma.CHEAT}
+
+
+MAX_LINE = 4096 # Longest line accepted from a client
+
+
+async def _line_batches(reader: asyncio.StreamReader, chunk_size: int = 1 << 16):
+    """
+    Reads `reader` a chunk (often many lines) at a time, yielding the split fields of the chunk's
+    complete non-blank lines as one list, so the caller can answer them all with one write.
+    """
+    partial = b""
+    while True:
+        chunk = await reader.read(chunk_size)
+        if not chunk:
+            return
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        if len(partial) > MAX_LINE:
+            raise ValueError("Line too long.")
+        batch = [fields for fields in map(bytes.split, lines) if fields]
+        if batch:
+            yield batch
+
+
+class _Connection:
+    """One client: its socket, the moves asked of it and not yet answered, and its match slots."""
+    def __init__(self, server: "MatchServer", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.name = None
+        self.tournament = None
+        self.slots = None    # Semaphore of the matches it may play at once
+        self.pending = {}    # match id -> (round asked for, future of the action)
+        self.closed = False
+        self.outgoing = []   # Lines sent during this pass of the event loop, written together by _flush
+
+    def send(self, line: str):
+        if self.closed:
+            return
+        if not self.outgoing:
+            self.server.loop.call_soon(self._flush)
+        self.outgoing.append(line)
+
+    def _flush(self):
+        # One socket write per connection and event loop pass, however many matches sent lines
+        if not self.closed and self.outgoing:
+            self.writer.write("".join(self.outgoing).encode())
+        self.outgoing.clear()
+
+    async def drain(self):
+        """Waits while too much is queued for this client (it reads slower than its matches write)."""
+        if not self.closed and self.writer.transport.get_write_buffer_size() > self.server.write_buffer_limit:
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                self.close()
+
+    def ask(self, match_id: int, round_num: int) -> asyncio.Future:
+        future = self.server.loop.create_future()
+        if self.closed:
+            future.set_result(self.server.timeout_action)
+            self.server.stats["forfeited_moves"] += 1
+            return future
+        self.pending[match_id] = (round_num, future)
+        self.server._deadlines.append((self.server.loop.time() + self.server.move_timeout, self, match_id, future))
+        self.send(f"MOVE {match_id} {round_num}\n")
+        return future
+
+    def expire(self, match_id: int, future: asyncio.Future):
+        awaited = self.pending.get(match_id)
+        if awaited is not None and awaited[1] is future:
+            del self.pending[match_id]
+            future.set_result(self.server.timeout_action)
+            self.server.stats["timeouts"] += 1
+
+    def answer(self, match_id: int, round_num: int, action: int):
+        awaited = self.pending.get(match_id)
+        if awaited is None:
+            self.send(f"ERROR no move of match {match_id} is awaited\n")
+            return
+        if awaited[0] != round_num:
+            # A late answer (its round was already played as timeout_action) must not become the next move
+            self.send(f"ERROR match {match_id} awaits round {awaited[0]}, not {round_num}\n")
+            return
+        del self.pending[match_id]
+        awaited[1].set_result(action)
+
+    def close(self):
+        """The client is gone: whatever it still owes is forfeited."""
+        if self.closed:
+            return
+        self.closed = True
+        for _, future in self.pending.values():
+            future.set_result(self.server.timeout_action)
+            self.server.stats["forfeited_moves"] += 1
+        self.pending.clear()
+        self.outgoing.clear()
+        self.writer.close()
+
+
+class _RemoteSeat:
+    """A client's side of one match."""
+    __slots__ = ("connection", "match_id")
+
+    def __init__(self, connection: _Connection, match_id: int):
+        self.connection = connection
+        self.match_id = match_id
+
+    def start(self, opponent_name: str, num_rounds: int):
+        self.connection.send(f"START {self.match_id} {opponent_name} {num_rounds}\n")
+
+    def ask(self, round_num: int):
+        return self.connection.ask(self.match_id, round_num)
+
+    def result(self, own_action: int, opponent_action: int, reward: int):
+        self.connection.send(f"RESULT {self.match_id} {ACTION_LETTERS[own_action]} "
+                             f"{ACTION_LETTERS[opponent_action]} {reward}\n")
+
+    def end(self, own_total: int, opponent_total: int):
+        self.connection.send(f"END {self.match_id} {own_total} {opponent_total}\n")
+
+    def drain(self):
+        return self.connection.drain()
+
+
+class _LocalSeat:
+    """An in-process agent's side of one match (its own copy of the agent, as MatchKernel would play it)."""
+    def __init__(self, agent, env: PrisonersDilemma):
+        self.agent = agent
+        self.env = env
+        self.reads_state = getattr(agent, "observes", "history") == "state"
+        self.observe = observer(agent)
+        self.own_history = MatchHistory(window=env.memory_length, log=False)
+        self.opponent_history = MatchHistory(window=env.memory_length, log=False)
+        agent.reset()
+
+    def start(self, opponent_name: str, num_rounds: int):
+        pass
+
+    def ask(self, round_num: int) -> int:
+        if self.reads_state:
+            return self.agent.choose_action(self.env.get_state(self.own_history, self.opponent_history))
+        return self.agent.choose_action(self.opponent_history)
+
+    def result(self, own_action: int, opponent_action: int, reward: int):
+        self.own_history.append(own_action)
+        self.opponent_history.append(opponent_action)
+        if self.observe is not None:
+            self.observe(own_action, opponent_action)
+
+    def end(self, own_total: int, opponent_total: int):
+        pass
+
+    async def drain(self):
+        pass
+
+
+class _Tournament:
+    """The entrants of one tournament and, once it is full, the round robin of their matches."""
+    def __init__(self, server: "MatchServer", name: str):
+        self.server = server
+        self.name = name
+        self.connections = []
+        self.names = {agent.name for agent in server.local_agents}
+        self.started = False
+        self.results = server.loop.create_future() # Set to the pairwise scores when every match is over
+
+    def join(self, connection: _Connection, name: str) -> str:
+        unique = name
+        for k in itertools.count(2):
+            if unique not in self.names:
+                break
+            unique = f"{name}#{k}"
+        self.names.add(unique)
+        self.connections.append(connection)
+        if len(self.connections) == self.server.players:
+            self.started = True
+            task = asyncio.ensure_future(self._run())
+            self.server._tasks.add(task)
+            task.add_done_callback(self.server._tasks.discard)
+        return unique
+
+    async def _run(self):
+        server = self.server
+        entrants = [(connection.name, connection) for connection in self.connections] + \
+                   [(agent.name, agent) for agent in server.local_agents]
+        pairings = [(i, j) for i, j in itertools.combinations(range(len(entrants)), 2)
+                    if isinstance(entrants[i][1], _Connection) or isinstance(entrants[j][1], _Connection)]
+        results = await asyncio.gather(*(self._scheduled(entrants[i], entrants[j])
+                                         for i, j in pairings for _ in range(server.matches_per_pair)))
+        scores = {name: {} for name, _ in entrants}
+        for k, (i, j) in enumerate(pairings):
+            pair_results = np.array(results[k * server.matches_per_pair:(k + 1) * server.matches_per_pair])
+            (name1, _), (name2, _) = entrants[i], entrants[j]
+            scores[name1][name2], scores[name2][name1] = pair_results.mean(axis=0).tolist()
+        for connection in self.connections:
+            connection.send(f"DONE {self.name}\n")
+        self.results.set_result(scores)
+
+    async def _scheduled(self, entrant1: tuple, entrant2: tuple) -> tuple:
+        # Slots are always taken in the same order (players', then the server's), so waiting never deadlocks
+        slots = [player.slots for _, player in (entrant1, entrant2) if isinstance(player, _Connection)]
+        for semaphore in slots:
+            await semaphore.acquire()
+        try:
+            async with self.server.match_slots:
+                return await self.server._play(entrant1, entrant2)
+        finally:
+            for semaphore in slots:
+                semaphore.release()
+
+
+class MatchServer:
+    """
+    Serves tournaments to external agents (see the protocol above).
+    :param num_rounds: Rounds per match.
+    :param players: Clients a tournament waits for before it starts.
+    :param matches_per_pair: Matches each pair of entrants plays.
+    :param local_agents: In-process agents (e.g. classic strategies) entered in every tournament.
+    :param env: The game (its memory_length sets what the local agents see; noise is not applied).
+    :param move_timeout: Seconds a client has to answer a MOVE.
+    :param timeout_action: Action played for a move that was not answered in time.
+    :param max_active_matches: Most matches running at once, over all tournaments.
+    :param max_matches_per_player: Most matches one client plays at once (HELLO may ask for fewer).
+    :param write_buffer_limit: Bytes queued for a client before its matches wait for it to read.
+    :param seed: Master seed of the local agents' random streams (one per match).
+    """
+    def __init__(self, num_rounds: int = 50, players: int = 2, matches_per_pair: int = 1, local_agents=(),
+                 env: PrisonersDilemma = None, move_timeout: float = 5.0,
+                 timeout_action: int = PrisonersDilemma.CHEAT, max_active_matches: int = 10_000,
+                 max_matches_per_player: int = 1000, write_buffer_limit: int = 1 << 16, seed: int = 0):
+        if players < 1 or matches_per_pair < 1:
+            raise ValueError("players and matches_per_pair must be positive.")
+        self.num_rounds = num_rounds
+        self.players = players
+        self.matches_per_pair = matches_per_pair
+        self.local_agents = list(local_agents)
+        self.env = env if env is not None else PrisonersDilemma()
+        self.move_timeout = move_timeout
+        self.timeout_action = timeout_action
+        self.max_active_matches = max_active_matches
+        self.max_matches_per_player = max_matches_per_player
+        self.write_buffer_limit = write_buffer_limit
+        self.seed = seed
+        self.tournaments = {} # name -> _Tournament; a name joined after its tournament started opens a new one
+        self.stats = {"connections": 0, "matches": 0, "moves": 0, "timeouts": 0, "forfeited_moves": 0}
+        self._match_ids = itertools.count(1)
+        # (deadline, connection, match id, future) of every move asked for, in asking order: all moves
+        # have the same timeout, so the deadlines are sorted and one task expires them (no timer per move)
+        self._deadlines = collections.deque()
+        self._tasks = set()
+        self._connections = set()
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0, path: str = None):
+        """
+        Starts listening on TCP host:port, or on the Unix socket `path` if given.
+        :return: The address clients connect to: (host, port), or path.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.match_slots = asyncio.Semaphore(self.max_active_matches)
+        self._tasks.add(asyncio.ensure_future(self._expire_moves()))
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._serve_client, path=path)
+            return path
+        self._server = await asyncio.start_server(self._serve_client, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def _expire_moves(self):
+        deadlines = self._deadlines
+        interval = min(0.05, self.move_timeout / 4) # How late a timeout may be noticed
+        while True:
+            await asyncio.sleep(interval)
+            now = self.loop.time()
+            while deadlines and deadlines[0][0] <= now:
+                _, connection, match_id, future = deadlines.popleft()
+                if not future.done():
+                    connection.expire(match_id, future)
+
+    async def close(self):
+        """Stops listening, hangs up on every client and cancels unfinished tournaments."""
+        self._server.close()
+        for connection in list(self._connections):
+            connection.close()
+        for task in self._tasks:
+            task.cancel()
+        await self._server.wait_closed()
+        while self._connections: # Let the clients' reading tasks see their sockets closed
+            await asyncio.sleep(0)
+
+    async def results(self, tournament: str = "default") -> dict:
+        """Waits for a tournament to finish: results[row][column] = row's average score against column."""
+        while tournament not in self.tournaments:
+            await asyncio.sleep(0.01)
+        return await self.tournaments[tournament].results
+
+    def _tournament(self, name: str) -> _Tournament:
+        tournament = self.tournaments.get(name)
+        if tournament is None or tournament.started:
+            tournament = self.tournaments[name] = _Tournament(self, name)
+        return tournament
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = _Connection(self, reader, writer)
+        self._connections.add(connection)
+        self.stats["connections"] += 1
+        try:
+            async for batch in _line_batches(reader):
+                for fields in batch:
+                    command = fields[0]
+                    if command == b"ACT" and len(fields) == 4 and fields[3] in _ACTIONS and \
+                            fields[1].isdigit() and fields[2].isdigit():
+                        connection.answer(int(fields[1]), int(fields[2]), _ACTIONS[fields[3]])
+                    elif command == b"HELLO" and 2 <= len(fields) <= 4 and connection.name is None:
+                        self._hello(connection, [field.decode(errors="replace") for field in fields[1:]])
+                    elif command == b"BYE":
+                        return
+                    else:
+                        connection.send(f"ERROR cannot handle {b' '.join(fields).decode(errors='replace')!r}\n")
+        except (ConnectionError, ValueError):
+            pass # Dropped, or a line longer than MAX_LINE: the client is let go
+        finally:
+            connection.close()
+            self._connections.discard(connection)
+
+    def _hello(self, connection: _Connection, fields: list):
+        name = fields[0]
+        tournament = self._tournament(fields[1] if len(fields) > 1 else "default")
+        max_matches = self.max_matches_per_player
+        if len(fields) > 2:
+            if not fields[2].isdigit() or int(fields[2]) < 1:
+                connection.send("ERROR max matches must be a positive integer\n")
+                return
+            max_matches = min(max_matches, int(fields[2]))
+        connection.slots = asyncio.Semaphore(max_matches)
+        connection.tournament = tournament
+        connection.name = tournament.join(connection, name)
+        connection.send(f"WELCOME {connection.name} {tournament.name}\n")
+
+    def _seat(self, player, match_id: int):
+        if isinstance(player, _Connection):
+            return _RemoteSeat(player, match_id)
+        agent = copy.deepcopy(player)
+        seed_agent(agent, derive_seed(self.seed, match_id, player.name))
+        return _LocalSeat(agent, self.env)
+
+    async def _play(self, entrant1: tuple, entrant2: tuple) -> tuple:
+        (name1, player1), (name2, player2) = entrant1, entrant2
+        match_id = next(self._match_ids)
+        seat1, seat2 = self._seat(player1, match_id), self._seat(player2, match_id)
+        play_round = self.env.play_round
+        seat1.start(name2, self.num_rounds)
+        seat2.start(name1, self.num_rounds)
+        total1 = total2 = 0
+        for round_num in range(1, self.num_rounds + 1):
+            # Both moves are asked for before either is awaited, so the two clients think in parallel
+            action1 = seat1.ask(round_num)
+            action2 = seat2.ask(round_num)
+            if isinstance(action1, asyncio.Future):
+                action1 = await action1
+            if isinstance(action2, asyncio.Future):
+                action2 = await action2
+            reward1, reward2 = play_round(action1, action2)
+            total1 += reward1
+            total2 += reward2
+            seat1.result(action1, action2, reward1)
+            seat2.result(action2, action1, reward2)
+            await seat1.drain()
+            await seat2.drain()
+        seat1.end(total1, total2)
+        seat2.end(total2, total1)
+        self.stats["matches"] += 1
+        self.stats["moves"] += 2 * self.num_rounds
+        return total1, total2
+
+
+async def _tit_for_tat_client(address, name: str, tournament: str, max_matches: int, latencies: list,
+                              finished: set, counters: dict):
+    """
+    A load-test client: plays Tit for Tat in every match it is given, and records the time from
+    each ACT it sends to the RESULT of that round (the opponent's thinking included).
+    """
+    if isinstance(address, str):
+        reader, writer = await asyncio.open_unix_connection(address)
+    else:
+        reader, writer = await asyncio.open_connection(*address)
+    writer.write(f"HELLO {name} {tournament} {max_matches}\n".encode())
+    clock = time.perf_counter
+    opponent_last = {} # match id -> opponent's last action (C or D)
+    sent_at = {}       # match id -> when the last ACT was sent
+    done = False
+    async for batch in _line_batches(reader):
+        answers = []
+        for fields in batch:
+            command = fields[0]
+            if command == b"MOVE":
+                match_id = fields[1]
+                answers.append(b"ACT %s %s %s\n" % (match_id, fields[2], opponent_last.get(match_id, b"C")))
+                sent_at[match_id] = None
+            elif command == b"RESULT":
+                latencies.append(clock() - sent_at.pop(fields[1]))
+                opponent_last[fields[1]] = fields[3]
+            elif command == b"END":
+                opponent_last.pop(fields[1], None)
+                finished.add(fields[1]) # Both clients of a match report it
+            elif command == b"DONE":
+                done = True
+            elif command == b"ERROR":
+                counters["errors"] += 1
+        if answers:
+            writer.write(b"".join(answers))
+            now = clock()
+            for answer in answers:
+                sent_at[answer.split()[1]] = now
+            if writer.transport.get_write_buffer_size() > 1 << 16:
+                await writer.drain()
+        if done:
+            break
+    if not done:
+        counters["errors"] += 1 # The server closed the connection before the tournament was over
+    writer.write(b"BYE\n")
+    writer.close()
+
+
+async def load_test(clients: int = 100, players: int = 4, num_rounds: int = 50, matches_per_pair: int = 1,
+                    max_matches: int = 1000, address=None, **server_options) -> dict:
+    """
+    Connects `clients` Tit for Tat clients, `players` to a tournament, and reports throughput.
+    :param address: A running server's (host, port) or Unix socket path; by default a MatchServer
+                    (with server_options) is started in this event loop (clients and server then share one CPU).
+    :return: matches, seconds, matches_per_sec, moves_per_sec and the ACT -> RESULT latency
+             percentiles in milliseconds (plus the server's stats when it runs here).
+    """
+    if clients % players:
+        raise ValueError("clients must be a multiple of players (a tournament starts once it is full).")
+    server = None
+    if address is None:
+        server = MatchServer(num_rounds=num_rounds, players=players, matches_per_pair=matches_per_pair,
+                             **server_options)
+        address = await server.start()
+    latencies = []
+    finished = set() # Ids of the matches played
+    counters = {"errors": 0}
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(_tit_for_tat_client(address, f"bot{k}", f"t{k // players}", max_matches,
+                                                   latencies, finished, counters) for k in range(clients)))
+    finally:
+        if server is not None:
+            await server.close()
+    seconds = time.perf_counter() - start
+    matches = len(finished)
+    milliseconds = np.array(latencies) * 1000.0
+    report = {"clients": clients, "matches": matches, "seconds": seconds,
+              "matches_per_sec": matches / seconds if seconds else 0.0,
+              "moves_per_sec": len(latencies) / seconds if seconds else 0.0, "errors": counters["errors"],
+              "latency_ms": {f"p{q}": float(np.percentile(milliseconds, q)) if len(milliseconds) else 0.0
+                             for q in (50, 90, 99, 99.9)}}
+    report["latency_ms"]["max"] = float(milliseconds.max()) if len(milliseconds) else 0.0
+    if server is not None:
+        report["server"] = dict(server.stats)
+    return report
+
+
+def _address(args):
+    return args.unix if args.unix else (args.host, args.port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve IPD tournaments to external agents, or load-test a server.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Run a match server until interrupted.")
+    loadtest = commands.add_parser("loadtest", help="Play many concurrent tournaments with Tit for Tat clients.")
+    for command in (serve, loadtest):
+        command.add_argument("--host", default="127.0.0.1")
+        command.add_argument("--port", type=int, default=8765)
+        command.add_argument("--unix", help="Unix socket path (instead of TCP).")
+        command.add_argument("--players", type=int, default=4, help="Clients per tournament.")
+        command.add_argument("--rounds", type=int, default=50, help="Rounds per match.")
+        command.add_argument("--matches-per-pair", type=int, default=1)
+    serve.add_argument("--local", default="", help="Comma-separated classic strategies entered in every tournament.")
+    serve.add_argument("--move-timeout", type=float, default=5.0, help="Seconds a client has to answer a MOVE.")
+    serve.add_argument("--max-active-matches", type=int, default=10_000)
+    loadtest.add_argument("--clients", type=int, default=400)
+    loadtest.add_argument("--max-matches", type=int, default=1000, help="Matches each client plays at once.")
+    loadtest.add_argument("--connect", action="store_true",
+                          help="Test the server at --host/--port (or --unix) instead of one started in-process.")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        local_agents = [getattr(classic_strategies, name)() for name in args.local.split(",") if name]
+
+        async def serve_forever():
+            server = MatchServer(num_rounds=args.rounds, players=args.players, matches_per_pair=args.matches_per_pair,
+                                 local_agents=local_agents, move_timeout=args.move_timeout,
+                                 max_active_matches=args.max_active_matches)
+            address = await server.start(args.host, args.port, args.unix)
+            print(f"Serving on {address} ({args.players} players per tournament, {args.rounds} rounds per match)")
+            await server._server.serve_forever()
+        try:
+            asyncio.run(serve_forever())
+        except KeyboardInterrupt:
+            pass
+    else:
+        report = asyncio.run(load_test(args.clients, args.players, args.rounds, args.matches_per_pair,
+                                       args.max_matches, _address(args) if args.connect else None))
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# payoff_cache.py
+
+import hashlib
+import importlib
+import inspect
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from rl_agents import QLearningAgent, LinearQAgent
+
+CACHE_VERSION = 2 # Bump when the way pairings are evaluated changes, to orphan all old entries
+
+
+@lru_cache(maxsize=None)
+def source_hash(cls: type) -> str:
+    """Hash of a class's source code (and its bases'), so edited strategies get new cache keys."""
+    digest = hashlib.sha256()
+    for klass in cls.__mro__:
+        if klass is object:
+            continue
+        try:
+            digest.update(inspect.getsource(klass).encode())
+        except (OSError, TypeError): # Built-in or dynamically created class
+            digest.update(klass.__qualname__.encode())
+    return digest.hexdigest()[:16]
+
+
+def class_path(cls: type) -> str:
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def agent_fingerprint(agent) -> dict:
+    """
+    Everything that determines an agent's results: its name (which seeds its pairings' RNG streams),
+    class, the class's source, its constructor parameters (those it keeps as attributes; `seed` only
+    selects a random stream) and, for a QLearningAgent, a hash of its Q-table (of its weights for a LinearQAgent).
+    """
+    cls = type(agent)
+    params = {}
+    for name in inspect.signature(cls.__init__).parameters:
+        if name != "self" and name != "name" and hasattr(agent, name) and not callable(getattr(agent, name)):
+            params[name] = repr(getattr(agent, name))
+    fingerprint = {"name": agent.name, "class": class_path(cls), "source": source_hash(cls), "params": params}
+    if isinstance(agent, QLearningAgent):
+        if agent.dense:
+            table_bytes = agent.q_table.tobytes()
+        else:
+            table_bytes = repr(sorted((k, tuple(v)) for k, v in agent.q_table.items())).encode()
+        fingerprint["q_table"] = hashlib.sha256(table_bytes).hexdigest()[:16]
+    elif isinstance(agent, LinearQAgent):
+        fingerprint["weights"] = hashlib.sha256(agent.weights.tobytes()).hexdigest()[:16]
+    return fingerprint
+
+
+class PayoffCache:
+    """
+    Content-addressed cache of pairwise tournament results, stored in SQLite with an in-memory
+    LRU front. An entry's key hashes both agents' fingerprints (class, source code, constructor
+    parameters, Q-table), the rounds per match, memory length, match count and seed, so a pairing
+    is only re-simulated when something that affects its result has changed.
+    """
+    def __init__(self, path: str = ":memory:", max_memory_entries: int = 4096):
+        """
+        :param path: SQLite database file (":memory:" for a cache that lives only in this process).
+        :param max_memory_entries: Entries kept in the in-memory LRU.
+        """
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(payoffs)")]
+        if columns and "matches" not in columns:
+            self.db.execute("DROP TABLE payoffs") # Written before CACHE_VERSION 2; none of its keys can match
+        self.db.execute("""CREATE TABLE IF NOT EXISTS payoffs (
+                               key TEXT PRIMARY KEY, score1 REAL, score2 REAL, ci1 REAL, ci2 REAL, matches INTEGER,
+                               class1 TEXT, source1 TEXT, class2 TEXT, source2 TEXT, created REAL)""")
+        self.db.commit()
+
+    @staticmethod
+    def key(agent1, agent2, num_rounds: int, memory_length: int, num_matches: int, seed: int,
+            sampling: dict = None) -> str:
+        """:param sampling: Any further settings the result depends on (e.g. run_tournament's target_ci)."""
+        content = json.dumps([CACHE_VERSION, agent_fingerprint(agent1), agent_fingerprint(agent2),
+                              num_rounds, memory_length, num_matches, seed, sampling], sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _remember(self, key: str, scores: tuple):
+        self.memory[key] = scores
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str):
+        """:return: (score1, score2, ci1, ci2, matches), as given to put, or None."""
+        scores = self.memory.get(key)
+        if scores is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return scores
+        row = self.db.execute("SELECT score1, score2, ci1, ci2, matches FROM payoffs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, row)
+        return row
+
+    def put(self, key: str, agent1, agent2, score1: float, score2: float, ci1: float = 0.0, ci2: float = 0.0,
+            matches: int = 0):
+        self._remember(key, (score1, score2, ci1, ci2, matches))
+        cls1, cls2 = type(agent1), type(agent2)
+        self.db.execute("INSERT OR REPLACE INTO payoffs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, score1, score2, ci1, ci2, matches, class_path(cls1), source_hash(cls1),
+                         class_path(cls2), source_hash(cls2), time.time()))
+        self.db.commit()
+
+    def invalidate(self, strategy_class: type = None) -> int:
+        """
+        Drops every entry involving strategy_class (or every entry, if None).
+        :return: Number of entries removed.
+        """
+        self.memory.clear()
+        if strategy_class is None:
+            removed = self.db.execute("DELETE FROM payoffs").rowcount
+        else:
+            path = class_path(strategy_class)
+            removed = self.db.execute("DELETE FROM payoffs WHERE class1 = ? OR class2 = ?", (path, path)).rowcount
+        self.db.commit()
+        return removed
+
+    def invalidate_stale(self) -> int:
+        """
+        Drops entries recorded for a class whose source code has since changed (or which no longer
+        exists). Such entries can never be hit again, since their keys include the old source hash.
+        :return: Number of entries removed.
+        """
+        stale = []
+        for path, recorded in self.db.execute("SELECT DISTINCT class1, source1 FROM payoffs "
+                                              "UNION SELECT DISTINCT class2, source2 FROM payoffs").fetchall():
+            module_name, qualname = path.split(":")
+            try:
+                cls = importlib.import_module(module_name)
+                for part in qualname.split("."):
+                    cls = getattr(cls, part)
+                current = source_hash(cls)
+            except (ImportError, AttributeError):
+                current = None
+            if current != recorded:
+                stale.append((path, recorded))
+        removed = 0
+        for path, recorded in stale:
+            removed += self.db.execute("DELETE FROM payoffs WHERE (class1 = ? AND source1 = ?) OR (class2 = ? AND source2 = ?)",
+                                       (path, recorded, path, recorded)).rowcount
+        self.db.commit()
+        self.memory.clear()
+        return removed
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM payoffs").fetchone()[0]
+
+    def close(self):
+        self.db.close()
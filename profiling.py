@@ -0,0 +1,105 @@
+# profiling.py
+
+import json
+import marshal
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+
+class Profiler:
+    """
+    Opt-in instrumentation for run_match, QLearningAgent training and the tournament.
+    Records cumulative time and call counts per named phase, free-form counters, per-pairing
+    (agent class vs agent class) match timings and Q-table size over time.
+    Pass one to run_match / run_tournament / main via their `profiler` argument; with the
+    default of None nothing is timed and the hot loops only pay a boolean check.
+    """
+    def __init__(self):
+        self.times = defaultdict(float)  # phase -> cumulative seconds
+        self.calls = defaultdict(int)    # phase -> number of timed calls
+        self.counters = defaultdict(int) # name -> count
+        self.q_table_sizes = defaultdict(list) # agent name -> [(episode, states, bytes), ...]
+
+    def add(self, phase: str, seconds: float, calls: int = 1):
+        self.times[phase] += seconds
+        self.calls[phase] += calls
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def record_match(self, agent1, agent2, seconds: float, num_rounds: int):
+        """Time of one whole match, per pair of agent classes."""
+        pairing = f"{type(agent1).__name__} vs {type(agent2).__name__}"
+        self.add(f"match:{pairing}", seconds)
+        self.counters[f"rounds:{pairing}"] += num_rounds
+
+    def sample_q_table(self, agent, episode: int):
+        """
+        Records how many states the agent's Q-table holds: dict entries, or (dense backend)
+        rows that have been updated at least once.
+        """
+        q_table = agent.q_table
+        if isinstance(q_table, np.ndarray):
+            states = int(np.count_nonzero(q_table.any(axis=1)))
+            size = q_table.nbytes
+        else:
+            states = len(q_table)
+            size = states * 2 * 8 # Two float Q-values per state, ignoring dict and list overhead
+        self.q_table_sizes[agent.name].append((episode, states, size))
+
+    def to_dict(self) -> dict:
+        return {
+            "phases": {phase: {"seconds": self.times[phase], "calls": self.calls[phase],
+                               "us_per_call": 1e6 * self.times[phase] / max(1, self.calls[phase])}
+                       for phase in sorted(self.times, key=self.times.get, reverse=True)},
+            "counters": dict(self.counters),
+            "q_table_sizes": {name: [list(sample) for sample in samples]
+                              for name, samples in self.q_table_sizes.items()},
+        }
+
+    def to_json(self, path: str = None) -> str:
+        """:return: The to_dict() report as JSON, also written to `path` if given."""
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def dump_stats(self, path: str):
+        """
+        Writes the phase timings in cProfile's stats format, so they can be read with
+        pstats.Stats(path) or tools such as snakeviz. Each phase shows up as a "function"
+        whose file name is the part of the phase name before the first '.' or ':'.
+        """
+        stats = {}
+        for phase, seconds in self.times.items():
+            calls = self.calls[phase]
+            module = phase.replace(":", ".").split(".")[0]
+            stats[(module, 0, phase)] = (calls, calls, seconds, seconds, {})
+        with open(path, "wb") as f:
+            marshal.dump(stats, f)
+
+    def report(self, top: int = None) -> str:
+        """:return: A text table of the phases, slowest first."""
+        lines = [f"{'Phase':<56} {'Calls':>10} {'Total (s)':>11} {'us/call':>9}"]
+        for phase, entry in list(self.to_dict()["phases"].items())[:top]:
+            lines.append(f"{phase:<56} {entry['calls']:>10} {entry['seconds']:>11.4f} {entry['us_per_call']:>9.2f}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<56} {value:>10}")
+        return "\n".join(lines)
+
+
+def phase(profiler, name: str):
+    """`with phase(profiler, name):` times the block if profiler is not None."""
+    return profiler.phase(name) if profiler is not None else nullcontext()
@@ -1,35 +1,223 @@
 # rl_agents.py
 
-import random
+import heapq
+import itertools
+import os
+import struct
 from collections import defaultdict
+
+import numpy as np
+
 from game_environment import PrisonersDilemma
+from rng import RandomStream
+
+def _initial_q_values():
+    # Module-level (not a lambda) so that agents and their Q-tables can be pickled
+    return [0.0, 0.0]
+
+# Q-table checkpoint layout: a fixed 64-byte little-endian header, then the dense
+# (3^(2*memory_length), 2) table in C order, so the table can be memory-mapped at CHECKPOINT_HEADER_SIZE.
+# Header: magic, format version, bytes per Q-value (4 or 8), memory_length, alpha, gamma, epsilon, episodes_trained
+CHECKPOINT_MAGIC = b"QTBL"
+CHECKPOINT_VERSION = 1
+CHECKPOINT_HEADER = struct.Struct("<4sHBxIdddQ")
+CHECKPOINT_HEADER_SIZE = 64
+_CHECKPOINT_DTYPES = {4: np.dtype("<f4"), 8: np.dtype("<f8")}
+
+class TransitionModel:
+    """
+    What a learner has seen of its environment: for every (state, action) it tried, how often, the
+    rewards it got in total and how often each next state followed. States are the keys of the
+    learner's Q-table (get_state tuples, or integer state codes for the dense backend).
+    """
+    def __init__(self):
+        self.counts = {}       # (state, action) -> [visits, reward sum, {next state: visits}]
+        self.predecessors = {} # state -> {(state, action) seen leading to it}
+
+    def update(self, state, action: int, reward: float, next_state):
+        key = (state, action)
+        entry = self.counts.get(key)
+        if entry is None:
+            entry = self.counts[key] = [0, 0.0, {}]
+        entry[0] += 1
+        entry[1] += reward
+        successors = entry[2]
+        successors[next_state] = successors.get(next_state, 0) + 1
+        self.predecessors.setdefault(next_state, set()).add(key)
+
+    def expected_target(self, q_table, key: tuple, gamma: float) -> float:
+        """The model's estimate of reward + gamma * max Q(next state) for (state, action) `key`."""
+        visits, reward_sum, successors = self.counts[key]
+        future = 0.0
+        for next_state, count in successors.items():
+            q_values = q_table[next_state]
+            future += count * max(q_values[0], q_values[1])
+        return (reward_sum + gamma * future) / visits
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class PrioritizedSweeping:
+    """
+    Planning for a QLearningAgent (prioritized sweeping): after every real update, the agent's
+    TransitionModel is updated and up to `steps` simulated backups are made from it, each on the
+    (state, action) whose Q-value is furthest from the model's expected target. A backup that changes
+    a state's value queues the pairs the model says lead to it, with priority P(state | pair) times
+    gamma times that change, so a surprise (e.g. being cheated) spreads back along the states that
+    led there within the same round instead of over many matches.
+    The cost per real round is bounded by `steps` backups, each of which touches the pair's
+    successors and the predecessors of its state (both bounded by the number of possible
+    last-round outcomes, whatever the memory length).
+    :param steps: Most simulated backups per real update.
+    :param threshold: Pairs whose |target - Q| is at most this are not queued.
+    :param step_size: Fraction of the gap to the expected target each backup closes (1: full backup).
+    """
+    def __init__(self, steps: int = 10, threshold: float = 1e-4, step_size: float = 1.0):
+        if steps < 1:
+            raise ValueError("steps must be at least 1.")
+        self.steps = steps
+        self.threshold = threshold
+        self.step_size = step_size
+        self.model = TransitionModel()
+        self.backups = 0   # Simulated backups made so far
+        self._queue = []   # Heap of (-priority, tie-break, (state, action))
+        self._queued = {}  # (state, action) -> priority of its live heap entry; older entries are skipped
+        self._order = itertools.count()
+
+    def _push(self, key: tuple, priority: float):
+        if priority <= self.threshold or self._queued.get(key, 0.0) >= priority:
+            return
+        self._queued[key] = priority
+        heapq.heappush(self._queue, (-priority, next(self._order), key))
+        if len(self._queue) > 2 * len(self._queued) + 64: # Drop the superseded entries
+            self._queue = [entry for entry in self._queue if self._queued.get(entry[2]) == -entry[0]]
+            heapq.heapify(self._queue)
+
+    def _pop(self):
+        while self._queue:
+            negative_priority, _, key = heapq.heappop(self._queue)
+            if self._queued.get(key) == -negative_priority:
+                del self._queued[key]
+                return key
+        return None
+
+    def __len__(self):
+        """Pairs waiting for a backup."""
+        return len(self._queued)
+
+    def update(self, q_table, gamma: float, state, action: int, reward: float, next_state) -> float:
+        """
+        Records a real transition, then plans.
+        :return: The largest |change| the simulated backups made to a Q-value.
+        """
+        model = self.model
+        model.update(state, action, reward, next_state)
+        key = (state, action)
+        self._push(key, abs(model.expected_target(q_table, key, gamma) - q_table[state][action]))
+
+        largest = 0.0
+        counts, predecessors = model.counts, model.predecessors
+        for _ in range(self.steps):
+            key = self._pop()
+            if key is None:
+                break
+            planned_state, planned_action = key
+            q_values = q_table[planned_state]
+            value_before = max(q_values[0], q_values[1])
+            change = self.step_size * (model.expected_target(q_table, key, gamma) - q_values[planned_action])
+            q_values[planned_action] += change
+            self.backups += 1
+            if abs(change) > largest:
+                largest = abs(change)
+            # A pair leading here moves by gamma * P(here | pair) * (change of this state's value)
+            value_change = gamma * abs(max(q_values[0], q_values[1]) - value_before)
+            if value_change > self.threshold:
+                for predecessor in predecessors.get(planned_state, ()):
+                    visits, _, successors = counts[predecessor]
+                    self._push(predecessor, value_change * successors[planned_state] / visits)
+        return largest
+
 
 class QLearningAgent:
     """
     A Reinforcement Learning agent that uses Q-Learning to learn a strategy.
+
+    By default the Q-table is a dict keyed by get_state tuples. Passing `memory_length` selects the
+    dense backend instead: a preallocated (3^(2*memory_length), 2) array indexed by the integer
+    state code from PrisonersDilemma.encode_state, with O(1) lookups and a fixed memory footprint.
+    With `planning_steps`, every real update is followed by that many simulated ones from a learnt
+    model (PrioritizedSweeping).
     """
+    observes = "state" # choose_action is given the environment state (see match_kernels.py)
+
     def __init__(self,
                  alpha: float = 0.1,    # Learning rate
                  gamma: float = 0.9,    # Discount factor
                  epsilon: float = 0.1,  # Exploration rate (for epsilon-greedy policy)
-                 name: str = "QLearner"):
-        self.q_table = defaultdict(lambda: [0.0, 0.0])  # Q[state] = [Q(state, Cooperate), Q(state, Cheat)]
+                 name: str = "QLearner",
+                 memory_length: int = None, # Set to use the dense array backend for this memory length
+                 dtype=np.float64,      # Dtype of the dense Q-table (float32 halves its memory)
+                 planning_steps: int = 0, # Simulated backups per real update (PrioritizedSweeping; 0: none)
+                 seed=None):            # Seed of the exploration stream (see rng.py)
+        if memory_length is None:
+            self.q_table = defaultdict(_initial_q_values)  # Q[state] = [Q(state, Cooperate), Q(state, Cheat)]
+        else:
+            if memory_length < 0:
+                raise ValueError("Memory length cannot be negative.")
+            self.q_table = np.zeros((3 ** (2 * memory_length), 2), dtype=dtype) # Q[state_code, action]
+        self.dense = memory_length is not None
+        self.memory_length = memory_length
         self.alpha = alpha
         self.gamma = gamma
         self.epsilon = epsilon
         self.name = name
+        self.episodes_trained = 0 # Training matches played so far (kept in checkpoints)
+        self.max_q_change = 0.0   # Largest |Q-value update| since last cleared (see training.ConvergenceMonitor)
         self.last_action = None
         self.last_state = None
+        self.rng = RandomStream(seed)
+        # Learnt model and planning step (None: plain one-backup-per-round Q-learning)
+        self.planner = PrioritizedSweeping(planning_steps) if planning_steps else None
+
+    def seed(self, seed):
+        """Restarts the exploration stream from `seed`."""
+        self.rng.seed(seed)
+
+    def _plan(self, state, action: int, reward: int, next_state):
+        planned_change = self.planner.update(self.q_table, self.gamma, state, action, reward, next_state)
+        if planned_change > self.max_q_change:
+            self.max_q_change = planned_change
+
+    def _index(self, state) -> int:
+        if not isinstance(state, tuple):
+            return state
+        if len(state[0]) != self.memory_length:
+            raise ValueError(f"{self.name}: state of memory length {len(state[0])} given to a dense Q-table "
+                             f"with memory_length={self.memory_length}.")
+        return PrisonersDilemma.encode_state(state)
+
+    def q_values(self, state) -> tuple:
+        """
+        Q-values (Cooperate, Cheat) of a state, without adding it to a dict Q-table.
+        :param state: A get_state tuple, or an integer state code for the dense backend.
+        """
+        if self.dense:
+            return tuple(self.q_table[self._index(state)].tolist())
+        return tuple(self.q_table.get(state, (0.0, 0.0)))
 
-    def choose_action(self, state: tuple) -> int:
+    def choose_action(self, state) -> int:
         """
         Chooses an action (Cooperate or Cheat) based on epsilon-greedy policy.
         :param state: The current state of the game (opponent's last move, etc.).
+                      With the dense backend this may also be the integer state code.
         :return: Action (0 for Cooperate, 1 for Cheat).
         """
+        if self.dense:
+            return self.choose_action_index(self._index(state))
         # Epsilon-greedy exploration
-        if random.uniform(0, 1) < self.epsilon:
-            action = random.choice(PrisonersDilemma.ACTIONS) # Explore
+        if self.rng.uniform() < self.epsilon:
+            action = PrisonersDilemma.CHEAT if self.rng.uniform() < 0.5 else PrisonersDilemma.COOPERATE # Explore
         else:
             # Exploit (choose action with highest Q-value)
             q_values = self.q_table[state]
@@ -39,21 +227,131 @@ class QLearningAgent:
                 action = PrisonersDilemma.CHEAT
         return action
 
-    def learn(self, state: tuple, action: int, reward: int, next_state: tuple):
+    def choose_action_index(self, index: int) -> int:
+        """
+        Fast path of choose_action for the dense backend: takes the integer state code directly.
+        Consumes random numbers exactly like choose_action.
+        """
+        if self.rng.uniform() < self.epsilon:
+            return PrisonersDilemma.CHEAT if self.rng.uniform() < 0.5 else PrisonersDilemma.COOPERATE
+        q_values = self.q_table[index]
+        if q_values[PrisonersDilemma.COOPERATE] >= q_values[PrisonersDilemma.CHEAT]:
+            return PrisonersDilemma.COOPERATE
+        return PrisonersDilemma.CHEAT
+
+    def learn(self, state, action: int, reward: int, next_state):
         """
         Updates the Q-table based on the observed reward and next state.
         :param state: The state before the action.
         :param action: The action taken.
         :param reward: The immediate reward received.
         :param next_state: The state after the action.
+        :return: The change applied to Q(state, action).
         """
+        if self.dense:
+            return self.learn_index(self._index(state), action, reward, self._index(next_state))
+
         old_q_value = self.q_table[state][action]
         # Max Q-value for the next state
         next_max_q = max(self.q_table[next_state])
 
         # Q-learning update rule
-        new_q_value = old_q_value + self.alpha * (reward + self.gamma * next_max_q - old_q_value)
-        self.q_table[state][action] = new_q_value
+        change = self.alpha * (reward + self.gamma * next_max_q - old_q_value)
+        self.q_table[state][action] = old_q_value + change
+        if abs(change) > self.max_q_change:
+            self.max_q_change = abs(change)
+        if self.planner is not None:
+            self._plan(state, action, reward, next_state)
+        return change
+
+    def learn_index(self, index: int, action: int, reward: int, next_index: int):
+        """Fast path of learn for the dense backend: takes integer state codes directly."""
+        q_table = self.q_table
+        old_q_value = q_table[index, action]
+        next_q_values = q_table[next_index]
+        next_max_q = max(next_q_values[0], next_q_values[1])
+        change = self.alpha * (reward + self.gamma * next_max_q - old_q_value)
+        q_table[index, action] = old_q_value + change
+        if abs(change) > self.max_q_change:
+            self.max_q_change = abs(change)
+        if self.planner is not None:
+            self._plan(index, action, reward, next_index)
+        return change
+
+    def save(self, path: str):
+        """
+        Writes a checkpoint: the checkpoint header followed by the dense Q-table. A dict Q-table
+        is converted to the dense layout first (its memory length is read from its states).
+        The file is written under a temporary name and then renamed into place, so readers that
+        memory-map `path` never see a partial checkpoint.
+        """
+        if self.dense:
+            memory_length = self.memory_length
+            table = self.q_table
+        else:
+            lengths = {len(state[0]) for state in self.q_table}
+            if len(lengths) != 1:
+                raise ValueError(f"{self.name}: cannot tell the memory length of a dict Q-table with states "
+                                 f"of lengths {sorted(lengths)}.")
+            memory_length = lengths.pop()
+            table = np.zeros((3 ** (2 * memory_length), 2))
+            for state, q_values in self.q_table.items():
+                table[PrisonersDilemma.encode_state(state)] = q_values
+        dtype = np.dtype("<f4") if table.dtype == np.float32 else np.dtype("<f8")
+        header = CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, dtype.itemsize, memory_length,
+                                        self.alpha, self.gamma, self.epsilon, self.episodes_trained)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(header.ljust(CHECKPOINT_HEADER_SIZE, b"\0"))
+            f.write(np.ascontiguousarray(table, dtype=dtype).tobytes())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str, name: str = "QLearner", mmap_mode: str = None) -> "QLearningAgent":
+        """
+        Creates a dense agent from a checkpoint written by save().
+        :param mmap_mode: None reads the table into memory. "r" memory-maps it read-only, so any
+                          number of processes share one copy through the page cache (such agents can
+                          play but not learn, and pickle as a reference to the file); "c" maps it
+                          copy-on-write and "r+" writes updates back to the file (see numpy.memmap).
+        """
+        with open(path, "rb") as f:
+            header = f.read(CHECKPOINT_HEADER_SIZE)
+        if len(header) < CHECKPOINT_HEADER_SIZE:
+            raise ValueError(f"{path} is not a Q-table checkpoint (file too short).")
+        magic, version, itemsize, memory_length, alpha, gamma, epsilon, episodes_trained = \
+            CHECKPOINT_HEADER.unpack_from(header)
+        if magic != CHECKPOINT_MAGIC:
+            raise ValueError(f"{path} is not a Q-table checkpoint.")
+        if version != CHECKPOINT_VERSION or itemsize not in _CHECKPOINT_DTYPES:
+            raise ValueError(f"{path}: unsupported checkpoint version {version} (value size {itemsize}).")
+        dtype = _CHECKPOINT_DTYPES[itemsize]
+        shape = (3 ** (2 * memory_length), 2)
+
+        agent = cls(alpha=alpha, gamma=gamma, epsilon=epsilon, name=name, memory_length=0) # Tiny placeholder table
+        agent.memory_length = memory_length
+        agent.episodes_trained = episodes_trained
+        if mmap_mode is None:
+            agent.q_table = np.fromfile(path, dtype=dtype, count=shape[0] * 2,
+                                        offset=CHECKPOINT_HEADER_SIZE).reshape(shape).astype(dtype.newbyteorder("="), copy=False)
+        else:
+            agent.q_table = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=CHECKPOINT_HEADER_SIZE, shape=shape)
+        return agent
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        q_table = self.q_table
+        if isinstance(q_table, np.memmap) and q_table.mode == "r":
+            # A read-only mapped checkpoint travels as a reference: the receiving process maps the same file
+            state["q_table"] = ("mmap", q_table.filename, q_table.offset, q_table.shape, q_table.dtype.str)
+        return state
+
+    def __setstate__(self, state: dict):
+        q_table = state["q_table"]
+        if isinstance(q_table, tuple) and q_table[0] == "mmap":
+            _, filename, offset, shape, dtype = q_table
+            state["q_table"] = np.memmap(filename, dtype=np.dtype(dtype), mode="r", offset=offset, shape=shape)
+        self.__dict__.update(state)
 
     def reset(self):
         """
@@ -63,4 +361,184 @@ class QLearningAgent:
         """
         self.last_action = None
         self.last_state = None
-        # self.q_table.clear() # Uncomment to reset Q-table for each new training run
\ No newline at end of file
+        # self.q_table.clear() # Uncomment to reset Q-table for each new training run
+
+
+_ACTION_ROWS = np.arange(2)[:, None] # Compared with n actions, gives which of them are Cooperate, Cheat
+
+
+class LinearFeatures:
+    """
+    Feature vectors of `num_matches` matches played in lockstep, from one player's point of view,
+    updated after every round (push). Row k of X describes match k:
+      X[:, 4i : 4i + 4]  round t-1-i (i < memory_length): own move was Cooperate, opponent's move was
+                         Cooperate, own move was Cheat, opponent's was Cheat (all 0 before the match
+                         reached that far back)
+      X[:, RATES]        own and opponent cooperation rates so far, smoothed as (cooperations + 1) / (rounds + 2)
+      X[:, STREAKS]      runs of cooperations (own, opponent's), then of cheats, each as min(run, streak_cap) / streak_cap
+      X[:, -1]           bias, always 1
+    The size is 4 * memory_length + 7 and every update is O(size) whatever the match length.
+    push writes the new features into a second buffer and makes it X, so the previous X stays valid
+    (and unchanged) until the next push: learners keep it as the state they acted in without copying.
+    Both buffers are column-major (each feature's values for all matches are contiguous), so moving
+    the one-hot moves a round further back is one block copy.
+    """
+    def __init__(self, memory_length: int, num_matches: int = 1, streak_cap: int = 8):
+        if memory_length < 0:
+            raise ValueError("Memory length cannot be negative.")
+        self.memory_length = memory_length
+        self.num_matches = num_matches
+        self.streak_cap = streak_cap
+        self.size = 4 * memory_length + 7
+        self.rates = slice(4 * memory_length, 4 * memory_length + 2)
+        self.streaks = slice(4 * memory_length + 2, 4 * memory_length + 6)
+        self._buffers = (np.zeros((self.size, num_matches)).T, np.zeros((self.size, num_matches)).T)
+        # Without a memory the newest round's one-hot moves are kept aside (they still give the streaks)
+        self._onehot = None if memory_length else np.zeros((4, num_matches)).T
+        self.reset()
+
+    def reset(self):
+        for X in self._buffers:
+            X[:] = 0.0
+            X[:, self.rates] = 0.5
+            X[:, -1] = 1.0
+        self.X = self._buffers[0]
+        self.rounds = 0
+        self.cooperations = np.ones((2, self.num_matches)).T # Own, opponent's; plus 1 (the rates' smoothing)
+        self.runs = np.zeros((2, self.num_matches)).T # Current run of identical moves, up to streak_cap: own, opponent's
+        self.last = np.full((2, self.num_matches), -1.0).T # Last moves (1.0: Cheat): own, opponent's
+
+    def push(self, own_actions, opponent_actions):
+        """Appends one round (arrays of num_matches actions, or single actions for one match)."""
+        previous = self.X
+        X = self._buffers[previous is self._buffers[0]]
+        onehot_end = 4 * self.memory_length
+        if onehot_end > 4:
+            X[:, 4:onehot_end] = previous[:, :onehot_end - 4] # Everything moves one round further back
+        onehot = X[:, :4] if onehot_end else self._onehot
+        cooperates, cheats = onehot[:, 0:2], onehot[:, 2:4] # Own, opponent's
+        onehot[:, 2] = own_actions
+        onehot[:, 3] = opponent_actions
+        np.subtract(1.0, cheats, out=cooperates)
+        self.rounds += 1
+        self.cooperations += cooperates
+        np.divide(self.cooperations, self.rounds + 2.0, out=X[:, self.rates])
+        # A run goes on while the move repeats, and restarts at 1 otherwise
+        runs = self.runs
+        np.multiply(runs, cheats == self.last, out=runs)
+        runs += 1.0
+        np.minimum(runs, self.streak_cap, out=runs)
+        self.last[:] = cheats
+        first = self.streaks.start
+        np.multiply(cooperates, runs, out=X[:, first:first + 2])
+        np.multiply(cheats, runs, out=X[:, first + 2:first + 4])
+        X[:, self.streaks] /= self.streak_cap
+        self.X = X
+
+
+class LinearQAgent:
+    """
+    Q-learning with a linear model, Q(s, a) = weights[a] . x(s), over the LinearFeatures of the
+    match so far instead of a table. Memory is 2 x (4 * memory_length + 7) weights whatever the
+    memory length (a Q-table needs 3^(2 * memory_length) rows), and what is learnt in one state
+    carries over to similar ones.
+    The agent builds its features itself from observe(), so choose_action ignores its argument and
+    learn ignores the states it is given. Updates are normalized semi-gradient TD steps: each moves
+    Q(s, a) by exactly alpha * (TD error), whatever the number of active features. learn_batch applies
+    many transitions at once (see training.train_linear_agent_batched).
+    """
+    observes = "history"
+    learns_from_observations = True # learn() needs no state arguments (see match_kernels.py)
+
+    def __init__(self,
+                 alpha: float = 0.1,    # Learning rate (fraction of the TD error each update corrects)
+                 gamma: float = 0.9,    # Discount factor
+                 epsilon: float = 0.1,  # Exploration rate (for epsilon-greedy policy)
+                 name: str = "LinearQLearner",
+                 memory_length: int = 8, # Rounds of one-hot move features
+                 streak_cap: int = 8,   # Runs of identical moves longer than this look the same
+                 seed=None):            # Seed of the exploration stream (see rng.py)
+        self.memory_length = memory_length
+        self.streak_cap = streak_cap
+        self.features = LinearFeatures(memory_length, 1, streak_cap)
+        self.weights = np.zeros((2, self.features.size)) # weights[action] . x = Q(x, action)
+        self.alpha = alpha
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.name = name
+        self.episodes_trained = 0
+        self.max_q_change = 0.0   # Largest |Q-value update| since last cleared
+        self.last_state = None    # Features the last action was chosen from
+        self.last_q_values = None # And their Q-values (Cooperate, Cheat)
+        self.rng = RandomStream(seed)
+
+    def seed(self, seed):
+        """Restarts the exploration stream from `seed`."""
+        self.rng.seed(seed)
+
+    def q_values(self, x: np.ndarray = None) -> tuple:
+        """Q-values (Cooperate, Cheat) of a feature vector (default: the current one)."""
+        return tuple((self.weights @ (self.features.X[0] if x is None else x)).tolist())
+
+    def choose_action(self, observation=None) -> int:
+        x = self.features.X[0]
+        self.last_state = x # Still intact after the observe that follows (see LinearFeatures)
+        self.last_q_values = q_values = (self.weights @ x).tolist() # Also the learn that follows' Q(state, .)
+        if self.rng.uniform() < self.epsilon:
+            return PrisonersDilemma.CHEAT if self.rng.uniform() < 0.5 else PrisonersDilemma.COOPERATE
+        if q_values[PrisonersDilemma.COOPERATE] >= q_values[PrisonersDilemma.CHEAT]:
+            return PrisonersDilemma.COOPERATE
+        return PrisonersDilemma.CHEAT
+
+    def observe(self, own_action: int, opponent_action: int):
+        self.features.push(own_action, opponent_action)
+
+    def learn(self, state, action: int, reward: int, next_state):
+        """
+        One TD update from the features the action was chosen from to the current ones
+        (called after observe). `state` and `next_state` are ignored.
+        :return: The change applied to Q(state, action).
+        """
+        x = self.last_state
+        next_q_values = (self.weights @ self.features.X[0]).tolist()
+        change = self.alpha * (reward + self.gamma * max(next_q_values) - self.last_q_values[action])
+        self.weights[action] += (change / (x @ x)) * x
+        if abs(change) > self.max_q_change:
+            self.max_q_change = abs(change)
+        return change
+
+    def learn_batch(self, states: np.ndarray, actions: np.ndarray, rewards: np.ndarray, next_states: np.ndarray,
+                    q_values: np.ndarray = None):
+        """
+        Applies a batch of TD updates at once, all computed from the weights as they were before the
+        batch. Each action's weights take the mean of its transitions' steps, so the batch size
+        does not change the step size.
+        :param states: (n, size) features the actions were chosen from.
+        :param actions: (n,) actions taken.
+        :param rewards: (n,) rewards received.
+        :param next_states: (n, size) features after the round.
+        :param q_values: (n, 2) states @ weights.T, if the caller already has it (e.g. from choosing the actions).
+        :return: (n,) alpha * TD error of each transition.
+        """
+        weights = self.weights
+        if q_values is None:
+            q = np.einsum("ij,ij->i", states, weights[actions])
+        else:
+            q = np.where(actions == PrisonersDilemma.CHEAT, q_values[:, PrisonersDilemma.CHEAT],
+                         q_values[:, PrisonersDilemma.COOPERATE])
+        next_q_values = weights @ next_states.T # (2, n): one contiguous row per action
+        targets = rewards + self.gamma * np.maximum(next_q_values[0], next_q_values[1])
+        changes = self.alpha * (targets - q)
+        counts = np.bincount(actions, minlength=2)
+        scales = changes / (np.einsum("ij,ij->i", states, states) * counts.take(actions))
+        chosen = actions == _ACTION_ROWS # (2, n): which transitions update each action's weights
+        weights += (chosen * scales) @ states
+        if len(changes):
+            self.max_q_change = max(self.max_q_change, float(np.abs(changes).max()))
+        return changes
+
+    def reset(self):
+        """Starts a new match: clears the features (the weights are kept)."""
+        self.features.reset()
+        self.last_state = None
+        self.last_q_values = None
@@ -0,0 +1,101 @@
+# rng.py
+
+import hashlib
+from itertools import chain
+
+import numpy as np
+
+# Streams of one match (see seed_match): one per player, one for the environment's execution noise
+MATCH_STREAMS = ("player1", "player2", "noise")
+
+
+def derive_seed(master_seed, *keys) -> np.random.SeedSequence:
+    """
+    Seed of an independent stream identified by `keys` (strings or integers, e.g. an agent's name,
+    a match number), derived from one master seed. The same master seed and keys always give the
+    same stream, no matter how many other streams are derived or in which order.
+    """
+    if isinstance(master_seed, np.random.SeedSequence): # Derived from a derived seed
+        entropy = master_seed.entropy
+        master_words = list(entropy) if isinstance(entropy, (list, tuple)) else [entropy]
+    else:
+        master_words = [master_seed]
+    words = [int.from_bytes(hashlib.sha256(str(key).encode()).digest()[:8], "little") for key in keys]
+    return np.random.SeedSequence(master_words + words)
+
+
+def make_generator(master_seed, *keys) -> np.random.Generator:
+    """numpy Generator of the stream derive_seed(master_seed, *keys); unseeded if master_seed is None."""
+    return np.random.default_rng(None if master_seed is None else derive_seed(master_seed, *keys))
+
+
+class RandomStream:
+    """
+    Uniform [0, 1) floats from a numpy Generator, drawn block_size at a time and served one by one.
+    `uniform` is the `__next__` of an iterator over the blocks, so a draw is a single C call with no
+    Python frame: as cheap as `random.random()`, and several times cheaper than `Generator.random()`.
+    Agents and environments keep one each (as `rng`) and read `self.rng.uniform()` per decision.
+    Copies are not independent: copy.copy of an agent shares its stream object, and copy.deepcopy
+    or pickling (e.g. to a worker process) duplicates the stream's state, so the copy replays the
+    original's draws. Reseed copies (seed_agent) where they must differ, with None for fresh entropy.
+    """
+    def __init__(self, seed=None, block_size: int = 1024):
+        self.block_size = block_size
+        self.seed(seed)
+
+    def seed(self, seed, pending: list = ()):
+        """Restarts the stream from `seed` (anything np.random.default_rng accepts), in place."""
+        self.generator = np.random.default_rng(seed)
+        self._start(list(pending))
+
+    def _start(self, pending: list):
+        self._block = pending
+        self._current = iter(pending)
+        self.uniform = chain.from_iterable(self._blocks()).__next__
+
+    def _blocks(self):
+        yield self._current
+        while True:
+            self._block = self.generator.random(self.block_size).tolist()
+            self._current = iter(self._block)
+            yield self._current
+
+    def uniforms(self, n: int) -> np.ndarray:
+        """The next n draws as an array (the same values n calls to uniform() would give)."""
+        return np.fromiter((self.uniform() for _ in range(n)), dtype=np.float64, count=n)
+
+    def __getstate__(self):
+        # The block iterator cannot be pickled: keep the undrawn rest of the current block instead
+        remaining = self._current.__length_hint__()
+        return {"block_size": self.block_size, "generator": self.generator,
+                "pending": self._block[len(self._block) - remaining:] if remaining else []}
+
+    def __setstate__(self, state: dict):
+        self.block_size = state["block_size"]
+        self.generator = state["generator"]
+        self._start(state["pending"])
+
+    def __repr__(self):
+        return f"RandomStream(block_size={self.block_size})"
+
+
+def seed_agent(agent, seed):
+    """
+    Reseeds an agent's random stream, if it has one (agents with a `seed(seed)` method).
+    A seed of None draws fresh OS entropy, e.g. to make a copy's stream independent of the original's.
+    """
+    reseed = getattr(agent, "seed", None)
+    if callable(reseed):
+        reseed(seed)
+
+
+def seed_match(agent1, agent2, env, seed):
+    """
+    Gives a match its own streams, derived from `seed`: one per player and one for the
+    environment's execution noise (MATCH_STREAMS). run_match(..., seed=s) plays with exactly
+    these streams, and so does match k of batch_engine.run_batch(..., seeds=[..., s, ...]).
+    An agent playing itself (the same object on both sides) has a single stream, player 2's.
+    """
+    seed_agent(agent1, derive_seed(seed, MATCH_STREAMS[0]))
+    seed_agent(agent2, derive_seed(seed, MATCH_STREAMS[1]))
+    seed_agent(env, derive_seed(seed, MATCH_STREAMS[2]))
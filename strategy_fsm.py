@@ -0,0 +1,174 @@
+# strategy_fsm.py
+
+import copy
+from collections import deque
+
+import numpy as np
+
+from game_environment import PrisonersDilemma
+from rl_agents import QLearningAgent
+from classic_strategies import ClassicStrategy
+
+MAX_FSM_STATES = 100_000 # Guard against strategies whose state space never closes
+
+
+class StrategyFSM:
+    """
+    A deterministic strategy compiled to a finite-state machine.
+    State 0 is the start of a match. In state s the strategy plays actions[s], and after
+    the opponent plays o it moves to transitions[s, o].
+    """
+    def __init__(self, name: str, actions, transitions):
+        self.name = name
+        self.actions = np.asarray(actions, dtype=np.int8)
+        self.transitions = np.asarray(transitions, dtype=np.int64).reshape(-1, 2)
+
+    @property
+    def num_states(self) -> int:
+        return len(self.actions)
+
+    def __repr__(self):
+        return f"StrategyFSM({self.name!r}, states={self.num_states})"
+
+
+def is_deterministic(agent) -> bool:
+    """True if the agent's play is fully determined by the match so far."""
+    if isinstance(agent, QLearningAgent):
+        return agent.epsilon == 0
+    return getattr(type(agent), "deterministic", False)
+
+
+def _strategy_key(strategy: ClassicStrategy) -> tuple:
+    return tuple(sorted(vars(strategy).items()))
+
+
+def _compile_classic(agent: ClassicStrategy, memory_length: int) -> StrategyFSM:
+    """
+    Explores every configuration (internal strategy state, visible history window) reachable
+    by driving copies of `agent` exactly like run_match does (choose_action, then observe), numbering
+    them as FSM states.
+    """
+    start = copy.deepcopy(agent)
+    start.reset()
+    configs = [(start, ())]
+    index = {(_strategy_key(start), ()): 0}
+    actions = []
+    transitions = []
+
+    for strategy, window in configs: # configs grows while we iterate (breadth-first)
+        strategy = copy.deepcopy(strategy) # choose_action may update the strategy's state
+        action = strategy.choose_action(deque(window))
+        actions.append(action)
+        for opponent_action in PrisonersDilemma.ACTIONS:
+            successor = copy.deepcopy(strategy)
+            if hasattr(successor, "observe"):
+                successor.observe(action, opponent_action)
+            next_window = (window + (opponent_action,))[-memory_length:] if memory_length else ()
+            key = (_strategy_key(successor), next_window)
+            if key not in index:
+                if len(configs) >= MAX_FSM_STATES:
+                    raise ValueError(f"{agent.name} does not compile to a finite-state machine "
+                                     f"with at most {MAX_FSM_STATES} states.")
+                index[key] = len(configs)
+                configs.append((successor, next_window))
+            transitions.append(index[key])
+
+    return StrategyFSM(agent.name, actions, transitions)
+
+
+def _compile_q_policy(agent: QLearningAgent, memory_length: int) -> StrategyFSM:
+    """A greedy Q-policy's states are the (own window, opponent window) pairs it can observe."""
+    pad = (-1,) * memory_length
+    states = [(pad, pad)]
+    index = {states[0]: 0}
+    actions = []
+    transitions = []
+
+    for own_window, opponent_window in states:
+        q_values = agent.q_values((own_window, opponent_window))
+        action = PrisonersDilemma.COOPERATE if q_values[PrisonersDilemma.COOPERATE] >= q_values[PrisonersDilemma.CHEAT] \
+            else PrisonersDilemma.CHEAT
+        actions.append(action)
+        for opponent_action in PrisonersDilemma.ACTIONS:
+            if memory_length:
+                state = ((own_window + (action,))[1:], (opponent_window + (opponent_action,))[1:])
+            else:
+                state = ((), ())
+            if state not in index:
+                index[state] = len(states)
+                states.append(state)
+            transitions.append(index[state])
+
+    return StrategyFSM(agent.name, actions, transitions)
+
+
+_classic_fsm_cache = {}
+
+def compile_fsm(agent, memory_length: int) -> StrategyFSM:
+    """
+    Compiles a deterministic agent (see is_deterministic) for an environment with the given
+    memory_length. Classic strategies are compiled once per class and memory length.
+    """
+    if not is_deterministic(agent):
+        raise ValueError(f"{agent.name} is not deterministic and cannot be compiled to an FSM.")
+    if isinstance(agent, QLearningAgent):
+        return _compile_q_policy(agent, memory_length)
+    key = (type(agent), memory_length)
+    if key not in _classic_fsm_cache:
+        _classic_fsm_cache[key] = _compile_classic(agent, memory_length)
+    return _classic_fsm_cache[key]
+
+
+def play_fsm_match(fsm1: StrategyFSM, fsm2: StrategyFSM, num_rounds: int, record_rounds: bool = False):
+    """
+    Plays a match between two compiled strategies. The joint state (state1, state2) must repeat
+    within fsm1.num_states * fsm2.num_states rounds; once it does, the rest of the match is
+    the detected cycle repeated, so the totals are computed in closed form.
+    :return: (agent1_score, agent2_score, agent1_round_scores, agent2_round_scores);
+             the round score arrays are None unless record_rounds is set.
+    """
+    payoffs = PrisonersDilemma.PAYOFF_MATRIX
+    seen = {}
+    rewards = []
+    s1 = s2 = 0
+    while len(rewards) < num_rounds and (s1, s2) not in seen:
+        seen[(s1, s2)] = len(rewards)
+        a1 = fsm1.actions[s1]
+        a2 = fsm2.actions[s2]
+        rewards.append(payoffs[a1, a2])
+        s1, s2 = fsm1.transitions[s1, a2], fsm2.transitions[s2, a1]
+
+    rewards = np.array(rewards, dtype=np.int64).reshape(-1, 2)
+    if len(rewards) == num_rounds:
+        totals = rewards.sum(axis=0)
+        trace = rewards
+    else:
+        cycle_start = seen[(s1, s2)]
+        prefix, cycle = rewards[:cycle_start], rewards[cycle_start:]
+        repeats, remainder = divmod(num_rounds - cycle_start, len(cycle))
+        totals = prefix.sum(axis=0) + repeats * cycle.sum(axis=0) + cycle[:remainder].sum(axis=0)
+        trace = np.concatenate((prefix, np.tile(cycle, (repeats, 1)), cycle[:remainder])) if record_rounds else None
+
+    if not record_rounds:
+        return int(totals[0]), int(totals[1]), None, None
+    return int(totals[0]), int(totals[1]), trace[:, 0].copy(), trace[:, 1].copy()
+
+
+def fast_forward_match(agent1, agent2, num_rounds: int, env: PrisonersDilemma, record_rounds: bool = False):
+    """
+    Same result as run_match(agent1, agent2, num_rounds, env) for two deterministic agents,
+    in time bounded by the cycle length instead of num_rounds.
+    """
+    return play_fsm_match(compile_fsm(agent1, env.memory_length), compile_fsm(agent2, env.memory_length),
+                          num_rounds, record_rounds=record_rounds)
+
+
+# Example Usage
+if __name__ == "__main__":
+    from classic_strategies import AlwaysCooperate, AlwaysCheat, TitForTat, Grudger, Pavlov, TitForTwoTats, TwoTitsForTat
+
+    env = PrisonersDilemma(memory_length=2)
+    strategies = [AlwaysCooperate(), AlwaysCheat(), TitForTat(), Grudger(), Pavlov(), TitForTwoTats(), TwoTitsForTat()]
+    for strategy in strategies:
+        print(compile_fsm(strategy, env.memory_length))
+    print(fast_forward_match(TwoTitsForTat(), AlwaysCheat(), 50_000, env))
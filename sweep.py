@@ -0,0 +1,318 @@
+# sweep.py
+
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from game_environment import PrisonersDilemma
+from rl_agents import QLearningAgent
+from classic_strategies import (
+    AlwaysCooperate, AlwaysCheat, TitForTat, Grudger, Pavlov, RandomStrategy,
+    TitForTwoTats, TwoTitsForTat, GenerousTitForTat, AdaptiveTitForTat
+)
+from tournament import run_tournament, evaluate_pairing, pairing_rng
+from training import train_q_agent_batched, train_q_agent_parallel, ConvergenceMonitor
+from payoff_cache import PayoffCache
+from rng import derive_seed, make_generator
+
+# Settings of one sweep point; a spec overrides any of them. The defaults are main.py's.
+SWEEP_DEFAULTS = {
+    "alpha": 0.1,                  # QLearningAgent learning rate
+    "gamma": 0.9,                  # QLearningAgent discount factor
+    "epsilon": 0.2,                # Exploration rate while training
+    "eval_epsilon": 0.05,          # Exploration rate while evaluated
+    "memory_length": 1,
+    "rounds_per_match": 50,
+    "num_training_episodes": 2000,
+    "num_training_envs": 1,        # > 1: train_q_agent_batched with this many matches in lockstep
+    "convergence": None,           # ConvergenceMonitor settings (None: always train the full budget)
+    "planning_steps": 0,           # Prioritized-sweeping backups per real round (needs num_training_envs 1)
+    "noise": 0.0,
+    "num_eval_matches_per_pair": 50,
+    "eval_ci_half_width": 5.0,
+    "eval_confidence": 0.95,
+    "eval_seed": 0,
+    "seed": 0,                     # Master seed of training; the same for every point unless swept
+}
+
+# Settings that change the opponent-only (classic vs classic) results, which are shared by all points agreeing on them
+OPPONENT_SETTINGS = ("memory_length", "rounds_per_match", "noise", "num_eval_matches_per_pair",
+                     "eval_ci_half_width", "eval_confidence", "eval_seed")
+
+QLEARNER_NAME = "QLearner (Eval)"
+
+
+def default_opponents() -> list:
+    return [AlwaysCooperate(), AlwaysCheat(), TitForTat(), Grudger(), Pavlov(), RandomStrategy(),
+            TitForTwoTats(), TwoTitsForTat(), GenerousTitForTat(), AdaptiveTitForTat()]
+
+
+def _check_keys(spec: dict):
+    unknown = set(spec) - set(SWEEP_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown sweep settings {sorted(unknown)}; expected some of {sorted(SWEEP_DEFAULTS)}.")
+
+
+def grid(spec: dict) -> list:
+    """
+    Every combination of the spec's values.
+    :param spec: setting -> list of values (a single value is held fixed).
+    """
+    _check_keys(spec)
+    names = list(spec)
+    values = [value if isinstance(value, list) else [value] for value in spec.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def random_search(spec: dict, num_points: int, seed: int = 0) -> list:
+    """
+    num_points independent random draws from the spec.
+    :param spec: setting -> list of values (drawn uniformly), ("uniform", low, high),
+                 ("loguniform", low, high), ("int", low, high) (both ends included), or a fixed value.
+    """
+    _check_keys(spec)
+    rng = np.random.default_rng(seed)
+    def draw(value):
+        if isinstance(value, list):
+            return value[rng.integers(len(value))]
+        if isinstance(value, tuple):
+            kind, low, high = value
+            if kind == "uniform":
+                return float(rng.uniform(low, high))
+            if kind == "loguniform":
+                return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+            if kind == "int":
+                return int(rng.integers(low, high + 1))
+            raise ValueError(f"Unknown distribution {kind!r}; use 'uniform', 'loguniform' or 'int'.")
+        return value
+    return [{name: draw(value) for name, value in spec.items()} for _ in range(num_points)]
+
+
+def config_id(config: dict) -> str:
+    """Identifies a point of the sweep by its full settings, so a resumed sweep knows what is done."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _opponent_key(config: dict) -> str:
+    return json.dumps([config[name] for name in OPPONENT_SETTINGS])
+
+
+def _env(config: dict) -> PrisonersDilemma:
+    return PrisonersDilemma(memory_length=config["memory_length"], noise=config["noise"],
+                            seed=derive_seed(config["seed"], "noise"))
+
+
+# Per-process state of run_sweep, set up once by _init_sweeper
+_sweeper = {}
+
+def _init_sweeper(opponents: list):
+    _sweeper["opponents"] = opponents
+
+def _run_point(config: dict) -> dict:
+    """Trains a QLearner with the point's settings and evaluates it against every opponent."""
+    start = time.perf_counter()
+    opponents = _sweeper["opponents"]
+    env = _env(config)
+    q_agent = QLearningAgent(alpha=config["alpha"], gamma=config["gamma"], epsilon=config["epsilon"],
+                             name=QLEARNER_NAME, memory_length=config["memory_length"],
+                             planning_steps=config["planning_steps"],
+                             seed=derive_seed(config["seed"], "learner"))
+    monitor = ConvergenceMonitor(**config["convergence"]) if config["convergence"] is not None else None
+    if config["num_training_envs"] > 1:
+        curve = train_q_agent_batched(q_agent, opponents, config["num_training_episodes"], config["rounds_per_match"],
+                                      env, num_envs=config["num_training_envs"],
+                                      rng=make_generator(config["seed"], "training"), verbose=False, monitor=monitor)
+    else: # One process, so the run is reproducible from the seed
+        curve, _ = train_q_agent_parallel(q_agent, opponents, config["num_training_episodes"],
+                                          config["rounds_per_match"], env, workers=1,
+                                          seed=derive_seed(config["seed"], "training"), verbose=False, monitor=monitor)
+
+    q_agent.epsilon = config["eval_epsilon"]
+    results = [evaluate_pairing(q_agent, opponent, config["num_eval_matches_per_pair"], config["rounds_per_match"], env,
+                                rng=pairing_rng(config["eval_seed"], q_agent.name, opponent.name),
+                                target_ci=config["eval_ci_half_width"], confidence=config["eval_confidence"])
+               for opponent in opponents]
+    return {"config": config, "curve": np.asarray(curve, dtype=np.int32), "results": np.array(results),
+            "seconds": time.perf_counter() - start}
+
+
+def _opponent_tables(configs: list, opponents: list, workers: int, cache: PayoffCache, verbose: bool,
+                     tables: dict) -> dict:
+    """Opponent-vs-opponent scores and CI half-widths, once per distinct OPPONENT_SETTINGS not yet in `tables`."""
+    names = [opponent.name for opponent in opponents]
+    for config in configs:
+        key = _opponent_key(config)
+        if key in tables:
+            continue
+        if verbose:
+            print(f"Opponent pairings for {dict(zip(OPPONENT_SETTINGS, json.loads(key)))}")
+            sys.stdout.flush()
+        scores, ci = run_tournament(opponents, config["rounds_per_match"], config["num_eval_matches_per_pair"],
+                                    _env(config), master_seed=config["eval_seed"], workers=workers, verbose=False,
+                                    cache=cache, target_ci=config["eval_ci_half_width"],
+                                    confidence=config["eval_confidence"])
+        tables[key] = (np.array([[scores[row][column] for column in names] for row in names]),
+                       np.array([[ci[row][column] for column in names] for row in names]))
+    return tables
+
+
+def save_results(path: str, points: list, opponent_names: list, opponent_tables: dict):
+    """
+    Writes all finished points as one columnar .npz file (one array per column), replacing `path`
+    atomically. Columns:
+      - config_id, config (JSON), one column per setting, seconds, episodes, mean_score
+        (the QLearner's mean score against the opponents);
+      - curve_offsets / curves: every point's training curve, concatenated (point k's curve is
+        curves[curve_offsets[k]:curve_offsets[k + 1]]);
+      - q_vs / vs_q / q_vs_ci / vs_q_ci / eval_matches: (points, opponents) arrays of the QLearner's
+        and its opponents' scores in their pairings, with CI half-widths and matches played;
+      - opponents, opponent_keys, opponent_scores, opponent_ci: the shared opponent-vs-opponent tables,
+        and opponent_table: which of them belongs to each point.
+    """
+    keys = list(opponent_tables)
+    curves = [point["curve"] for point in points]
+    results = np.array([point["results"] for point in points]).reshape(len(points), len(opponent_names), 5)
+    columns = {
+        "config_id": np.array([config_id(point["config"]) for point in points]),
+        "config": np.array([json.dumps(point["config"], sort_keys=True) for point in points]),
+        "seconds": np.array([point["seconds"] for point in points]),
+        "episodes": np.array([len(curve) for curve in curves], dtype=np.int64),
+        "mean_score": results[:, :, 0].mean(axis=1) if points else np.empty(0),
+        "curve_offsets": np.concatenate(([0], np.cumsum([len(curve) for curve in curves]))).astype(np.int64),
+        "curves": np.concatenate(curves) if curves else np.empty(0, dtype=np.int32),
+        "q_vs": results[:, :, 0], "vs_q": results[:, :, 1],
+        "q_vs_ci": results[:, :, 2], "vs_q_ci": results[:, :, 3], "eval_matches": results[:, :, 4].astype(np.int64),
+        "opponents": np.array(opponent_names),
+        "opponent_keys": np.array(keys),
+        "opponent_scores": np.array([opponent_tables[key][0] for key in keys]),
+        "opponent_ci": np.array([opponent_tables[key][1] for key in keys]),
+        "opponent_table": np.array([keys.index(_opponent_key(point["config"])) for point in points], dtype=np.int64),
+    }
+    for name in SWEEP_DEFAULTS:
+        values = [point["config"][name] for point in points]
+        if all(isinstance(value, (int, float, bool)) for value in values):
+            columns[name] = np.array(values)
+        else:
+            columns[name] = np.array([json.dumps(value) for value in values])
+    temporary_path = f"{path}.tmp.npz"
+    np.savez(temporary_path, **columns)
+    os.replace(temporary_path, path)
+
+
+def load_results(path: str) -> dict:
+    """The columns written by save_results, as a dict of arrays."""
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def _points_from_results(results: dict) -> list:
+    """Rebuilds finished points from a results file, for resuming."""
+    points = []
+    offsets = results["curve_offsets"]
+    for k, text in enumerate(results["config"]):
+        evaluation = np.stack([results["q_vs"][k], results["vs_q"][k], results["q_vs_ci"][k],
+                               results["vs_q_ci"][k], results["eval_matches"][k]], axis=1)
+        # Settings added since the file was written take their default, which is what those points ran with
+        points.append({"config": {**SWEEP_DEFAULTS, **json.loads(str(text))}, "curve": results["curves"][offsets[k]:offsets[k + 1]],
+                       "results": evaluation, "seconds": float(results["seconds"][k])})
+    return points
+
+
+def pairwise_table(results: dict, index: int):
+    """
+    The full pairwise average score table of point `index` (rows play against columns), like
+    main.py prints: the point's QLearner pairings plus its shared opponent-vs-opponent table.
+    """
+    import pandas as pd
+    names = [QLEARNER_NAME] + [str(name) for name in results["opponents"]]
+    table = np.full((len(names), len(names)), np.nan)
+    table[0, 1:] = results["q_vs"][index]
+    table[1:, 0] = results["vs_q"][index]
+    table[1:, 1:] = results["opponent_scores"][results["opponent_table"][index]]
+    np.fill_diagonal(table, np.nan)
+    return pd.DataFrame(table, index=names, columns=names)
+
+
+def run_sweep(points: list, path: str, workers: int = None, opponents: list = None, resume: bool = True,
+              cache: PayoffCache = None, save_every: float = 10.0, verbose: bool = True) -> dict:
+    """
+    Runs the training and evaluation pipeline for every point of a sweep (see grid and random_search)
+    across a process pool, storing the results in one columnar file (see save_results).
+    The opponent-vs-opponent pairings do not involve the QLearner, so they are evaluated once per
+    distinct combination of OPPONENT_SETTINGS (and read from `cache` if given) rather than per point.
+    :param points: Settings of each point; missing settings take their SWEEP_DEFAULTS value.
+    :param path: Results file (.npz). It is rewritten as points finish, at most every save_every seconds
+                 and once at the end, including when the sweep is interrupted.
+    :param workers: Processes (default: all CPUs); each trains and evaluates one point at a time.
+    :param opponents: Training and evaluation opponents (default: the classic strategies).
+    :param resume: Keep the points already in `path` and only run the missing ones.
+    :return: The results, as returned by load_results.
+    """
+    opponents = opponents if opponents is not None else default_opponents()
+    opponent_names = [opponent.name for opponent in opponents]
+    configs = []
+    for point in points:
+        _check_keys(point)
+        configs.append({**SWEEP_DEFAULTS, **point})
+    done = []
+    opponent_tables = {}
+    if resume and os.path.exists(path):
+        previous = load_results(path)
+        if list(previous["opponents"]) != opponent_names:
+            raise ValueError(f"{path} was written with other opponents ({list(previous['opponents'])}).")
+        done = _points_from_results(previous)
+        for k, key in enumerate(previous["opponent_keys"]):
+            opponent_tables[str(key)] = (previous["opponent_scores"][k], previous["opponent_ci"][k])
+    done_ids = {config_id(point["config"]) for point in done}
+    todo = [config for config in configs if config_id(config) not in done_ids]
+    todo = list({config_id(config): config for config in todo}.values()) # Duplicates run once
+    workers = workers or os.cpu_count() or 1
+    if verbose:
+        print(f"Sweep: {len(configs)} points, {len(configs) - len(todo)} already in {path}, {len(todo)} to run "
+              f"on {min(workers, max(1, len(todo)))} worker(s)")
+
+    opponent_tables = _opponent_tables(todo, opponents, workers, cache, verbose, opponent_tables)
+    last_save = time.perf_counter()
+    executor = None
+    try:
+        if workers == 1 or len(todo) <= 1:
+            _init_sweeper(opponents)
+            finished = (_run_point(config) for config in todo)
+        else:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(todo)), initializer=_init_sweeper,
+                                           initargs=(opponents,))
+            finished = (future.result() for future in as_completed([executor.submit(_run_point, config)
+                                                                    for config in todo]))
+        for point in finished:
+            done.append(point)
+            if verbose:
+                settings = {name: point["config"][name] for name in SWEEP_DEFAULTS
+                            if point["config"][name] != SWEEP_DEFAULTS[name]}
+                print(f"  [{len(done)}/{len(configs)}] {settings}: mean score {point['results'][:, 0].mean():.2f} "
+                      f"after {len(point['curve'])} episodes ({point['seconds']:.1f}s)")
+                sys.stdout.flush()
+            if time.perf_counter() - last_save >= save_every:
+                save_results(path, done, opponent_names, opponent_tables)
+                last_save = time.perf_counter()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        save_results(path, done, opponent_names, opponent_tables)
+        _sweeper.clear()
+    return load_results(path)
+
+
+# Example Usage
+if __name__ == "__main__":
+    spec = {"alpha": [0.05, 0.1, 0.3], "epsilon": [0.05, 0.2], "memory_length": [1, 2],
+            "num_training_episodes": 500}
+    results = run_sweep(grid(spec), "sweep_results.npz", cache=PayoffCache("payoff_cache.sqlite"))
+    best = int(np.argmax(results["mean_score"]))
+    print(f"\nBest point: {results['config'][best]} (mean score {results['mean_score'][best]:.2f})")
+    print(pairwise_table(results, best).round(2))
@@ -0,0 +1,173 @@
+# tournament.py
+
+import hashlib
+import os
+import sys
+import time
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from game_environment import PrisonersDilemma
+from batch_engine import run_match_batch
+from markov_eval import expected_scores
+from strategy_fsm import is_deterministic, fast_forward_match
+from payoff_cache import PayoffCache
+from profiling import Profiler
+
+
+def pairing_rng(master_seed: int, name1: str, name2: str) -> np.random.Generator:
+    """
+    RNG stream of the pairing (name1, name2). It depends only on the master seed and the two
+    agents' names, never on which worker plays it, in which order, or who else takes part.
+    """
+    pairing = int.from_bytes(hashlib.sha256(f"{name1}\0{name2}".encode()).digest()[:8], "little")
+    return np.random.default_rng(np.random.SeedSequence([master_seed, pairing]))
+
+
+def evaluate_pairing(agent1, agent2, num_matches: int, num_rounds: int, env: PrisonersDilemma,
+                     rng: np.random.Generator = None, target_ci: float = None, confidence: float = 0.95,
+                     batch_size: int = 10) -> tuple:
+    """
+    Average scores of both agents over a pairing's matches, with their confidence intervals.
+    Memory-one pairings are solved exactly as Markov chains, and pairings of two deterministic
+    agents (including QLearners with epsilon 0) are played once, by cycle detection, unless the
+    environment has execution noise. The rest are
+    sampled with the batch engine: all num_matches at once or, with target_ci, in batches of
+    batch_size until both confidence intervals are narrower than target_ci, or num_matches is reached.
+    :param target_ci: Target half-width of the confidence intervals, in points; None plays num_matches.
+    :param confidence: Confidence level of the intervals (normal approximation).
+    :return: (score1, score2, ci1, ci2, matches): ci1/ci2 are the half-widths (0.0 for exact results),
+             matches the number of matches played (0 when solved analytically).
+    """
+    exact_scores = expected_scores(agent1, agent2, num_rounds, env)
+    if exact_scores is not None:
+        return exact_scores[0], exact_scores[1], 0.0, 0.0, 0
+    if not env.noise and is_deterministic(agent1) and is_deterministic(agent2):
+        s1, s2, _, _ = fast_forward_match(agent1, agent2, num_rounds, env)
+        return float(s1), float(s2), 0.0, 0.0, 1
+
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    def half_width(scores):
+        return z * float(scores.std(ddof=1)) / np.sqrt(len(scores)) if len(scores) > 1 else float("inf")
+
+    step = num_matches if target_ci is None else min(batch_size, num_matches)
+    scores1 = np.empty(0, dtype=np.int64)
+    scores2 = np.empty(0, dtype=np.int64)
+    while len(scores1) < num_matches:
+        batch1, batch2, _, _ = run_match_batch(agent1, agent2, min(step, num_matches - len(scores1)), num_rounds, env, rng=rng)
+        scores1 = np.concatenate((scores1, batch1))
+        scores2 = np.concatenate((scores2, batch2))
+        if target_ci is not None and max(half_width(scores1), half_width(scores2)) <= target_ci:
+            break
+    ci1, ci2 = (half_width(scores1), half_width(scores2)) if len(scores1) > 1 else (float("nan"), float("nan"))
+    return float(scores1.mean()), float(scores2.mean()), ci1, ci2, len(scores1)
+
+
+# Per-process tournament setup, shipped once to each worker by _init_worker
+_worker = {}
+
+def _init_worker(agents, env: PrisonersDilemma, num_matches: int, num_rounds: int, master_seed: int, sampling: dict):
+    _worker["agents"] = agents
+    _worker["env"] = env
+    _worker["num_matches"] = num_matches
+    _worker["num_rounds"] = num_rounds
+    _worker["master_seed"] = master_seed
+    _worker["sampling"] = sampling
+
+def _play_pairing(i: int, j: int):
+    agents = _worker["agents"]
+    start = time.perf_counter()
+    result = evaluate_pairing(agents[i], agents[j], _worker["num_matches"], _worker["num_rounds"], _worker["env"],
+                              rng=pairing_rng(_worker["master_seed"], agents[i].name, agents[j].name),
+                              **_worker["sampling"])
+    return i, j, result, time.perf_counter() - start
+
+
+def run_tournament(agents: list, num_rounds: int, num_matches: int, env: PrisonersDilemma,
+                   master_seed: int = 0, workers: int = None, verbose: bool = True,
+                   cache: PayoffCache = None, profiler: Profiler = None, target_ci: float = None,
+                   confidence: float = 0.95) -> tuple:
+    """
+    Round-robin tournament. Each unordered pairing is evaluated once (see evaluate_pairing) and
+    both agents' average scores and confidence intervals are recorded. Pairings are sharded across
+    a process pool; the agents (including any trained Q-table) are sent to each worker once, when
+    the worker starts.
+    Results are identical for any number of workers.
+    :param agents: Agents taking part. Names must be unique; agents are not modified.
+    :param num_rounds: Rounds per match.
+    :param num_matches: Matches per pairing when a pairing has to be sampled (with target_ci, the most
+                        that are played).
+    :param env: The game environment.
+    :param master_seed: Seed from which every pairing's RNG stream is derived.
+    :param workers: Number of worker processes (default: all CPUs). 1 runs in this process.
+    :param verbose: Print each pairing as it completes.
+    :param cache: Optional PayoffCache. Cached pairings are not simulated again, and new
+                  results are added to it.
+    :param profiler: Optional Profiler; records each pairing's evaluation time (measured in the
+                     worker), per pair of agent classes, and counts of cached and evaluated pairings
+                     and of matches played.
+    :param target_ci: Sample stochastic pairings only until their confidence intervals' half-width
+                      is at most this many points (None: always num_matches).
+    :param confidence: Confidence level of the intervals.
+    :return: (pairwise_scores, pairwise_ci): pairwise_scores[row_name][column_name] = average score of
+             row against column, pairwise_ci the matching confidence interval half-widths (0.0 for
+             exact results). The diagonal is left at 0.0, agents do not play themselves.
+    """
+    pairings = [(i, j) for i in range(len(agents)) for j in range(i + 1, len(agents))]
+    pairwise_scores = {agent.name: {opponent.name: 0.0 for opponent in agents} for agent in agents}
+    pairwise_ci = {agent.name: {opponent.name: 0.0 for opponent in agents} for agent in agents}
+    workers = workers or os.cpu_count() or 1
+    sampling = {"target_ci": target_ci, "confidence": confidence}
+    setup = (agents, env, num_matches, num_rounds, master_seed, sampling)
+    cache_keys = {}
+
+    def record(i, j, result, source="Evaluated"):
+        s1, s2, ci1, ci2, matches = result
+        pairwise_scores[agents[i].name][agents[j].name] = s1
+        pairwise_scores[agents[j].name][agents[i].name] = s2
+        pairwise_ci[agents[i].name][agents[j].name] = ci1
+        pairwise_ci[agents[j].name][agents[i].name] = ci2
+        if verbose:
+            played = "exact" if matches == 0 else f"{matches} match{'es' if matches != 1 else ''}"
+            print(f"  {source}: {agents[i].name} vs {agents[j].name} "
+                  f"({s1:.2f} ± {ci1:.2f} / {s2:.2f} ± {ci2:.2f}, {played})")
+            sys.stdout.flush()
+
+    def record_new(i, j, result, seconds):
+        record(i, j, result)
+        if profiler is not None:
+            profiler.add(f"tournament.pairing:{type(agents[i]).__name__} vs {type(agents[j]).__name__}", seconds)
+            profiler.count("tournament.evaluated")
+            profiler.count("tournament.matches", result[4])
+        if cache is not None:
+            cache.put(cache_keys[(i, j)], agents[i], agents[j], *result)
+
+    to_play = []
+    for i, j in pairings:
+        if cache is not None:
+            cache_keys[(i, j)] = cache.key(agents[i], agents[j], num_rounds, env.memory_length, num_matches, master_seed,
+                                           sampling={**sampling, "noise": env.noise})
+            cached_result = cache.get(cache_keys[(i, j)])
+            if cached_result is not None:
+                record(i, j, cached_result, source="Cached")
+                if profiler is not None:
+                    profiler.count("tournament.cached")
+                continue
+        to_play.append((i, j))
+
+    if not to_play:
+        return pairwise_scores, pairwise_ci
+    if workers == 1 or len(to_play) == 1:
+        _init_worker(*setup)
+        for i, j in to_play:
+            record_new(*_play_pairing(i, j))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(to_play)), initializer=_init_worker,
+                                 initargs=setup) as executor:
+            futures = [executor.submit(_play_pairing, i, j) for i, j in to_play]
+            for future in as_completed(futures):
+                record_new(*future.result())
+
+    return pairwise_scores, pairwise_ci
@@ -0,0 +1,140 @@
+# traces.py
+
+import json
+
+import numpy as np
+
+from game_environment import PrisonersDilemma
+
+# How much of each round a match keeps (see MatchKernel):
+# "off": totals only; "compact": int8 arrays in memory (MatchTrace); "streaming": appended to a file (TraceWriter)
+RECORD_LEVELS = ("off", "compact", "streaming")
+
+# One round of a trace file, and one match of its index
+ROUND_DTYPE = np.dtype([("action1", np.int8), ("action2", np.int8), ("reward1", np.int8), ("reward2", np.int8)])
+MATCH_DTYPE = np.dtype([("start", np.int64), ("rounds", np.int64), ("pairing", np.int32)])
+
+
+def _rewards(actions1: np.ndarray, actions2: np.ndarray) -> np.ndarray:
+    """(n, 2) int8 rewards of n rounds, looked up in one vectorized step."""
+    return PrisonersDilemma.PAYOFF_MATRIX[actions1, actions2].astype(np.int8)
+
+
+class MatchTrace:
+    """
+    Every round of one match as four int8 arrays (one byte per round each, instead of a Python
+    int per round in a list). Built once the match is over from the players' move logs
+    (MatchHistory.moves), so the round loop itself records nothing.
+    """
+    __slots__ = ("actions1", "actions2", "rewards1", "rewards2")
+
+    def __init__(self, actions1, actions2):
+        self.actions1 = np.asarray(actions1, dtype=np.int8)
+        self.actions2 = np.asarray(actions2, dtype=np.int8)
+        rewards = _rewards(self.actions1, self.actions2)
+        self.rewards1 = rewards[:, 0]
+        self.rewards2 = rewards[:, 1]
+
+    @classmethod
+    def from_histories(cls, history1, history2) -> "MatchTrace":
+        return cls(np.frombuffer(history1.moves, dtype=np.int8).copy(),
+                   np.frombuffer(history2.moves, dtype=np.int8).copy())
+
+    def __len__(self):
+        return len(self.actions1)
+
+    def __repr__(self):
+        return f"MatchTrace(rounds={len(self)}, totals=({int(self.rewards1.sum())}, {int(self.rewards2.sum())}))"
+
+
+class TraceWriter:
+    """
+    Streams the rounds of any number of matches to a file, four bytes per round (ROUND_DTYPE),
+    appended a chunk at a time so neither a long match nor a long run is ever held in memory.
+    The match index (MATCH_DTYPE rows: first round, number of rounds, pairing) goes to
+    <path>.matches, and the pairings' agent names to <path>.json when the writer is closed.
+    Read the result back with read_trace, which memory-maps it.
+    :param chunk_rounds: Rounds a streaming match plays between two writes (bounds its memory).
+    """
+    def __init__(self, path: str, chunk_rounds: int = 1 << 20):
+        if chunk_rounds < 1:
+            raise ValueError("chunk_rounds must be positive.")
+        self.path = path
+        self.chunk_rounds = chunk_rounds
+        self.rounds_file = open(path, "wb")
+        self.matches_file = open(f"{path}.matches", "wb")
+        self.pairings = {} # (agent1 name, agent2 name) -> pairing number
+        self.rounds = 0
+        self.matches = 0
+        self._match_start = None
+
+    def begin_match(self, agent1_name: str, agent2_name: str):
+        if self._match_start is not None:
+            raise RuntimeError("begin_match called before the previous match ended.")
+        self._pairing = self.pairings.setdefault((agent1_name, agent2_name), len(self.pairings))
+        self._match_start = self.rounds
+
+    def write(self, actions1, actions2):
+        """Appends rounds of the current match, given both players' actions (bytes or int8 arrays)."""
+        actions1 = np.frombuffer(actions1, dtype=np.int8) if isinstance(actions1, (bytes, bytearray)) else actions1
+        actions2 = np.frombuffer(actions2, dtype=np.int8) if isinstance(actions2, (bytes, bytearray)) else actions2
+        rows = np.empty(len(actions1), dtype=ROUND_DTYPE)
+        rows["action1"] = actions1
+        rows["action2"] = actions2
+        rewards = _rewards(rows["action1"], rows["action2"])
+        rows["reward1"] = rewards[:, 0]
+        rows["reward2"] = rewards[:, 1]
+        self.rounds_file.write(rows.data)
+        self.rounds += len(rows)
+
+    def end_match(self):
+        row = np.array([(self._match_start, self.rounds - self._match_start, self._pairing)], dtype=MATCH_DTYPE)
+        self.matches_file.write(row.data)
+        self.matches += 1
+        self._match_start = None
+
+    def write_match(self, agent1_name: str, agent2_name: str, trace: MatchTrace):
+        """Appends a whole match already recorded in memory."""
+        self.begin_match(agent1_name, agent2_name)
+        self.write(trace.actions1, trace.actions2)
+        self.end_match()
+
+    def flush(self):
+        self.rounds_file.flush()
+        self.matches_file.flush()
+        with open(f"{self.path}.json", "w") as f:
+            json.dump({"rounds": self.rounds, "matches": self.matches,
+                       "pairings": [list(names) for names in self.pairings]}, f, indent=2)
+
+    def close(self):
+        if self.rounds_file.closed:
+            return
+        self.flush()
+        self.rounds_file.close()
+        self.matches_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _memmap(path: str, dtype: np.dtype) -> np.ndarray:
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+    if size == 0: # numpy cannot map an empty file
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(size // dtype.itemsize,))
+
+
+def read_trace(path: str) -> tuple[np.ndarray, np.ndarray, list]:
+    """
+    Opens a file written by TraceWriter without loading it: rounds are read from disk only as
+    they are accessed (e.g. rounds["reward1"][start:start + n].sum(), or a reduction over all of it).
+    :return: (rounds, matches, pairings): ROUND_DTYPE and MATCH_DTYPE memory maps, and the
+             (agent1 name, agent2 name) of each pairing number.
+    """
+    with open(f"{path}.json") as f:
+        pairings = [tuple(names) for names in json.load(f)["pairings"]]
+    return _memmap(path, ROUND_DTYPE), _memmap(f"{path}.matches", MATCH_DTYPE), pairings
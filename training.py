@@ -0,0 +1,519 @@
+# training.py
+
+import copy
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from game_environment import PrisonersDilemma
+from rl_agents import QLearningAgent, LinearQAgent, LinearFeatures
+from batch_engine import EMPTY, GeneratorDraws, make_policy, greedy_action_table
+from match_kernels import make_kernel
+from rng import derive_seed, seed_agent
+
+
+def batch_td_update(q_table: np.ndarray, states: np.ndarray, actions: np.ndarray, targets: np.ndarray, alpha: float):
+    """
+    Applies a batch of Q-learning backups Q[s, a] += alpha * (target - Q[s, a]) to a dense Q-table.
+    All targets are computed from the table as it was before the batch. A (state, action) pair hit
+    n times moves towards the mean of its n targets by 1 - (1 - alpha)^n, which is exactly what
+    applying the n updates one after another gives when their targets are equal. So the result does
+    not depend on the order of the batch, and duplicates neither cancel out nor overshoot.
+    :return: The largest absolute change made to any Q-value.
+    """
+    flat_q = q_table.reshape(-1)
+    flat, inverse, counts = np.unique(states * 2 + actions, return_inverse=True, return_counts=True)
+    mean_targets = np.bincount(inverse, weights=targets) / counts
+    changes = (1.0 - (1.0 - alpha) ** counts) * (mean_targets - flat_q[flat])
+    flat_q[flat] += changes
+    return float(np.abs(changes).max()) if len(changes) else 0.0
+
+
+class ConvergenceMonitor:
+    """
+    Decides when Q-learning training has converged, from checks made every `check_every` episodes.
+    Each check records:
+      - max_q_change: the largest single Q-value update since the previous check (agent.max_q_change)
+      - policy_changes: states whose greedy action differs from the previous check
+      - rolling_score: the learner's mean score over the last `window` episodes
+    Training stops once `patience` consecutive checks pass every enabled criterion: policy_changes
+    <= policy_tolerance, |change of rolling_score| <= score_tolerance and, if q_tolerance is set,
+    max_q_change <= q_tolerance. A criterion set to None is not used. (With constant exploration and
+    stochastic opponents single updates never become small, so q_tolerance is off by default.)
+    """
+    def __init__(self, check_every: int = 100, window: int = 500, policy_tolerance: int = 0,
+                 score_tolerance: float = 1.0, q_tolerance: float = None, patience: int = 3, min_episodes: int = 0):
+        self.check_every = check_every
+        self.window = window
+        self.policy_tolerance = policy_tolerance
+        self.score_tolerance = score_tolerance
+        self.q_tolerance = q_tolerance
+        self.patience = patience
+        self.min_episodes = min_episodes
+        self.history = [] # One dict per check
+        self.stable_checks = 0
+        self.stop_reason = None
+        self._policy = None
+
+    def due(self, episodes_done: int, episodes_before: int = None) -> bool:
+        """True if a check falls in (episodes_before, episodes_done] (default: exactly at episodes_done)."""
+        if episodes_before is None:
+            episodes_before = episodes_done - 1
+        return episodes_done // self.check_every > episodes_before // self.check_every
+
+    def check(self, agent, episode_scores: list, memory_length: int, episodes_done: int = None) -> bool:
+        """
+        Records a check and clears agent.max_q_change.
+        :param episode_scores: The learner's scores of all episodes so far, or only the most recent ones
+                               (at least `window` of them) if episodes_done is given.
+        :param episodes_done: Episodes trained so far (default: len(episode_scores)).
+        :return: True if training should stop; the reason is in stop_reason.
+        """
+        if episodes_done is None:
+            episodes_done = len(episode_scores)
+        policy = greedy_action_table(agent, memory_length)
+        policy_changes = int(np.count_nonzero(policy != self._policy)) if self._policy is not None else len(policy)
+        self._policy = policy
+        rolling_score = float(np.mean(episode_scores[-self.window:])) if episode_scores else 0.0
+        score_change = abs(rolling_score - self.history[-1]["rolling_score"]) if self.history else float("inf")
+        entry = {"episode": episodes_done, "max_q_change": agent.max_q_change,
+                 "policy_changes": policy_changes, "rolling_score": rolling_score}
+        self.history.append(entry)
+        agent.max_q_change = 0.0
+
+        stable = (self.policy_tolerance is None or policy_changes <= self.policy_tolerance) and \
+                 (self.score_tolerance is None or score_change <= self.score_tolerance) and \
+                 (self.q_tolerance is None or entry["max_q_change"] <= self.q_tolerance)
+        self.stable_checks = self.stable_checks + 1 if stable else 0
+        if self.stable_checks >= self.patience and episodes_done >= self.min_episodes:
+            self.stop_reason = (f"converged after {episodes_done} episodes: {self.stable_checks} checks in a row with "
+                                f"{policy_changes} greedy-action changes, rolling score {rolling_score:.2f} "
+                                f"(moved {score_change:.2f}) and max Q-change {entry['max_q_change']:.4f}")
+            return True
+        return False
+
+    def finish(self, episodes: int, budget: int):
+        """Sets stop_reason at the end of training if no convergence stop happened."""
+        if self.stop_reason is None:
+            self.stop_reason = f"episode budget exhausted ({episodes}/{budget} episodes) before convergence"
+
+    def describe_last(self) -> str:
+        if not self.history:
+            return ""
+        last = self.history[-1]
+        return (f"Rolling avg: {last['rolling_score']:.2f}, max dQ: {last['max_q_change']:.4f}, "
+                f"greedy changes: {last['policy_changes']}")
+
+
+def train_q_agent_batched(q_agent: QLearningAgent, opponents: list, num_episodes: int, num_rounds: int,
+                          env: PrisonersDilemma, num_envs: int = 256, rng: np.random.Generator = None,
+                          verbose: bool = True, checkpoint_path: str = None, checkpoint_every: int = 0,
+                          monitor: ConvergenceMonitor = None) -> list:
+    """
+    Trains a dense QLearningAgent in num_envs environments at once, all sharing its Q-table.
+    Every episode plays against an opponent drawn uniformly from `opponents` (which are only read).
+    Each round, actions for all environments are chosen with one vectorized epsilon-greedy step and
+    the num_envs TD updates are applied together by batch_td_update.
+    :param q_agent: The learner; must use the dense backend with env's memory_length.
+    :param opponents: Opponent templates; any agent the batch engine supports.
+    :param num_episodes: Total number of training matches.
+    :param num_rounds: Rounds per match.
+    :param env: The game environment.
+    :param num_envs: Matches played in lockstep.
+    :param rng: numpy Generator for exploration and stochastic opponents.
+    :param verbose: Print progress about ten times during training.
+    :param checkpoint_path: Where to save the agent (QLearningAgent.save) during and after training.
+    :param checkpoint_every: Save a checkpoint whenever this many more episodes have been played (0: only at the end).
+    :param monitor: Optional ConvergenceMonitor, checked between batches; training stops early when it says so.
+    :return: The learner's score in every episode, in episode order.
+    """
+    memory_length = env.memory_length
+    if not q_agent.dense or q_agent.memory_length != memory_length:
+        raise ValueError("Batched training needs a dense Q-table (QLearningAgent(memory_length=...)) "
+                         "matching the environment's memory length.")
+    if q_agent.planner is not None:
+        raise ValueError("Batched training does not plan; train agents with planning_steps serially or with "
+                         "train_q_agent_parallel.")
+    rng = rng if rng is not None else np.random.default_rng()
+    draws = GeneratorDraws(rng)
+    q_table = q_agent.q_table
+    payoffs = env.PAYOFF_MATRIX
+    window_states = 3 ** memory_length
+    episode_scores = []
+    report_every = max(1, num_episodes // 10)
+
+    while len(episode_scores) < num_episodes:
+        num_matches = min(num_envs, num_episodes - len(episode_scores))
+        assignment = rng.integers(0, len(opponents), size=num_matches)
+        policies = [make_policy(opponents[o], np.flatnonzero(assignment == o), memory_length)
+                    for o in np.unique(assignment)]
+
+        own_window = np.full((num_matches, memory_length), EMPTY, dtype=np.int8)
+        opp_window = np.full((num_matches, memory_length), EMPTY, dtype=np.int8)
+        own_code = np.zeros(num_matches, dtype=np.int64) # Rolling base-3 codes, as in MatchState
+        opp_code = np.zeros(num_matches, dtype=np.int64)
+        opponent_actions = np.empty(num_matches, dtype=np.int8)
+        scores = np.zeros(num_matches, dtype=np.int64)
+
+        for _ in range(num_rounds):
+            states = own_code * window_states + opp_code
+            q_values = q_table[states]
+            actions = (q_values[:, PrisonersDilemma.COOPERATE] < q_values[:, PrisonersDilemma.CHEAT]).astype(np.int8)
+            explore = rng.random(num_matches) < q_agent.epsilon
+            actions[explore] = rng.integers(0, 2, size=int(explore.sum()), dtype=np.int8)
+
+            for policy in policies:
+                m = policy.matches
+                opponent_actions[m] = policy.act(opp_window[m], own_window[m], draws)
+            if env.noise: # Trembling hand: flip each played action with probability env.noise
+                actions ^= (rng.random(num_matches) < env.noise).astype(np.int8)
+                opponent_actions ^= (rng.random(num_matches) < env.noise).astype(np.int8)
+
+            rewards = payoffs[actions, opponent_actions, 0]
+            scores += rewards
+            for policy in policies:
+                m = policy.matches
+                policy.observe(opponent_actions[m], actions[m])
+
+            own_code = (own_code * 3 + actions + 1) % window_states
+            opp_code = (opp_code * 3 + opponent_actions + 1) % window_states
+            if memory_length:
+                own_window[:, :-1] = own_window[:, 1:]
+                own_window[:, -1] = actions
+                opp_window[:, :-1] = opp_window[:, 1:]
+                opp_window[:, -1] = opponent_actions
+
+            next_states = own_code * window_states + opp_code
+            targets = rewards + q_agent.gamma * q_table[next_states].max(axis=1)
+            q_agent.max_q_change = max(q_agent.max_q_change,
+                                       batch_td_update(q_table, states, actions, targets, q_agent.alpha))
+
+        first_episode = len(episode_scores)
+        episode_scores.extend(scores.tolist())
+        q_agent.episodes_trained += num_matches
+        if checkpoint_path and checkpoint_every and \
+                len(episode_scores) // checkpoint_every > first_episode // checkpoint_every:
+            q_agent.save(checkpoint_path)
+        if verbose and (first_episode == 0 or len(episode_scores) // report_every > first_episode // report_every):
+            print(f"Training Episode {len(episode_scores)}/{num_episodes}. "
+                  f"{q_agent.name} Avg Score (last {num_matches} episodes): {scores.mean():.2f}. "
+                  f"Avg Q-Score so far: {sum(episode_scores) / len(episode_scores):.2f}")
+            sys.stdout.flush()
+        if monitor is not None and monitor.due(len(episode_scores), first_episode) and \
+                monitor.check(q_agent, episode_scores, memory_length):
+            break
+
+    if monitor is not None:
+        monitor.finish(len(episode_scores), num_episodes)
+    if checkpoint_path:
+        q_agent.save(checkpoint_path)
+    return episode_scores
+
+
+def train_linear_agent_batched(agent: LinearQAgent, opponents: list, num_episodes: int, num_rounds: int,
+                               env: PrisonersDilemma, num_envs: int = 256, rng: np.random.Generator = None,
+                               verbose: bool = True) -> list:
+    """
+    Trains a LinearQAgent in num_envs environments at once, all sharing its weights, like
+    train_q_agent_batched does for Q-tables. The learner's features for every environment are one
+    LinearFeatures array; each round its actions come from one matrix product and the num_envs TD
+    updates are applied together by agent.learn_batch.
+    :param agent: The learner (its memory_length is its own, independent of env's).
+    :param opponents: Opponent templates; any agent the batch engine supports.
+    :param num_episodes: Total number of training matches.
+    :param num_rounds: Rounds per match.
+    :param env: The game environment (its memory_length sets the opponents' history window).
+    :param num_envs: Matches played in lockstep.
+    :param rng: numpy Generator for exploration and stochastic opponents.
+    :param verbose: Print progress about ten times during training.
+    :return: The learner's score in every episode, in episode order.
+    """
+    memory_length = env.memory_length
+    rng = rng if rng is not None else np.random.default_rng()
+    draws = GeneratorDraws(rng)
+    payoffs = env.PAYOFF_MATRIX
+    episode_scores = []
+    report_every = max(1, num_episodes // 10)
+
+    while len(episode_scores) < num_episodes:
+        num_matches = min(num_envs, num_episodes - len(episode_scores))
+        assignment = rng.integers(0, len(opponents), size=num_matches)
+        policies = [make_policy(opponents[o], np.flatnonzero(assignment == o), memory_length)
+                    for o in np.unique(assignment)]
+        features = LinearFeatures(agent.memory_length, num_matches, agent.streak_cap)
+
+        own_window = np.full((num_matches, memory_length), EMPTY, dtype=np.int8)
+        opp_window = np.full((num_matches, memory_length), EMPTY, dtype=np.int8)
+        opponent_actions = np.empty(num_matches, dtype=np.int8)
+        scores = np.zeros(num_matches, dtype=np.int64)
+
+        for _ in range(num_rounds):
+            states = features.X # push writes the next features to its other buffer: no copy needed
+            q_values = states @ agent.weights.T
+            actions = (q_values[:, PrisonersDilemma.COOPERATE] < q_values[:, PrisonersDilemma.CHEAT]).astype(np.int8)
+            explore = rng.random(num_matches) < agent.epsilon
+            actions[explore] = rng.integers(0, 2, size=int(explore.sum()), dtype=np.int8)
+
+            for policy in policies:
+                m = policy.matches
+                opponent_actions[m] = policy.act(opp_window[m], own_window[m], draws)
+            if env.noise: # Trembling hand: flip each played action with probability env.noise
+                actions ^= (rng.random(num_matches) < env.noise).astype(np.int8)
+                opponent_actions ^= (rng.random(num_matches) < env.noise).astype(np.int8)
+
+            rewards = payoffs[actions, opponent_actions, 0]
+            scores += rewards
+            for policy in policies:
+                m = policy.matches
+                policy.observe(opponent_actions[m], actions[m])
+            features.push(actions, opponent_actions)
+            if memory_length:
+                own_window[:, :-1] = own_window[:, 1:]
+                own_window[:, -1] = actions
+                opp_window[:, :-1] = opp_window[:, 1:]
+                opp_window[:, -1] = opponent_actions
+
+            agent.learn_batch(states, actions, rewards, features.X, q_values)
+
+        first_episode = len(episode_scores)
+        episode_scores.extend(scores.tolist())
+        agent.episodes_trained += num_matches
+        if verbose and (first_episode == 0 or len(episode_scores) // report_every > first_episode // report_every):
+            print(f"Training Episode {len(episode_scores)}/{num_episodes}. "
+                  f"{agent.name} Avg Score (last {num_matches} episodes): {scores.mean():.2f}. "
+                  f"Avg Q-Score so far: {sum(episode_scores) / len(episode_scores):.2f}")
+            sys.stdout.flush()
+    return episode_scores
+
+
+# Per-process state of train_q_agent_parallel, set up once by _init_trainer
+_trainer = {}
+
+def _attach_shared_table(name: str, shape: tuple, dtype: str):
+    # Pool workers share the parent's resource tracker, so attaching does not take over ownership:
+    # the block is unlinked once, by the parent
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+def _init_trainer(template: QLearningAgent, opponents: list, env: PrisonersDilemma, num_rounds: int,
+                  self_play: float, mode: str, table, slots):
+    """
+    :param table: The shared Q-table, as an array (same process) or (shm name, shape, dtype).
+    :param slots: For mode "average", each task's result table: array or (shm name, shape, dtype).
+    """
+    if not isinstance(table, np.ndarray):
+        shm, table = _attach_shared_table(*table)
+        _trainer["shm"] = [shm]
+        if slots is not None:
+            slots_shm, slots = _attach_shared_table(*slots)
+            _trainer["shm"].append(slots_shm)
+    learner = copy.copy(template)
+    # Hogwild: every process updates the shared table in place; average: each task trains a private copy
+    learner.q_table = table if mode == "hogwild" else table.copy()
+    partner = copy.copy(learner) # Self-play opponent, learning into the same table
+    partner.name = f"{learner.name} (self-play)"
+    kernels = [make_kernel(learner, copy.deepcopy(opponent), env, is_training=True, record="off") for opponent in opponents]
+    _trainer.update(table=table, slots=slots, learner=learner, env=env, mode=mode, num_rounds=num_rounds,
+                    self_play=self_play, kernels=kernels,
+                    self_play_kernel=make_kernel(learner, partner, env, is_training=True, record="off"))
+
+def _train_chunk(slot: int, num_episodes: int, seed) -> tuple:
+    """
+    Plays num_episodes training matches.
+    :return: (slot, process id, episode scores, seconds, largest Q-value update)
+    """
+    t = _trainer
+    learner, kernels, num_rounds, self_play = t["learner"], t["kernels"], t["num_rounds"], t["self_play"]
+    start = time.perf_counter()
+    learner.max_q_change = 0.0
+    if t["mode"] == "average":
+        learner.q_table[:] = t["table"]
+    chooser = np.random.default_rng(seed)
+    # Exploration, stochastic opponents and noise each get a stream derived from the chunk's seed. Without
+    # one they are reseeded from fresh entropy: every worker unpickled the same stream states, and would
+    # otherwise replay the same draws
+    def stream(*keys):
+        return derive_seed(seed, *keys) if seed is not None else None
+    seed_agent(learner, stream("learner")) # Shared with the self-play partner
+    for k, kernel in enumerate(kernels):
+        seed_agent(kernel.agent2, stream("opponent", k))
+    seed_agent(t["env"], stream("noise"))
+    scores = []
+    for _ in range(num_episodes):
+        if self_play and chooser.random() < self_play:
+            kernel = t["self_play_kernel"]
+        else:
+            kernel = kernels[chooser.integers(len(kernels))]
+        scores.append(kernel.play(num_rounds)[0])
+    if t["mode"] == "average":
+        t["slots"][slot] = learner.q_table
+    return slot, os.getpid(), scores, time.perf_counter() - start, learner.max_q_change
+
+
+def train_q_agent_parallel(q_agent: QLearningAgent, opponents: list, num_episodes: int, num_rounds: int,
+                           env: PrisonersDilemma, workers: int = None, self_play: float = 0.0, mode: str = "hogwild",
+                           sync_every: int = 100, seed: int = None, verbose: bool = True,
+                           checkpoint_path: str = None, checkpoint_every: int = 0,
+                           monitor: ConvergenceMonitor = None) -> tuple:
+    """
+    Trains a dense QLearningAgent with several processes playing episodes at once, all learning into
+    one Q-table held in shared memory (multiprocessing.shared_memory).
+    :param q_agent: The learner; must use the dense backend with env's memory_length. Its table holds
+                    the result when training ends. If it plans (planning_steps), each process learns
+                    its own model, and plans into the shared table.
+    :param opponents: Opponent templates (copied once per process); each episode picks one uniformly.
+    :param num_episodes: Total number of training matches, split evenly over the workers.
+    :param num_rounds: Rounds per match.
+    :param env: The game environment.
+    :param workers: Number of processes (default: all CPUs). 1 trains in this process, and with a
+                    seed the result is exactly reproducible.
+    :param self_play: Fraction of episodes played against the learner itself (both sides learn).
+    :param mode: "hogwild": lock-free in-place updates of the shared table; concurrent updates of the
+                 same entry may occasionally be lost, which Q-learning tolerates.
+                 "average": each worker trains a private copy for sync_every episodes, then the copies
+                 are averaged into the shared table.
+    :param sync_every: Episodes each worker plays between averaging steps (mode "average").
+    :param seed: Master seed (an int or an rng.derive_seed SeedSequence); every worker chunk derives its own seed from it.
+    :param verbose: Print progress and the per-worker throughput.
+    :param checkpoint_path: Where to save the agent during and after training.
+    :param checkpoint_every: Save a checkpoint about every this many episodes (0: only at the end).
+    :param monitor: Optional ConvergenceMonitor; work is then handed out in rounds of at most
+                    monitor.check_every episodes and training stops early when it says so.
+    :return: (episode_scores, worker_stats). episode_scores lists the learner's score in every
+             episode, chunk by chunk; worker_stats has one dict per process with its episodes,
+             rounds, seconds and episodes_per_sec.
+    """
+    memory_length = env.memory_length
+    if not q_agent.dense or q_agent.memory_length != memory_length:
+        raise ValueError("Parallel training needs a dense Q-table (QLearningAgent(memory_length=...)) "
+                         "matching the environment's memory length.")
+    if mode not in ("hogwild", "average"):
+        raise ValueError(f"Unknown mode {mode!r}; use 'hogwild' or 'average'.")
+    workers = workers or os.cpu_count() or 1
+    if mode == "average":
+        round_size = sync_every * workers
+    elif checkpoint_path and checkpoint_every:
+        round_size = checkpoint_every
+    else:
+        round_size = num_episodes
+    if monitor is not None:
+        round_size = min(round_size, monitor.check_every)
+    seeds = derive_seed(seed) if seed is not None else None
+
+    template = copy.copy(q_agent)
+    template.q_table = None # Sent to the workers without its table, which they attach to instead
+    table = np.ascontiguousarray(q_agent.q_table, dtype=np.float64)
+    shms = []
+    executor = None
+    start = time.perf_counter()
+    try:
+        if workers == 1:
+            slots = np.empty((1,) + table.shape) if mode == "average" else None
+            _init_trainer(template, opponents, env, num_rounds, self_play, mode, table, slots)
+        else:
+            shms.append(shared_memory.SharedMemory(create=True, size=table.nbytes))
+            shared = np.ndarray(table.shape, dtype=table.dtype, buffer=shms[0].buf)
+            shared[:] = table
+            table = shared
+            slots = slots_spec = None
+            if mode == "average":
+                shms.append(shared_memory.SharedMemory(create=True, size=table.nbytes * workers))
+                slots = np.ndarray((workers,) + table.shape, dtype=table.dtype, buffer=shms[1].buf)
+                slots_spec = (shms[1].name, slots.shape, slots.dtype.str)
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_trainer,
+                                           initargs=(template, opponents, env, num_rounds, self_play, mode,
+                                                     (shms[0].name, table.shape, table.dtype.str), slots_spec))
+
+        episode_scores = []
+        stats = {}
+        while len(episode_scores) < num_episodes:
+            episodes = min(round_size, num_episodes - len(episode_scores))
+            chunks = [episodes // workers + (k < episodes % workers) for k in range(workers)]
+            chunks = [(slot, n, int(seeds.spawn(1)[0].generate_state(1)[0]) if seeds is not None else None)
+                      for slot, n in enumerate(chunks) if n > 0]
+            if executor is None:
+                results = [_train_chunk(*chunk) for chunk in chunks]
+            else:
+                results = list(executor.map(_train_chunk, *zip(*chunks)))
+
+            for slot, pid, scores, seconds, max_q_change in results:
+                q_agent.max_q_change = max(q_agent.max_q_change, max_q_change)
+                episode_scores.extend(scores)
+                entry = stats.setdefault(pid, {"worker": len(stats), "episodes": 0, "rounds": 0, "seconds": 0.0})
+                entry["episodes"] += len(scores)
+                entry["rounds"] += len(scores) * num_rounds
+                entry["seconds"] += seconds
+            if mode == "average":
+                table[:] = slots[[result[0] for result in results]].mean(axis=0)
+            q_agent.episodes_trained += episodes
+
+            if checkpoint_path and checkpoint_every and len(episode_scores) < num_episodes and \
+                    len(episode_scores) // checkpoint_every > (len(episode_scores) - episodes) // checkpoint_every:
+                q_agent.q_table[:] = table
+                q_agent.save(checkpoint_path)
+            if verbose:
+                print(f"Training Episode {len(episode_scores)}/{num_episodes}. {q_agent.name} "
+                      f"Avg Score (last {episodes} episodes): {np.mean(episode_scores[-episodes:]):.2f}")
+                sys.stdout.flush()
+            if monitor is not None and monitor.due(len(episode_scores), len(episode_scores) - episodes):
+                q_agent.q_table[:] = table
+                if monitor.check(q_agent, episode_scores, memory_length):
+                    break
+
+        q_agent.q_table[:] = table
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        _trainer.clear()
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    if monitor is not None:
+        monitor.finish(len(episode_scores), num_episodes)
+    if checkpoint_path:
+        q_agent.save(checkpoint_path)
+    worker_stats = []
+    for entry in stats.values():
+        entry["episodes_per_sec"] = entry["episodes"] / entry["seconds"] if entry["seconds"] else 0.0
+        worker_stats.append(entry)
+    if verbose:
+        for entry in worker_stats:
+            print(f"  Worker {entry['worker']}: {entry['episodes']} episodes, "
+                  f"{entry['episodes_per_sec']:.0f} episodes/s ({entry['rounds'] / max(entry['seconds'], 1e-9):.0f} rounds/s)")
+        print(f"  Total: {num_episodes / (time.perf_counter() - start):.0f} episodes/s with {workers} worker(s)")
+    return episode_scores, worker_stats
+
+
+# Example Usage (serial vs batched training speed)
+if __name__ == "__main__":
+    import random
+    import time
+    from classic_strategies import TitForTat, AlwaysCheat, AlwaysCooperate, RandomStrategy, Grudger, Pavlov
+    from markov_eval import expected_scores
+    from main import run_match
+
+    env = PrisonersDilemma(memory_length=1)
+    opponents = [TitForTat(), AlwaysCheat(), AlwaysCooperate(), RandomStrategy(), Grudger(), Pavlov()]
+    episodes = 2000
+
+    serial_agent = QLearningAgent(epsilon=0.2, memory_length=1)
+    start = time.perf_counter()
+    for _ in range(episodes):
+        run_match(serial_agent, type(random.choice(opponents))(), 50, env, is_training=True, record="off")
+    serial_time = time.perf_counter() - start
+
+    batched_agent = QLearningAgent(epsilon=0.2, memory_length=1)
+    start = time.perf_counter()
+    train_q_agent_batched(batched_agent, opponents, episodes, 50, env, num_envs=500, verbose=False)
+    batched_time = time.perf_counter() - start
+
+    print(f"Serial: {episodes / serial_time:.0f} episodes/s, batched: {episodes / batched_time:.0f} episodes/s")
+    for agent in (serial_agent, batched_agent):
+        agent.epsilon = 0.0
+        greedy_scores = [expected_scores(agent, opponent, 50, env)[0] for opponent in opponents]
+        print(f"Greedy policy average score vs training opponents: {np.mean(greedy_scores):.2f}")
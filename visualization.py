@@ -1,47 +1,218 @@
 # visualization.py
 
-import matplotlib.pyplot as plt
 import numpy as np
 
-def plot_scores(results: dict, num_episodes: int, total_rounds: int, title: str = "Agent Scores Over Training"):
+# Matplotlib is imported by the plot functions only, so SeriesDecimator (used while training) costs no import time
+
+
+class SeriesDecimator:
+    """
+    Streaming min/max/mean summary of a long series (e.g. one score per training episode), kept
+    in fewer than max_points buckets of `width` consecutive values. When the buckets run out,
+    neighbours are merged in pairs and the width doubles, so memory and plotting time stay bounded
+    however many values are added. Feed it as the values arrive (add / extend).
     """
-    Plots the cumulative scores for each agent.
-    :param results: A dictionary where keys are agent names and values are lists of cumulative scores.
+    def __init__(self, max_points: int = 2000):
+        if max_points < 2:
+            raise ValueError("max_points must be at least 2.")
+        self.max_points = max_points
+        self.width = 1
+        self.count = 0 # Values added so far
+        self._mins = np.empty(0)
+        self._maxs = np.empty(0)
+        self._sums = np.empty(0)
+        # The bucket being filled: number of values, sum, min, max
+        self._partial_count = 0
+        self._partial_sum = self._partial_min = self._partial_max = 0.0
+
+    def add(self, value: float):
+        value = float(value)
+        if self._partial_count:
+            self._partial_sum += value
+            self._partial_min = min(self._partial_min, value)
+            self._partial_max = max(self._partial_max, value)
+        else:
+            self._partial_sum = self._partial_min = self._partial_max = value
+        self._partial_count += 1
+        self.count += 1
+        if self._partial_count == self.width:
+            self._push_partial()
+
+    def extend(self, values):
+        """Adds many values at once (vectorized: whole buckets are reduced with NumPy)."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.count += len(values)
+        while len(values):
+            if self._partial_count or len(values) < self.width:
+                take = min(len(values), self.width - self._partial_count)
+                self._fold(len(values[:take]), values[:take].sum(), values[:take].min(), values[:take].max())
+                values = values[take:]
+                if self._partial_count == self.width:
+                    self._push_partial()
+                continue
+            num_buckets = len(values) // self.width
+            buckets = values[:num_buckets * self.width].reshape(num_buckets, self.width)
+            values = values[num_buckets * self.width:]
+            self._push(buckets.min(axis=1), buckets.max(axis=1), buckets.sum(axis=1))
+
+    def _fold(self, count, total, low, high):
+        if self._partial_count:
+            self._partial_sum += total
+            self._partial_min = min(self._partial_min, low)
+            self._partial_max = max(self._partial_max, high)
+        else:
+            self._partial_sum, self._partial_min, self._partial_max = total, low, high
+        self._partial_count += count
+
+    def _push_partial(self):
+        mins, maxs, sums = [self._partial_min], [self._partial_max], [self._partial_sum]
+        self._partial_count = 0
+        self._push(mins, maxs, sums)
+
+    def _push(self, mins, maxs, sums):
+        self._mins = np.concatenate((self._mins, mins))
+        self._maxs = np.concatenate((self._maxs, maxs))
+        self._sums = np.concatenate((self._sums, sums))
+        while len(self._mins) >= self.max_points:
+            if len(self._mins) % 2: # The odd bucket out goes back to the (wider) bucket being filled
+                partial = (self._partial_count, self._partial_sum, self._partial_min, self._partial_max)
+                self._partial_count = 0
+                self._fold(self.width, self._sums[-1], self._mins[-1], self._maxs[-1])
+                if partial[0]:
+                    self._fold(*partial)
+                self._mins, self._maxs, self._sums = self._mins[:-1], self._maxs[:-1], self._sums[:-1]
+            self._mins = self._mins.reshape(-1, 2).min(axis=1)
+            self._maxs = self._maxs.reshape(-1, 2).max(axis=1)
+            self._sums = self._sums.reshape(-1, 2).sum(axis=1)
+            self.width *= 2
+
+    def points(self) -> tuple:
+        """
+        :return: (x, mins, maxs, means), one entry per bucket (the one being filled included),
+                 x being the bucket's middle position in the series, counted from 1.
+        """
+        counts = np.full(len(self._mins), float(self.width))
+        x = np.arange(len(self._mins)) * self.width + (self.width + 1) / 2
+        mins, maxs, sums = self._mins, self._maxs, self._sums
+        if self._partial_count:
+            start = len(self._mins) * self.width
+            x = np.append(x, start + (self._partial_count + 1) / 2)
+            counts = np.append(counts, self._partial_count)
+            mins = np.append(mins, self._partial_min)
+            maxs = np.append(maxs, self._partial_max)
+            sums = np.append(sums, self._partial_sum)
+        return x, mins, maxs, sums / np.maximum(counts, 1)
+
+
+def _new_figure(figsize: tuple, path: str):
+    """A pyplot figure to show, or, when writing to `path`, a standalone one rendered by Agg (no GUI)."""
+    if path:
+        from matplotlib.figure import Figure
+        return Figure(figsize=figsize)
+    import matplotlib.pyplot as plt
+    return plt.figure(figsize=figsize)
+
+
+def _finish(fig, path: str):
+    """Saves the figure to `path` (format from its extension, e.g. .png or .svg) or shows it."""
+    fig.tight_layout()
+    if path:
+        fig.savefig(path)
+    else:
+        import matplotlib.pyplot as plt
+        plt.show()
+
+
+def plot_scores(results: dict, num_episodes: int, total_rounds: int, title: str = "Agent Scores Over Training",
+                path: str = None, max_points: int = 2000):
+    """
+    Plots the scores of each agent over training. Long series are decimated: each plotted point
+    is the mean of a bucket of episodes, drawn inside the band of that bucket's min and max.
+    :param results: A dictionary where keys are agent names and values are lists of episode scores
+                    (or SeriesDecimator summaries of them, built while training).
     :param num_episodes: Total number of training episodes/matches.
     :param total_rounds: Number of rounds per match.
     :param title: Title of the plot.
+    :param path: Write the plot to this file (PNG, SVG, ...) instead of showing it.
+    :param max_points: Most points plotted per agent.
     """
-    plt.figure(figsize=(12, 7))
+    fig = _new_figure((12, 7), path)
+    ax = fig.add_subplot()
     for agent_name, scores_history in results.items():
-        # Ensure scores_history is a list of episode-end cumulative scores
-        plt.plot(range(1, num_episodes + 1), scores_history, label=agent_name)
+        if not isinstance(scores_history, SeriesDecimator):
+            series = SeriesDecimator(max_points)
+            series.extend(scores_history)
+            scores_history = series
+        x, mins, maxs, means = scores_history.points()
+        line, = ax.plot(x, means, label=agent_name)
+        if scores_history.width > 1:
+            ax.fill_between(x, mins, maxs, color=line.get_color(), alpha=0.2, linewidth=0)
 
-    plt.title(title)
-    plt.xlabel("Training Episode (Match Number)")
-    plt.ylabel(f"Cumulative Score (over {total_rounds} rounds)")
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
+    ax.set_title(title)
+    ax.set_xlim(1, max(1, num_episodes))
+    ax.set_xlabel("Training Episode (Match Number)")
+    ax.set_ylabel(f"Cumulative Score (over {total_rounds} rounds)")
+    ax.legend()
+    ax.grid(True)
+    _finish(fig, path)
 
-def plot_single_match_scores(agent1_name: str, agent2_name: str, scores1: list, scores2: list, total_rounds: int):
+def plot_single_match_scores(agent1_name: str, agent2_name: str, scores1: list, scores2: list, total_rounds: int,
+                             path: str = None, max_points: int = 2000):
     """
     Plots the cumulative scores of two agents in a single match over rounds.
     :param agent1_name: Name of agent 1.
     :param agent2_name: Name of agent 2.
-    :param scores1: List of cumulative scores for agent 1 per round.
-    :param scores2: List of cumulative scores for agent 2 per round.
+    :param scores1: Agent 1's score in each round (list or array).
+    :param scores2: Agent 2's score in each round (list or array).
     :param total_rounds: Total rounds played in the match.
+    :param path: Write the plot to this file (PNG, SVG, ...) instead of showing it.
+    :param max_points: Most points plotted per agent (cumulative scores only grow, so every
+                       k-th round is enough).
+    """
+    rounds = np.arange(1, total_rounds + 1)
+    step = max(1, -(-total_rounds // max_points))
+    keep = np.r_[np.arange(0, total_rounds, step), total_rounds - 1] if total_rounds else np.arange(0)
+    fig = _new_figure((10, 6), path)
+    ax = fig.add_subplot()
+    ax.plot(rounds[keep], np.cumsum(scores1, dtype=np.int64)[keep], label=agent1_name)
+    ax.plot(rounds[keep], np.cumsum(scores2, dtype=np.int64)[keep], label=agent2_name)
+
+    ax.set_title(f"Cumulative Scores: {agent1_name} vs {agent2_name} (Single Match)")
+    ax.set_xlabel("Round Number")
+    ax.set_ylabel("Cumulative Score")
+    ax.legend()
+    ax.grid(True)
+    _finish(fig, path)
+
+def plot_pairwise_heatmap(scores, title: str = "Pairwise Average Scores (Rows play against Columns)",
+                          ci=None, path: str = None):
+    """
+    Plots the tournament's pairwise scores as a heatmap.
+    :param scores: DataFrame of average scores, rows playing against columns (as main builds
+                   from run_tournament); NaN cells (the diagonal) are left blank.
+    :param title: Title of the plot.
+    :param ci: Optional DataFrame of the confidence interval half-widths, shown in the cells.
+    :param path: Write the plot to this file (PNG, SVG, ...) instead of showing it.
     """
-    rounds = list(range(1, total_rounds + 1))
-    plt.figure(figsize=(10, 6))
-    plt.plot(rounds, np.cumsum(scores1), label=agent1_name)
-    plt.plot(rounds, np.cumsum(scores2), label=agent2_name)
-
-    plt.title(f"Cumulative Scores: {agent1_name} vs {agent2_name} (Single Match)")
-    plt.xlabel("Round Number")
-    plt.ylabel("Cumulative Score")
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    values = scores.to_numpy(dtype=np.float64)
+    size = len(scores.columns)
+    fig = _new_figure((max(6, 0.9 * size + 3), max(5, 0.7 * size + 2)), path)
+    ax = fig.add_subplot()
+    image = ax.imshow(np.ma.masked_invalid(values), cmap="viridis")
+    fig.colorbar(image, ax=ax, label="Average score")
+    ax.set_xticks(range(size), labels=scores.columns, rotation=45, ha="right")
+    ax.set_yticks(range(len(scores.index)), labels=scores.index)
+    if size <= 20: # Beyond that the numbers no longer fit in the cells
+        half_widths = ci.reindex(index=scores.index, columns=scores.columns).to_numpy(dtype=np.float64) \
+            if ci is not None else None
+        midpoint = np.nanmean(values) if np.isfinite(values).any() else 0.0
+        for (i, j), value in np.ndenumerate(values):
+            if np.isnan(value):
+                continue
+            text = f"{value:.1f}"
+            if half_widths is not None and half_widths[i, j] > 0:
+                text += f"\n±{half_widths[i, j]:.1f}"
+            ax.text(j, i, text, ha="center", va="center", fontsize=8,
+                    color="black" if value > midpoint else "white")
+    ax.set_title(title)
+    _finish(fig, path)